@@ -0,0 +1,136 @@
+import time
+import threading
+import numpy as np
+import faiss
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, FrozenSet, Iterable, Optional, Set
+from app.indexes import row_id_of
+
+
+@dataclass
+class AnswerEntry:
+    context_ids: FrozenSet[int]
+    answer: str
+    expires: float
+
+
+class SemanticAnswerCache:
+    """
+    Семантический кэш сгенерированных LLM ответов.
+
+    Запись находится по близости эмбеддинга вопроса (отдельный маленький
+    FAISS IndexFlatIP, косинус не ниже threshold) и принимается, только если
+    набор чанков контекста совпадает. Правка строки БЗ удаляет все записи,
+    построенные на её чанках. Размер ограничен maxsize (вытеснение LRU).
+    """
+
+    # Сколько ближайших соседей проверять на совпадение контекста
+    NEIGHBOURS = 8
+
+    def __init__(self, maxsize: int, threshold: float = 0.95, ttl: float = 86400):
+        self.maxsize = maxsize
+        self.threshold = threshold
+        self.ttl = ttl
+        self.index = None
+        self.entries: "OrderedDict[int, AnswerEntry]" = OrderedDict()
+        self.by_row: Dict[int, Set[int]] = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    @staticmethod
+    def _prepare(vector) -> np.ndarray:
+        query = np.array(vector, dtype=np.float32).reshape(1, -1)
+        faiss.normalize_L2(query)
+        return query
+
+    def _remove(self, entry_id: int):
+        entry = self.entries.pop(entry_id)
+        self.index.remove_ids(np.array([entry_id], dtype=np.int64))
+        for row_id in {row_id_of(chunk_id) for chunk_id in entry.context_ids}:
+            ids = self.by_row.get(row_id)
+            if ids is not None:
+                ids.discard(entry_id)
+                if not ids:
+                    del self.by_row[row_id]
+
+    def get(self, vector, context_ids: Iterable[int]) -> Optional[str]:
+        if self.maxsize <= 0:
+            return None
+        context = frozenset(context_ids)
+        query = self._prepare(vector)
+        with self._lock:
+            if self.index is None or not self.entries:
+                self.misses += 1
+                return None
+            scores, ids = self.index.search(query, min(self.NEIGHBOURS, len(self.entries)))
+            now = time.monotonic()
+            for score, entry_id in zip(scores[0], ids[0]):
+                if entry_id == -1 or score < self.threshold:
+                    break
+                entry = self.entries[int(entry_id)]
+                if entry.expires < now:
+                    self._remove(int(entry_id))
+                    continue
+                if entry.context_ids == context:
+                    self.entries.move_to_end(int(entry_id))
+                    self.hits += 1
+                    return entry.answer
+            self.misses += 1
+            return None
+
+    def set(self, vector, context_ids: Iterable[int], answer: str):
+        if self.maxsize <= 0:
+            return
+        context = frozenset(context_ids)
+        query = self._prepare(vector)
+        with self._lock:
+            if self.index is None:
+                self.index = faiss.IndexIDMap2(faiss.IndexFlatIP(query.shape[1]))
+            entry_id = self._next_id
+            self._next_id += 1
+            self.index.add_with_ids(query, np.array([entry_id], dtype=np.int64))
+            self.entries[entry_id] = AnswerEntry(context, answer, time.monotonic() + self.ttl)
+            for row_id in {row_id_of(chunk_id) for chunk_id in context}:
+                self.by_row.setdefault(row_id, set()).add(entry_id)
+            while len(self.entries) > self.maxsize:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def invalidate_rows(self, row_ids: Iterable[int]) -> int:
+        """Удаляет ответы, в контексте которых были чанки этих строк БЗ"""
+        with self._lock:
+            stale = set()
+            for row_id in row_ids:
+                stale.update(self.by_row.get(row_id, ()))
+            for entry_id in stale:
+                self._remove(entry_id)
+            self.invalidations += len(stale)
+            return len(stale)
+
+    def clear(self):
+        with self._lock:
+            self.index = None
+            self.entries.clear()
+            self.by_row.clear()
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "maxsize": self.maxsize,
+            "threshold": self.threshold,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
@@ -1,8 +1,12 @@
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
+from sqlalchemy.ext.asyncio import AsyncSession, AsyncEngine, create_async_engine, async_sessionmaker
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
-from sqlalchemy import String, DateTime, Text
+from sqlalchemy import String, DateTime, Text, Index, Float, Integer, event, inspect, text
+from sqlalchemy.engine import URL, make_url
 from datetime import datetime
+from pathlib import Path
 import secrets
+from app.config import settings
+from app.metrics import instrument_engine
 
 
 class Base(DeclarativeBase):
@@ -22,6 +26,19 @@ class FeedbackItem(Base):
     suggested_by: Mapped[str] = mapped_column(String(255), nullable=True)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
     resolved_at: Mapped[datetime] = mapped_column(DateTime, nullable=True)
+    # Сколько раз операторы прислали ту же правку (вопрос + исправленный ответ)
+    votes: Mapped[int] = mapped_column(Integer, default=1, server_default="1")
+    # sha256 (вопрос, исправленный ответ) - см. FeedbackWriter.dedup_key
+    dedup_key: Mapped[str] = mapped_column(String(64), nullable=True)
+    
+    # Очередь модерации: WHERE status = ... ORDER BY created_at, id - keyset по индексу.
+    # На модерации не больше одной правки с тем же dedup_key: повторы от всех
+    # воркеров становятся её голосами
+    __table_args__ = (
+        Index("ix_feedback_items_status_created", "status", "created_at", "id"),
+        Index("ix_feedback_items_pending_dedup", "dedup_key", unique=True,
+              sqlite_where=text("status = 'pending'"), postgresql_where=text("status = 'pending'")),
+    )
 
 
 class QAQueue(Base):
@@ -35,15 +52,108 @@ class QAQueue(Base):
     subtopic: Mapped[str] = mapped_column(String(255), nullable=True)
     status: Mapped[str] = mapped_column(String(50), default="pending")
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    resolved_at: Mapped[datetime] = mapped_column(DateTime, nullable=True)
+    
+    __table_args__ = (
+        Index("ix_qa_queue_status_created", "status", "created_at", "id"),
+    )
+
+
+class ModerationCounter(Base):
+    """
+    Счётчики модерации, которые обновляются в той же транзакции, что и правки:
+    feedback:<status>, qa:<approved|rejected>, resolution:count, resolution:seconds,
+    operator:<имя>:<событие>
+    """
+    __tablename__ = "moderation_counters"
+    
+    name: Mapped[str] = mapped_column(String(255), primary_key=True)
+    value: Mapped[float] = mapped_column(Float, default=0)
+
+
+# Асинхронные драйверы по умолчанию для URL без явного драйвера
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+}
+
+ALEMBIC_INI = Path(__file__).resolve().parent.parent / "alembic.ini"
+
+# Ревизия, соответствующая схеме баз, созданных через create_all до Alembic
+BASELINE_REVISION = "0001"
+
+# Ключ pg_advisory_xact_lock: реплики применяют миграции по очереди
+MIGRATION_LOCK_KEY = 0x7261675f6462
 
 
-engine = create_async_engine("sqlite+aiosqlite:////home/kate/T1-hackathon/backend/data/feedback.db")
+def database_url() -> URL:
+    url = make_url(settings.DATABASE_URL)
+    return url.set(drivername=ASYNC_DRIVERS.get(url.drivername, url.drivername))
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA journal_mode={settings.SQLITE_JOURNAL_MODE}")
+    cursor.execute(f"PRAGMA synchronous={settings.SQLITE_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA busy_timeout={int(settings.SQLITE_BUSY_TIMEOUT_MS)}")
+    cursor.execute(f"PRAGMA mmap_size={int(settings.SQLITE_MMAP_SIZE)}")
+    cursor.close()
+
+
+def create_engine() -> AsyncEngine:
+    """
+    Движок по DATABASE_URL.
+
+    SQLite: WAL (чтения модераторов не блокируются записью правок), busy_timeout
+    вместо мгновенного "database is locked", mmap для чтения. PostgreSQL: пул
+    соединений с pre-ping, чтобы реплики переживали рестарт базы.
+    """
+    url = database_url()
+    if url.get_backend_name() == "sqlite":
+        if url.database and url.database != ":memory:":
+            Path(url.database).parent.mkdir(parents=True, exist_ok=True)
+        engine = create_async_engine(
+            url, connect_args={'timeout': settings.SQLITE_BUSY_TIMEOUT_MS / 1000}
+        )
+        event.listen(engine.sync_engine, "connect", _set_sqlite_pragmas)
+    else:
+        engine = create_async_engine(
+            url,
+            pool_size=settings.DB_POOL_SIZE,
+            max_overflow=settings.DB_MAX_OVERFLOW,
+            pool_timeout=settings.DB_POOL_TIMEOUT_SECONDS,
+            pool_recycle=settings.DB_POOL_RECYCLE_SECONDS,
+            pool_pre_ping=settings.DB_POOL_PRE_PING,
+        )
+    instrument_engine(engine.sync_engine)
+    return engine
+
+
+engine = create_engine()
 async_session_maker = async_sessionmaker(engine, expire_on_commit=False)
 
 
+def _upgrade(connection):
+    from alembic import command
+    from alembic.config import Config
+
+    config = Config(str(ALEMBIC_INI))
+    config.attributes['connection'] = connection
+    tables = inspect(connection).get_table_names()
+    if "alembic_version" not in tables and "feedback_items" in tables:
+        # База создана через create_all: схема уже есть, фиксируем исходную ревизию
+        command.stamp(config, BASELINE_REVISION)
+    command.upgrade(config, "head")
+
+
 async def init_db():
+    """Применяет миграции Alembic до head (при DB_AUTO_MIGRATE)"""
+    if not settings.DB_AUTO_MIGRATE:
+        return
     async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+        if conn.dialect.name == "postgresql":
+            await conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {'key': MIGRATION_LOCK_KEY})
+        await conn.run_sync(_upgrade)
 
 
 async def get_session() -> AsyncSession:
@@ -0,0 +1,111 @@
+import sqlite3
+import hashlib
+import threading
+import numpy as np
+from typing import List, Optional, Dict
+
+
+class EmbeddingCache:
+    """
+    Персистентный кэш эмбеддингов, адресуемый по содержимому.
+
+    Ключ - (модель, sha256 текста чанка), значение - вектор в компактном
+    float16/float32 представлении. Хранится в SQLite, поэтому переживает
+    перезапуски и переиспользуется всеми пересборками индекса.
+    """
+
+    # Ограничение SQLite на число параметров в одном запросе
+    _LOOKUP_BATCH = 500
+
+    def __init__(self, path: str, dtype: str = "float16"):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                dtype TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                PRIMARY KEY (model, text_hash)
+            ) WITHOUT ROWID
+        """)
+        self.conn.commit()
+        # Число записей считается один раз при открытии, дальше - по вставкам
+        # этого процесса (записи других воркеров видны после перезапуска)
+        self.entries = self.conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    @staticmethod
+    def text_hash(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def get_many(self, model: str, texts: List[str]) -> List[Optional[List[float]]]:
+        """Возвращает векторы в порядке texts; None для промахов"""
+        hashes = [self.text_hash(t) for t in texts]
+        found: Dict[str, List[float]] = {}
+
+        with self._lock:
+            for i in range(0, len(hashes), self._LOOKUP_BATCH):
+                batch = list(set(hashes[i:i + self._LOOKUP_BATCH]))
+                placeholders = ",".join("?" * len(batch))
+                rows = self.conn.execute(
+                    f"SELECT text_hash, dtype, vector FROM embeddings "
+                    f"WHERE model = ? AND text_hash IN ({placeholders})",
+                    [model, *batch]
+                ).fetchall()
+                for text_hash, dtype, blob in rows:
+                    found[text_hash] = np.frombuffer(blob, dtype=dtype).astype(np.float32).tolist()
+
+            result = [found.get(h) for h in hashes]
+            hit_count = sum(1 for v in result if v is not None)
+            self.hits += hit_count
+            self.misses += len(result) - hit_count
+
+        return result
+
+    def put_many(self, model: str, texts: List[str], vectors: List[List[float]]):
+        rows = [
+            (model, self.text_hash(text), self.dtype.name,
+             np.asarray(vec, dtype=self.dtype).tobytes())
+            for text, vec in zip(texts, vectors)
+        ]
+        with self._lock:
+            added = self.conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (model, text_hash, dtype, vector) VALUES (?, ?, ?, ?)",
+                rows
+            ).rowcount
+            if added < len(rows):
+                # Часть ключей уже была в кэше - перезаписываем их векторы
+                self.conn.executemany(
+                    "UPDATE embeddings SET dtype = ?, vector = ? WHERE model = ? AND text_hash = ?",
+                    [(dtype, vector, model, text_hash) for model, text_hash, dtype, vector in rows]
+                )
+            self.conn.commit()
+            self.entries += added
+
+    def vectors(self, model: str) -> np.ndarray:
+        """Все векторы модели одной матрицей float32 (корпус для бенчмарка индексов)"""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT dtype, vector FROM embeddings WHERE model = ?", (model,)
+            ).fetchall()
+        if not rows:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.vstack([np.frombuffer(blob, dtype=dtype) for dtype, blob in rows]).astype(np.float32)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "entries": self.entries,
+                "dtype": self.dtype.name,
+            }
@@ -1,33 +1,149 @@
+import asyncio
+import time
+import httpx
 import requests
 from langchain.embeddings.base import Embeddings
 from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+from app.embedding_cache import EmbeddingCache
+from app.metrics import EMBEDDING_BATCH_SIZE, EMBEDDING_IN_FLIGHT, EMBEDDING_REQUEST_SECONDS
+from app import tracing
+
+
+class QueryBatcher:
+    """
+    Склеивает конкурентные запросы эмбеддингов в один батч.
+
+    Первый запрос открывает окно window секунд; всё, что пришло за это
+    время (но не больше max_batch), уходит одним POST /embeddings.
+    """
+
+    def __init__(self, post: Callable[[List[str]], Awaitable[List[List[float]]]],
+                 window: float = 0.005, max_batch: int = 64):
+        self._post = post
+        self.window = window
+        self.max_batch = max_batch
+        # (текст, future, тайминги батча: начало/конец HTTP-запроса и размер)
+        self._pending: List[Tuple[str, asyncio.Future, Dict]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def submit(self, text: str) -> List[float]:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        timing: Dict = {}
+        queued = time.perf_counter()
+        self._pending.append((text, future, timing))
+
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+
+        try:
+            return await future
+        finally:
+            if tracing.active() and 'http_start' in timing:
+                tracing.record("queue", queued, timing['http_start'])
+                tracing.record("http", timing['http_start'], timing['http_end'],
+                               batch_size=timing['batch_size'])
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.create_task(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: List[Tuple[str, asyncio.Future, Dict]]):
+        texts = list(dict.fromkeys(text for text, _, _ in batch))
+        start = time.perf_counter()
+        try:
+            vectors = dict(zip(texts, await self._post(texts)))
+        except Exception as e:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            end = time.perf_counter()
+            for _, _, timing in batch:
+                timing.update(http_start=start, http_end=end, batch_size=len(texts))
+
+        for text, future, _ in batch:
+            if not future.done():
+                future.set_result(vectors[text])
 
 
 class BGEM3Embeddings(Embeddings):
     def __init__(self, api_key: str, base_url: str = "https://llm.t1v.scibox.tech/v1",
-                 model: str = "bge-m3", batch_size: int = 64, max_workers: int = 8, timeout: int = 120):
+                 model: str = "bge-m3", batch_size: int = 64, max_workers: int = 8, timeout: int = 120,
+                 cache: Optional[EmbeddingCache] = None, query_batch_window_ms: float = 5.0,
+                 max_query_batch: int = 64, max_connections: int = 32):
         self.api_key = api_key
         self.base_url = base_url.rstrip("/") + "/embeddings"
         self.model = model
         self.batch_size = batch_size
         self.max_workers = max_workers
         self.timeout = timeout
-        self.session = requests.Session()
-        self.session.headers.update({
+        self.cache = cache
+        self.max_connections = max_connections
+        self.headers = {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json",
             "Accept-Encoding": "gzip, deflate"
-        })
+        }
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        self._async_client: Optional[httpx.AsyncClient] = None
+        self.query_batcher = QueryBatcher(
+            self._apost_batch,
+            window=query_batch_window_ms / 1000,
+            max_batch=max_query_batch
+        )
 
     def _post_batch(self, texts):
         payload = {"model": self.model, "input": texts}
-        resp = self.session.post(self.base_url, json=payload, timeout=self.timeout)
+        EMBEDDING_BATCH_SIZE.labels(mode="sync").observe(len(texts))
+        with EMBEDDING_IN_FLIGHT.labels(mode="sync").track_inprogress(), \
+                EMBEDDING_REQUEST_SECONDS.labels(mode="sync").time():
+            resp = self.session.post(self.base_url, json=payload, timeout=self.timeout)
+        resp.raise_for_status()
+        data = resp.json()
+        return [d["embedding"] for d in data["data"]]
+
+    def _get_async_client(self) -> httpx.AsyncClient:
+        # Один клиент на процесс: пул соединений с keep-alive переиспользуется всеми запросами
+        if self._async_client is None:
+            self._async_client = httpx.AsyncClient(
+                headers=self.headers,
+                timeout=self.timeout,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections
+                )
+            )
+        return self._async_client
+
+    async def _apost_batch(self, texts):
+        payload = {"model": self.model, "input": texts}
+        EMBEDDING_BATCH_SIZE.labels(mode="async").observe(len(texts))
+        with EMBEDDING_IN_FLIGHT.labels(mode="async").track_inprogress(), \
+                EMBEDDING_REQUEST_SECONDS.labels(mode="async").time():
+            resp = await self._get_async_client().post(self.base_url, json=payload)
         resp.raise_for_status()
         data = resp.json()
         return [d["embedding"] for d in data["data"]]
 
     def _embed(self, texts):
         batches = [texts[i:i+self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        if len(batches) == 1:
+            return self._post_batch(batches[0])
+
         embeddings = [None] * len(batches)
 
         with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
@@ -39,9 +155,26 @@ class BGEM3Embeddings(Embeddings):
         return [vec for batch in embeddings for vec in batch]
 
     def embed_documents(self, texts):
-        return self._embed(texts)
+        if self.cache is None:
+            return self._embed(texts)
+
+        # В API уходят только промахи кэша, уникальные по тексту
+        embeddings = self.cache.get_many(self.model, texts)
+        missing = list(dict.fromkeys(t for t, vec in zip(texts, embeddings) if vec is None))
+        if missing:
+            computed = dict(zip(missing, self._embed(missing)))
+            self.cache.put_many(self.model, missing, [computed[t] for t in missing])
+            embeddings = [vec if vec is not None else computed[t] for t, vec in zip(texts, embeddings)]
+
+        return embeddings
 
     def embed_query(self, text):
-        return self._embed([text])[0]
+        return self._post_batch([text])[0]
 
+    async def aembed_query(self, text):
+        return await self.query_batcher.submit(text)
 
+    async def aclose(self):
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
@@ -0,0 +1,425 @@
+import os
+import json
+import time
+import hashlib
+import asyncio
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+from sqlalchemy import insert, select, update
+from app.config import settings
+from app.database import FeedbackItem, async_session_maker, generate_token
+from app.metrics import FEEDBACK_FLUSH_SIZE, FEEDBACK_QUEUE_DEPTH, FEEDBACK_SUBMISSIONS
+from app import moderation
+
+
+class FeedbackQueueFull(Exception):
+    """Буфер правок заполнен и не освободился за время ожидания"""
+
+
+@dataclass
+class PendingFeedback:
+    internal_token: str
+    original_question: str
+    old_answer: str
+    edited_answer: str
+    note: Optional[str]
+    suggested_by: Optional[str]
+    created_at: datetime
+    votes: int = 1
+
+
+class FeedbackWriter:
+    """
+    Write-behind очередь правок операторов.
+
+    submit() сразу возвращает internal_token, а фоновая задача пишет накопленные
+    правки одним INSERT (и одной транзакцией со счётчиками модерации) раз в
+    flush_interval секунд или при flush_max_items записях. Одинаковые
+    (вопрос, исправленный ответ) в пределах collapse_window схлопываются в одну
+    правку: повторы увеличивают votes. Голоса не меняют счётчики модерации -
+    те считают правки, а не отправки. Голос засчитывается только правке на
+    модерации (pending): если её уже приняли или отклонили, повтор
+    записывается новой правкой.
+
+    Окно схлопывания у каждого воркера своё; между воркерами правки сводит
+    база: на модерации не больше одной правки с тем же dedup_key, и запись
+    новой правки, которая уже есть в базе, прибавляет ей голоса. Токен,
+    выданный такому повтору, в базе не появляется - модератор видит правку
+    под токеном первой.
+
+    При остановке close() дописывает буфер в базу; если база недоступна,
+    буфер и голоса сохраняются в spill_path и загружаются при следующем старте.
+    Правки, принятые за последние flush_interval секунд до аварийного
+    завершения процесса (SIGKILL), теряются - цена ответа без fsync.
+    """
+
+    # Попытки записи при остановке, прежде чем сохранить буфер в файл
+    DRAIN_ATTEMPTS = 5
+    MAX_BACKOFF_SECONDS = 5.0
+
+    def __init__(self, session_maker, flush_interval: float = 0.02, flush_max_items: int = 500,
+                 max_items: int = 10000, enqueue_timeout: float = 2.0,
+                 collapse_window: float = 300, spill_path: Optional[str] = None):
+        self._session_maker = session_maker
+        self.flush_interval = flush_interval
+        self.flush_max_items = flush_max_items
+        self.max_items = max_items
+        self.enqueue_timeout = enqueue_timeout
+        self.collapse_window = collapse_window
+        self.spill_path = spill_path
+        # Новые правки, ещё не записанные в базу
+        self._buffer: "OrderedDict[Tuple[str, str], PendingFeedback]" = OrderedDict()
+        # Дополнительные голоса за правки, которые уже записаны (или пишутся):
+        # токен -> первая из повторных отправок, votes - сколько их. Если правка
+        # уже не pending, эта отправка записывается новой правкой
+        self._votes: Dict[str, PendingFeedback] = {}
+        # Недавно записанные правки: ключ -> (токен, до какого момента схлопывать)
+        self._recent: "OrderedDict[Tuple[str, str], Tuple[str, float]]" = OrderedDict()
+        self._recent_keys: Dict[str, Tuple[str, str]] = {}
+        # Токены, которых ещё нет в базе (буфер + пишущаяся пачка)
+        self._unsaved: Dict[str, Tuple[str, str]] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._lock: Optional[asyncio.Lock] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._full: Optional[asyncio.Event] = None
+        self._space: Optional[asyncio.Event] = None
+        self._closing = False
+        self.flushes = 0
+        self.failures = 0
+
+    def __len__(self):
+        return len(self._buffer)
+
+    @staticmethod
+    def _key(original_question: str, edited_answer: str) -> Tuple[str, str]:
+        return original_question.strip(), edited_answer.strip()
+
+    @staticmethod
+    def dedup_key(original_question: str, edited_answer: str) -> str:
+        """Ключ правки в базе (FeedbackItem.dedup_key): sha256 от _key"""
+        question, answer = FeedbackWriter._key(original_question, edited_answer)
+        return hashlib.sha256(f"{question}\0{answer}".encode("utf-8")).hexdigest()
+
+    def start(self):
+        if self._task is not None:
+            return
+        self._lock = asyncio.Lock()
+        self._wake = asyncio.Event()
+        self._full = asyncio.Event()
+        self._space = asyncio.Event()
+        self._closing = False
+        self._load_spill()
+        self._task = asyncio.create_task(self._run())
+
+    async def submit(self, original_question: str, old_answer: str, edited_answer: str,
+                     note: Optional[str] = None, suggested_by: Optional[str] = None) -> Tuple[str, bool]:
+        """
+        Ставит правку в очередь. Возвращает (internal_token, merged):
+        merged=True - такая же правка уже есть, засчитан голос.
+        FeedbackQueueFull, если буфер не освободился за enqueue_timeout.
+        """
+        if self._task is None:
+            self.start()
+        key = self._key(original_question, edited_answer)
+        entry = PendingFeedback(
+            internal_token=generate_token(),
+            original_question=original_question,
+            old_answer=old_answer,
+            edited_answer=edited_answer,
+            note=note,
+            suggested_by=suggested_by,
+            created_at=datetime.utcnow(),
+        )
+        deadline = time.monotonic() + self.enqueue_timeout
+        while True:
+            merged = self._merge(key, entry)
+            if merged is not None:
+                FEEDBACK_SUBMISSIONS.labels(result="merged").inc()
+                return merged, True
+            if len(self._buffer) < self.max_items:
+                break
+            # Backpressure: ждём, пока фоновая запись освободит место
+            self._space.clear()
+            self._full.set()
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    raise asyncio.TimeoutError
+                await asyncio.wait_for(self._space.wait(), timeout=remaining)
+            except asyncio.TimeoutError:
+                FEEDBACK_SUBMISSIONS.labels(result="rejected").inc()
+                raise FeedbackQueueFull(f"В буфере {len(self._buffer)} правок, запись не успевает")
+
+        self._buffer[key] = entry
+        self._unsaved[entry.internal_token] = key
+        FEEDBACK_QUEUE_DEPTH.inc()
+        FEEDBACK_SUBMISSIONS.labels(result="queued").inc()
+        self._wake.set()
+        if len(self._buffer) >= self.flush_max_items:
+            self._full.set()
+        return entry.internal_token, False
+
+    def _merge(self, key: Tuple[str, str], entry: PendingFeedback) -> Optional[str]:
+        buffered = self._buffer.get(key)
+        if buffered is not None:
+            buffered.votes += 1
+            return buffered.internal_token
+        recent = self._recent.get(key)
+        if recent is not None and recent[1] > time.monotonic():
+            token = recent[0]
+            vote = self._votes.get(token)
+            if vote is None:
+                self._votes[token] = entry
+            else:
+                vote.votes += 1
+            self._wake.set()
+            return token
+        return None
+
+    def forget(self, tokens: Iterable[str]):
+        """Правки приняты или отклонены: их повторы больше не схлопываются в них"""
+        for token in tokens:
+            key = self._recent_keys.pop(token, None)
+            if key is not None and self._recent.get(key, (None,))[0] == token:
+                del self._recent[key]
+            # Накопленные повторы становятся новой правкой
+            vote = self._votes.pop(token, None)
+            if vote is None:
+                continue
+            key = self._key(vote.original_question, vote.edited_answer)
+            buffered = self._buffer.get(key)
+            if buffered is not None:
+                buffered.votes += vote.votes
+                continue
+            self._buffer[key] = vote
+            self._unsaved[vote.internal_token] = key
+            FEEDBACK_QUEUE_DEPTH.inc()
+            self._wake.set()
+
+    def is_unsaved(self, token: str) -> bool:
+        return token in self._unsaved
+
+    async def ensure_saved(self, token: str):
+        """Дописывает буфер, если правка с этим токеном ещё не в базе (read-your-writes)"""
+        if token in self._unsaved:
+            await self.flush()
+
+    async def flush(self):
+        """Синхронно пишет всё накопленное; ошибка базы пробрасывается вызывающему"""
+        async with self._lock:
+            while self._buffer or self._votes:
+                await self._flush_once()
+
+    async def _run(self):
+        attempt = 0
+        while True:
+            await self._wake.wait()
+            if not self._closing and len(self._buffer) < self.flush_max_items:
+                try:
+                    await asyncio.wait_for(self._full.wait(), timeout=self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            self._full.clear()
+            self._wake.clear()
+            try:
+                async with self._lock:
+                    if self._buffer or self._votes:
+                        await self._flush_once()
+                attempt = 0
+            except Exception as e:
+                attempt += 1
+                self.failures += 1
+                print(f"Ошибка записи правок ({len(self._buffer)} в буфере), попытка {attempt}: {e}")
+                if self._closing and attempt >= self.DRAIN_ATTEMPTS:
+                    self._save_spill()
+                    return
+                await asyncio.sleep(min(0.1 * 2 ** attempt, self.MAX_BACKOFF_SECONDS))
+            if self._buffer or self._votes:
+                self._wake.set()
+            elif self._closing:
+                return
+
+    async def _flush_once(self):
+        batch: List[PendingFeedback] = []
+        while self._buffer and len(batch) < self.flush_max_items:
+            key, entry = self._buffer.popitem(last=False)
+            batch.append(entry)
+        votes, self._votes = self._votes, {}
+        # Повторы, пришедшие пока пачка пишется, станут голосами следующей записи
+        expires = time.monotonic() + self.collapse_window
+        for entry in batch:
+            self._remember(self._key(entry.original_question, entry.edited_answer), entry.internal_token, expires)
+        self._space.set()
+
+        # Повторы правок, которые уже не pending: записываются новыми правками
+        orphans: List[PendingFeedback] = []
+        # Новые правки, которые уже есть на модерации (их записал другой воркер):
+        # ключ -> токен записанной правки
+        merged: Dict[Tuple[str, str], str] = {}
+        try:
+            async with self._session_maker() as session:
+                table = FeedbackItem.__table__
+                for token, vote in votes.items():
+                    if not await self._add_votes(session, token, vote.votes):
+                        orphans.append(vote)
+
+                # Новые правки по dedup_key: повтор внутри пачки - голос первой
+                fresh: "OrderedDict[str, Tuple[PendingFeedback, int]]" = OrderedDict()
+                for entry in batch + orphans:
+                    dedup_key = self.dedup_key(entry.original_question, entry.edited_answer)
+                    first, count = fresh.get(dedup_key, (entry, 0))
+                    fresh[dedup_key] = (first, count + entry.votes)
+                if fresh:
+                    rows = await session.execute(
+                        select(table.c.dedup_key, table.c.internal_token)
+                        .where(table.c.dedup_key.in_(list(fresh)), table.c.status == "pending")
+                    )
+                    for dedup_key, token in rows.all():
+                        entry, count = fresh[dedup_key]
+                        if await self._add_votes(session, token, count):
+                            merged[self._key(entry.original_question, entry.edited_answer)] = token
+                            del fresh[dedup_key]
+                # Гонку с другим воркером ловит уникальный индекс: запись падает
+                # и повторяется, а повтор уже найдёт его правку
+                if fresh:
+                    await session.execute(insert(FeedbackItem), [
+                        {**asdict(entry), 'votes': count, 'status': "pending", 'dedup_key': dedup_key}
+                        for dedup_key, (entry, count) in fresh.items()
+                    ])
+                deltas: Dict[str, float] = {}
+                for entry, _ in fresh.values():
+                    for name, delta in moderation.feedback_created(entry.suggested_by).items():
+                        deltas[name] = deltas.get(name, 0) + delta
+                await moderation.bump_counters(session, deltas)
+                await session.commit()
+        except BaseException:
+            # Пачка возвращается в начало буфера, голоса - обратно в счётчик
+            for entry in reversed(batch):
+                key = self._key(entry.original_question, entry.edited_answer)
+                self._recent.pop(key, None)
+                self._recent_keys.pop(entry.internal_token, None)
+                pending = self._buffer.pop(key, None)
+                if pending is not None:
+                    entry.votes += pending.votes
+                self._buffer[key] = entry
+                self._buffer.move_to_end(key, last=False)
+            for token, vote in votes.items():
+                pending = self._votes.get(token)
+                if pending is not None:
+                    vote.votes += pending.votes
+                self._votes[token] = vote
+            raise
+
+        for entry in orphans:
+            self._remember(self._key(entry.original_question, entry.edited_answer), entry.internal_token, expires)
+        for key, token in merged.items():
+            self._remember(key, token, expires)
+        for entry in batch:
+            self._unsaved.pop(entry.internal_token, None)
+        FEEDBACK_QUEUE_DEPTH.dec(len(batch))
+        if batch:
+            FEEDBACK_FLUSH_SIZE.observe(len(batch))
+        self.flushes += 1
+        self._prune_recent()
+
+    @staticmethod
+    async def _add_votes(session, token: str, count: int) -> bool:
+        """Прибавляет голоса правке на модерации; False - её нет или она уже решена"""
+        table = FeedbackItem.__table__
+        result = await session.execute(
+            update(table)
+            .where(table.c.internal_token == token, table.c.status == "pending")
+            .values(votes=table.c.votes + count)
+        )
+        return result.rowcount > 0
+
+    def _remember(self, key: Tuple[str, str], token: str, expires: float):
+        previous = self._recent.get(key)
+        if previous is not None:
+            self._recent_keys.pop(previous[0], None)
+        self._recent[key] = (token, expires)
+        self._recent.move_to_end(key)
+        self._recent_keys[token] = key
+
+    def _prune_recent(self):
+        now = time.monotonic()
+        while self._recent:
+            key, (token, expires) = next(iter(self._recent.items()))
+            if expires > now:
+                break
+            self._recent.popitem(last=False)
+            self._recent_keys.pop(token, None)
+
+    @staticmethod
+    def _spill_record(entry: PendingFeedback, **extra) -> str:
+        return json.dumps({**asdict(entry), 'created_at': entry.created_at.isoformat(), **extra},
+                          ensure_ascii=False) + "\n"
+
+    def _save_spill(self):
+        """Буфер и голоса за уже записанные правки (строки с vote_for - токеном правки)"""
+        if not self.spill_path or not (self._buffer or self._votes):
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.spill_path)), exist_ok=True)
+        with open(self.spill_path, "a", encoding="utf-8") as f:
+            for entry in self._buffer.values():
+                f.write(self._spill_record(entry))
+            for token, vote in self._votes.items():
+                f.write(self._spill_record(vote, vote_for=token))
+        print(f"База недоступна: {len(self._buffer)} правок и "
+              f"{sum(vote.votes for vote in self._votes.values())} голосов сохранено в {self.spill_path}")
+
+    def _load_spill(self):
+        if not self.spill_path or not os.path.exists(self.spill_path):
+            return
+        with open(self.spill_path, encoding="utf-8") as f:
+            for line in f:
+                data = json.loads(line)
+                token = data.pop('vote_for', None)
+                entry = PendingFeedback(**{**data, 'created_at': datetime.fromisoformat(data['created_at'])})
+                if token is not None:
+                    pending = self._votes.get(token)
+                    if pending is not None:
+                        pending.votes += entry.votes
+                    else:
+                        self._votes[token] = entry
+                    continue
+                key = self._key(entry.original_question, entry.edited_answer)
+                self._buffer[key] = entry
+                self._unsaved[entry.internal_token] = key
+        os.remove(self.spill_path)
+        FEEDBACK_QUEUE_DEPTH.inc(len(self._buffer))
+        print(f"Загружено {len(self._buffer)} правок и {sum(vote.votes for vote in self._votes.values())} "
+              f"голосов, не записанных при прошлой остановке")
+        self._wake.set()
+
+    async def close(self):
+        """Дописывает буфер в базу (или в spill_path) и останавливает фоновую запись"""
+        if self._task is None:
+            return
+        self._closing = True
+        self._wake.set()
+        self._full.set()
+        await self._task
+        self._task = None
+
+    def stats(self) -> Dict:
+        return {
+            "buffered": len(self._buffer),
+            "pending_votes": sum(vote.votes for vote in self._votes.values()),
+            "max_items": self.max_items,
+            "flushes": self.flushes,
+            "failures": self.failures,
+        }
+
+
+feedback_writer = FeedbackWriter(
+    async_session_maker,
+    flush_interval=settings.FEEDBACK_FLUSH_INTERVAL_MS / 1000,
+    flush_max_items=settings.FEEDBACK_FLUSH_MAX_ITEMS,
+    max_items=settings.FEEDBACK_QUEUE_MAX_ITEMS,
+    enqueue_timeout=settings.FEEDBACK_ENQUEUE_TIMEOUT_SECONDS,
+    collapse_window=settings.FEEDBACK_COLLAPSE_WINDOW_SECONDS,
+    spill_path=settings.FEEDBACK_SPILL_PATH,
+)
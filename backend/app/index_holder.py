@@ -0,0 +1,106 @@
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterator, List, Optional
+from app.indexes import KnowledgeIndex
+
+
+@dataclass(frozen=True)
+class IndexVersion:
+    version: int
+    index: KnowledgeIndex
+
+
+class IndexHolder:
+    """
+    Двойная буферизация индекса (left-right).
+
+    Держит две одинаковые реплики KnowledgeIndex: поиск читает активную,
+    запись идёт в резервную. Публикация - одна замена ссылки на активную
+    версию. После замены писатель дожидается, пока поиски на старой реплике
+    закончатся, и применяет то же изменение к ней - она становится резервной.
+    Так поиски никогда не видят частично обновлённый индекс, а обновление
+    по-прежнему стоит O(изменённых чанков), ценой второй копии в памяти.
+    """
+
+    def __init__(self):
+        self._active: Optional[IndexVersion] = None
+        self._standby: Optional[KnowledgeIndex] = None
+        self._readers: Dict[int, int] = {}
+        self._cond = threading.Condition()
+        self._write_lock = threading.Lock()
+        self._listeners: List[Callable[[int], None]] = []
+
+    @property
+    def current(self) -> Optional[IndexVersion]:
+        return self._active
+
+    @property
+    def version(self) -> int:
+        return self._active.version if self._active else 0
+
+    def add_listener(self, fn: Callable[[int], None]):
+        """fn(version) вызывается после каждой публикации новой версии"""
+        self._listeners.append(fn)
+
+    def _notify(self):
+        version = self.version
+        for fn in self._listeners:
+            fn(version)
+
+    @contextmanager
+    def read(self) -> Iterator[IndexVersion]:
+        """Закрепляет активную версию на время поиска"""
+        with self._cond:
+            current = self._active
+            if current is None:
+                raise RuntimeError("Индекс ещё не загружен")
+            key = id(current.index)
+            self._readers[key] = self._readers.get(key, 0) + 1
+        try:
+            yield current
+        finally:
+            with self._cond:
+                self._readers[key] -= 1
+                if not self._readers[key]:
+                    del self._readers[key]
+                    self._cond.notify_all()
+
+    def _swap(self, index: KnowledgeIndex) -> Optional[KnowledgeIndex]:
+        """Атомарно публикует реплику и ждёт завершения чтений предыдущей"""
+        with self._cond:
+            old = self._active
+            self._active = IndexVersion(version=self.version + 1, index=index)
+            if old is None:
+                return None
+            self._cond.wait_for(lambda: not self._readers.get(id(old.index)))
+            return old.index
+
+    def publish(self, index: KnowledgeIndex) -> int:
+        """Публикует полностью пересобранный индекс; резервная реплика - его копия"""
+        with self._write_lock:
+            self._swap(index)
+            self._notify()
+            self._standby = index.copy()
+            return self.version
+
+    def update(self, mutate: Callable[[KnowledgeIndex], None]) -> int:
+        """
+        Применяет детерминированное изменение к обеим репликам.
+
+        Не вызывать из event loop: ожидание читателей блокирует поток.
+        """
+        with self._write_lock:
+            if self._standby is None:
+                raise RuntimeError("Индекс ещё не загружен")
+            mutate(self._standby)
+            old = self._swap(self._standby)
+            self._notify()
+            mutate(old)
+            self._standby = old
+            return self.version
+
+    def with_standby(self, fn: Callable[[KnowledgeIndex], Any]) -> Any:
+        """Выполняет fn над резервной репликой (она совпадает с активной и никем не читается)"""
+        with self._write_lock:
+            return fn(self._standby)
@@ -0,0 +1,195 @@
+import time
+import uuid
+import asyncio
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+
+@dataclass
+class IndexJob:
+    """Задание на обновление базы знаний и индекса по набору принятых правок"""
+    id: str
+    questions: List[str]
+    status: str = "queued"  # queued / running / done / failed
+    stage: Optional[str] = None  # стадия выполняющегося обновления
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    index_version: Optional[int] = None
+    # Сколько заданий применено вместе с этим одним обновлением индекса
+    coalesced: Optional[int] = None
+    error: Optional[str] = None
+    done: asyncio.Event = field(default_factory=asyncio.Event, repr=False, compare=False)
+
+    def to_dict(self) -> Dict:
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'stage': self.stage,
+            'items': len(self.questions),
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'index_version': self.index_version,
+            'coalesced': self.coalesced,
+            'error': self.error,
+        }
+
+
+class JobRegistry:
+    """Последние maxsize заданий по id; старые вытесняются в порядке создания"""
+
+    def __init__(self, maxsize: int = 1000):
+        self.maxsize = maxsize
+        self.jobs: "OrderedDict[str, IndexJob]" = OrderedDict()
+
+    def create(self, questions: List[str]) -> IndexJob:
+        job = IndexJob(id=uuid.uuid4().hex, questions=questions)
+        self.jobs[job.id] = job
+        while len(self.jobs) > self.maxsize:
+            self.jobs.popitem(last=False)
+        return job
+
+    def get(self, job_id: str) -> Optional[IndexJob]:
+        return self.jobs.get(job_id)
+
+
+class IndexUpdateQueue:
+    """
+    Очередь заданий обновления БЗ с одним потребителем.
+
+    Задания не выполняются в HTTP-запросе: воркер забирает их из очереди и
+    применяет по очереди, так что одновременные approve не запускают
+    параллельные пересборки. Всплеск склеивается (debounce): после задания
+    воркер ждёт, пока debounce секунд не придёт новых, но не дольше max_delay
+    и не больше max_changes правок, и применяет всё одним вызовом apply.
+    """
+
+    def __init__(self, apply: Callable[[List[Dict], Callable[[str], None]], Awaitable[int]],
+                 registry: JobRegistry, debounce: float = 0.5, max_delay: float = 5.0,
+                 max_changes: int = 1000):
+        self._apply = apply
+        self.registry = registry
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.max_changes = max_changes
+        self._queue: Deque[Tuple[IndexJob, List[Dict]]] = deque()
+        self._arrivals = 0
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+        self.running: List[IndexJob] = []
+        self.last_update: Optional[Dict] = None
+
+    def submit(self, changes: List[Dict]) -> IndexJob:
+        """changes - словари {'question', 'answer', 'taxonomy'}"""
+        job = self.registry.create([change['question'] for change in changes])
+        self._queue.append((job, changes))
+        self._arrivals += 1
+        if self._task is None:
+            self._wake = asyncio.Event()
+            self._closing = False
+            self._task = asyncio.create_task(self._run())
+        self._wake.set()
+        return job
+
+    async def wait(self, job: IndexJob, timeout: float) -> IndexJob:
+        """Ждёт завершения задания не дольше timeout; возвращает его в текущем состоянии"""
+        if timeout > 0 and not job.done.is_set():
+            try:
+                await asyncio.wait_for(asyncio.shield(job.done.wait()), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+        return job
+
+    def _queued_changes(self) -> int:
+        return sum(len(changes) for _, changes in self._queue)
+
+    async def _debounce(self):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_delay
+        while not self._closing and self._queued_changes() < self.max_changes:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return
+            arrivals = self._arrivals
+            await asyncio.sleep(min(self.debounce, remaining))
+            if self._arrivals == arrivals:
+                return
+
+    async def _run(self):
+        while True:
+            if not self._queue:
+                if self._closing:
+                    return
+                self._wake.clear()
+                await self._wake.wait()
+                continue
+
+            await self._debounce()
+            batch, changes = [], []
+            while self._queue and (not batch or len(changes) + len(self._queue[0][1]) <= self.max_changes):
+                job, job_changes = self._queue.popleft()
+                batch.append(job)
+                changes.extend(job_changes)
+            await self._process(batch, changes)
+
+    async def _process(self, batch: List[IndexJob], changes: List[Dict]):
+        started = time.time()
+        for job in batch:
+            job.status = "running"
+            job.started_at = started
+            job.coalesced = len(batch)
+        self.running = batch
+
+        def on_stage(stage: str):
+            for job in batch:
+                job.stage = stage
+
+        try:
+            version = await self._apply(changes, on_stage)
+            for job in batch:
+                job.status = "done"
+                job.index_version = version
+        except Exception as e:
+            print(f"Ошибка обновления индекса ({len(batch)} заданий): {e}")
+            for job in batch:
+                job.status = "failed"
+                job.error = str(e)
+        finally:
+            finished = time.time()
+            for job in batch:
+                job.stage = None
+                job.finished_at = finished
+                job.done.set()
+            self.running = []
+            self.last_update = {
+                'jobs': len(batch),
+                'changes': len(changes),
+                'status': batch[0].status,
+                'index_version': batch[0].index_version,
+                'started_at': started,
+                'finished_at': finished,
+                'duration_seconds': round(finished - started, 3),
+            }
+
+    async def close(self):
+        """Дожидается применения уже поставленных заданий"""
+        if self._task is None:
+            return
+        self._closing = True
+        self._wake.set()
+        await self._task
+        self._task = None
+
+    def status(self) -> Dict:
+        return {
+            'queued_jobs': len(self._queue),
+            'queued_changes': self._queued_changes(),
+            'running_jobs': [job.id for job in self.running],
+            'running_stage': self.running[0].stage if self.running else None,
+            'last_update': self.last_update,
+            'debounce_seconds': self.debounce,
+            'max_delay_seconds': self.max_delay,
+        }
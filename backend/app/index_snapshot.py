@@ -0,0 +1,90 @@
+import os
+import json
+import uuid
+import shutil
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+from app.indexes import KnowledgeIndex, VectorIndexSpec
+
+try:
+    import fcntl
+except ImportError:  # Windows: блокировки между процессами нет, снапшот может собрать каждый воркер
+    fcntl = None
+
+
+MANIFEST_FILE = "manifest.json"
+SNAPSHOTS_DIR = "snapshots"
+LOCK_FILE = "snapshot.lock"
+
+# Сколько снапшотов хранить: предыдущий ещё читают воркеры, не успевшие перейти на новый
+KEEP_SNAPSHOTS = 2
+
+
+class SnapshotStore:
+    """
+    Снапшоты индексов в каталоге root, общие для всех воркеров uvicorn.
+
+    Снапшот пишется один раз в собственный каталог snapshots/<имя> и больше
+    не меняется; воркеры отображают его в память (KnowledgeIndex.load) и
+    делят его страницы. Текущий снапшот указывает manifest.json в корне: он
+    заменяется атомарно (os.replace) после записи каталога, поэтому воркер
+    видит старый или новый снапшот целиком. Сборку сериализует файловая
+    блокировка (lock): индекс строит и эмбеддинги считает один воркер,
+    остальные дожидаются его снапшота.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(os.path.join(root, SNAPSHOTS_DIR), exist_ok=True)
+
+    def read_manifest(self) -> Optional[Dict]:
+        try:
+            with open(os.path.join(self.root, MANIFEST_FILE), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def load(self, manifest: Dict, vector_spec: VectorIndexSpec = None) -> KnowledgeIndex:
+        return KnowledgeIndex.load(os.path.join(self.root, SNAPSHOTS_DIR, manifest['snapshot']), vector_spec)
+
+    def save(self, index: KnowledgeIndex, manifest: Dict) -> Dict:
+        """Пишет снапшот в новый каталог и делает его текущим; возвращает записанный манифест"""
+        name = f"{manifest['kb_seq']}-{uuid.uuid4().hex[:8]}"
+        index.save(os.path.join(self.root, SNAPSHOTS_DIR, name))
+        manifest = {**manifest, 'snapshot': name, 'num_rows': len(index.questions), 'num_chunks': len(index)}
+
+        manifest_path = os.path.join(self.root, MANIFEST_FILE)
+        tmp_path = f"{manifest_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, manifest_path)
+        self._prune(name)
+        return manifest
+
+    def _prune(self, current: str):
+        """Удаляет старые снапшоты; процессы, уже отобразившие их файлы, читают их до закрытия"""
+        snapshots_dir = os.path.join(self.root, SNAPSHOTS_DIR)
+        names = sorted(
+            (name for name in os.listdir(snapshots_dir) if name != current),
+            key=lambda name: os.path.getmtime(os.path.join(snapshots_dir, name)),
+            reverse=True
+        )
+        for name in names[KEEP_SNAPSHOTS - 1:]:
+            shutil.rmtree(os.path.join(snapshots_dir, name), ignore_errors=True)
+
+    @contextmanager
+    def lock(self, blocking: bool = True) -> Iterator[bool]:
+        """Блокировка сборки между процессами; с blocking=False отдаёт False, если она занята"""
+        if fcntl is None:
+            yield True
+            return
+        with open(os.path.join(self.root, LOCK_FILE), 'a') as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
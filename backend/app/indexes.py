@@ -0,0 +1,851 @@
+import os
+import re
+import heapq
+import json
+import pickle
+import numpy as np
+from dataclasses import dataclass, replace
+import faiss
+from scipy import sparse
+from collections import Counter
+from typing import Iterator, List, Dict, Optional, Set, Tuple
+from langchain_core.documents import Document
+from app.mmap_io import load_array, save_array
+from app.question_index import QuestionIndex
+
+
+# Идентификатор чанка = row_id * CHUNK_ID_STRIDE + номер чанка в строке.
+# Так чанки одной строки БЗ находятся без отдельного поиска и не меняются между сборками.
+CHUNK_ID_STRIDE = 1000
+
+FAISS_FILE = "index.faiss"
+STATE_FILE = "index.pkl"
+
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def make_chunk_id(row_id: int, chunk_no: int) -> int:
+    if chunk_no >= CHUNK_ID_STRIDE:
+        raise ValueError(f"Слишком много чанков в строке {row_id}: {chunk_no}")
+    return int(row_id) * CHUNK_ID_STRIDE + chunk_no
+
+
+def row_id_of(chunk_id: int) -> int:
+    return int(chunk_id) // CHUNK_ID_STRIDE
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN_RE.findall(text.lower())
+
+
+def normalize_query(text: str) -> str:
+    """Нормализованный текст для ключей кэшей: регистр, пунктуация и пробелы свёрнуты, ё -> е"""
+    return " ".join(tokenize(text.lower().replace("ё", "е")))
+
+
+# Типы векторного индекса (VECTOR_INDEX_TYPE):
+#   flat      - точный поиск, float32 (4 байта на измерение)
+#   flat_fp16 - точный перебор по векторам в float16, вдвое меньше памяти
+#   hnsw      - граф HNSW: быстрый приближённый поиск, память больше flat
+#   ivf_flat  - инвертированные списки (nlist кластеров), перебор nprobe из них
+#   ivf_sq8   - IVF с 8-битным скалярным квантованием (1 байт на измерение)
+#   ivf_pq    - IVF с product quantization (pq_m байт на вектор при 8 битах)
+VECTOR_INDEX_TYPES = ("flat", "flat_fp16", "hnsw", "ivf_flat", "ivf_sq8", "ivf_pq")
+
+# Эвристика FAISS: k-means нужно не меньше 39 точек на центроид
+MIN_POINTS_PER_CENTROID = 39
+
+
+@dataclass(frozen=True)
+class VectorIndexSpec:
+    """Тип векторного индекса и его параметры; ef_search и nprobe действуют без пересборки"""
+    kind: str = "flat"
+    hnsw_m: int = 32
+    ef_construction: int = 200
+    ef_search: int = 64
+    # 0 - 4 * sqrt(число векторов)
+    nlist: int = 0
+    nprobe: int = 16
+    pq_m: int = 64
+    pq_nbits: int = 8
+    # Сколько векторов (случайная выборка) идёт на обучение IVF/PQ
+    train_sample: int = 50000
+
+    def __post_init__(self):
+        if self.kind not in VECTOR_INDEX_TYPES:
+            raise ValueError(f"Неизвестный тип векторного индекса: {self.kind}, ожидается один из {VECTOR_INDEX_TYPES}")
+
+    def build_params(self) -> Dict:
+        """Параметры, от которых зависит содержимое индекса (для манифеста снапшота)"""
+        params = {'kind': self.kind}
+        if self.kind == "hnsw":
+            params.update(hnsw_m=self.hnsw_m, ef_construction=self.ef_construction)
+        if self.kind.startswith("ivf"):
+            params.update(nlist=self.nlist, train_sample=self.train_sample)
+        if self.kind == "ivf_pq":
+            params.update(pq_m=self.pq_m, pq_nbits=self.pq_nbits)
+        return params
+
+
+class VectorIndex:
+    """
+    FAISS-индекс по косинусной близости с постоянными id чанков.
+
+    Тип задаётся VectorIndexSpec и выбирается при первом добавлении: IVF и PQ
+    обучаются на случайной выборке первых векторов; если векторов для
+    обучения мало, индекс остаётся точным flat (kind показывает фактический
+    тип). Flat-индексы обёрнуты в IndexIDMap2, IVF хранит id сам; и те, и
+    другие удаляют векторы на месте. HNSW удалять не умеет: удалённые id
+    помечаются в tombstones и отсекаются IDSelector при поиске, а новые
+    векторы идут в небольшой точный overlay. Когда overlay и tombstones
+    разрастаются, HNSW пересобирается из живых векторов.
+
+    Индекс из снапшота (load) отображён в память (IO_FLAG_MMAP_IFC) и общий
+    для всех процессов; менять его нельзя, поэтому правки любого типа идут
+    через tombstones и overlay, а сжатие - это новый снапшот.
+    """
+
+    # Пересборка HNSW, когда overlay + tombstones превышают
+    # max(COMPACT_MIN_VECTORS, COMPACT_RATIO * размер графа)
+    COMPACT_MIN_VECTORS = 1024
+    COMPACT_RATIO = 0.1
+
+    def __init__(self, dim: int = None, spec: VectorIndexSpec = None):
+        self.spec = spec or VectorIndexSpec()
+        self.kind: Optional[str] = None
+        self.index = None
+        self.overlay = None
+        self.tombstones: Set[int] = set()
+        self._selector = None
+        # Файл отображённого в память индекса; None - индекс в памяти процесса
+        self.path: Optional[str] = None
+        if dim is not None:
+            self._create(np.zeros((0, dim), dtype=np.float32))
+
+    def __len__(self):
+        if self.index is None:
+            return 0
+        overlay = self.overlay.ntotal if self.overlay is not None else 0
+        return self.index.ntotal + overlay - len(self.tombstones)
+
+    @property
+    def frozen(self) -> bool:
+        return self.path is not None
+
+    def _factory(self, dim: int, n: int) -> Tuple[str, str]:
+        """(фактический тип, строка faiss.index_factory) для n обучающих векторов"""
+        kind = self.spec.kind
+        if kind == "flat":
+            return kind, "IDMap2,Flat"
+        if kind == "flat_fp16":
+            return kind, "IDMap2,SQfp16"
+        if kind == "hnsw":
+            return kind, f"IDMap2,HNSW{self.spec.hnsw_m}"
+
+        nlist = min(self.spec.nlist or int(4 * np.sqrt(n)), n // MIN_POINTS_PER_CENTROID)
+        required = nlist * MIN_POINTS_PER_CENTROID
+        if kind == "ivf_pq":
+            required = max(required, 2 ** self.spec.pq_nbits * MIN_POINTS_PER_CENTROID)
+        if nlist < 1 or n < required:
+            print(f"Векторов для обучения {kind} недостаточно ({n}), используется flat")
+            return "flat", "IDMap2,Flat"
+        if kind == "ivf_flat":
+            return kind, f"IVF{nlist},Flat"
+        if kind == "ivf_sq8":
+            return kind, f"IVF{nlist},SQ8"
+        # Число подквантователей должно делить размерность; np - без polysemous-обучения,
+        # которое на порядок дольше и поиску без polysemous_ht не нужно
+        pq_m = max(m for m in range(1, min(self.spec.pq_m, dim) + 1) if dim % m == 0)
+        return kind, f"IVF{nlist},PQ{pq_m}x{self.spec.pq_nbits}np"
+
+    def _create(self, matrix: np.ndarray):
+        """Создаёт индекс и обучает его на выборке matrix (векторы уже нормированы)"""
+        dim = matrix.shape[1]
+        self.kind, factory = self._factory(dim, len(matrix))
+        index = faiss.index_factory(dim, factory, faiss.METRIC_INNER_PRODUCT)
+        if self.kind == "hnsw":
+            faiss.downcast_index(index.index).hnsw.efConstruction = self.spec.ef_construction
+        if not index.is_trained:
+            nlist = faiss.extract_index_ivf(index).nlist
+            size = min(len(matrix), max(self.spec.train_sample, nlist * MIN_POINTS_PER_CENTROID))
+            sample = matrix[np.random.default_rng(0).choice(len(matrix), size=size, replace=False)]
+            index.train(sample)
+        self.index = index
+        self.overlay = None
+        self.tombstones = set()
+        self._selector = None
+        self.set_search_params()
+
+    def set_search_params(self, ef_search: int = None, nprobe: int = None):
+        """Меняет параметры поиска (efSearch HNSW, nprobe IVF) без пересборки"""
+        self.spec = replace(self.spec, ef_search=ef_search or self.spec.ef_search,
+                            nprobe=nprobe or self.spec.nprobe)
+        if self.kind == "hnsw":
+            faiss.downcast_index(self.index.index).hnsw.efSearch = self.spec.ef_search
+        elif self.kind is not None and self.kind.startswith("ivf"):
+            faiss.extract_index_ivf(self.index).nprobe = self.spec.nprobe
+
+    def add(self, ids: List[int], vectors: List[List[float]]):
+        if not ids:
+            return
+        matrix = np.asarray(vectors, dtype=np.float32)
+        faiss.normalize_L2(matrix)
+        ids = np.asarray(ids, dtype=np.int64)
+        if self.index is None:
+            self._create(matrix)
+        if (self.kind == "hnsw" or self.frozen) and self.index.ntotal:
+            if self.overlay is None:
+                self.overlay = faiss.IndexIDMap2(faiss.IndexFlatIP(self.index.d))
+            self.overlay.add_with_ids(matrix, ids)
+            self._maybe_compact()
+        else:
+            self.index.add_with_ids(matrix, ids)
+
+    def remove(self, ids: List[int]):
+        if not ids or self.index is None:
+            return
+        ids = np.asarray(ids, dtype=np.int64)
+        if self.kind != "hnsw" and not self.frozen:
+            self.index.remove_ids(ids)
+            return
+        # Id в overlay удаляются сразу; остальные - из основного индекса, помечаются удалёнными
+        in_overlay = np.zeros(len(ids), dtype=bool)
+        if self.overlay is not None:
+            in_overlay = np.isin(ids, faiss.vector_to_array(self.overlay.id_map))
+            self.overlay.remove_ids(ids[in_overlay])
+        self.tombstones.update(ids[~in_overlay].tolist())
+        self._selector = None
+        self._maybe_compact()
+
+    def _maybe_compact(self):
+        if self.frozen:
+            return
+        churn = (self.overlay.ntotal if self.overlay is not None else 0) + len(self.tombstones)
+        if churn > max(self.COMPACT_MIN_VECTORS, self.COMPACT_RATIO * self.index.ntotal):
+            self.compact()
+
+    def compact(self):
+        """Пересобирает HNSW из живых векторов графа и overlay"""
+        if self.kind != "hnsw":
+            return
+        if self.frozen:
+            raise ValueError("Индекс из снапшота не сжимается на месте - нужен новый снапшот")
+        ids = faiss.vector_to_array(self.index.id_map)
+        alive = ~np.isin(ids, np.fromiter(self.tombstones, dtype=np.int64, count=len(self.tombstones)))
+        matrix = self.index.index.reconstruct_n(0, self.index.ntotal)[alive]
+        ids = ids[alive]
+        if self.overlay is not None:
+            matrix = np.vstack([matrix, self.overlay.index.reconstruct_n(0, self.overlay.ntotal)])
+            ids = np.concatenate([ids, faiss.vector_to_array(self.overlay.id_map)])
+        self._create(matrix)
+        self.index.add_with_ids(matrix, ids)
+
+    def _search_params(self):
+        if not self.tombstones:
+            return None
+        if self._selector is None:
+            removed = np.fromiter(self.tombstones, dtype=np.int64, count=len(self.tombstones))
+            self._selector = faiss.IDSelectorNot(faiss.IDSelectorBatch(removed))
+        if self.kind == "hnsw":
+            return faiss.SearchParametersHNSW(sel=self._selector, efSearch=self.spec.ef_search)
+        if self.kind.startswith("ivf"):
+            return faiss.SearchParametersIVF(sel=self._selector, nprobe=self.spec.nprobe)
+        return faiss.SearchParameters(sel=self._selector)
+
+    def _search(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        faiss.normalize_L2(queries)
+        scores, ids = self.index.search(queries, min(k, len(self)), params=self._search_params())
+        if self.overlay is not None and self.overlay.ntotal:
+            extra_scores, extra_ids = self.overlay.search(queries, min(k, self.overlay.ntotal))
+            scores = np.hstack([scores, extra_scores])
+            ids = np.hstack([ids, extra_ids])
+            # -1 (недобор графа) получают -inf и уходят в конец
+            scores[ids == -1] = -np.inf
+            order = np.argsort(-scores, axis=1)[:, :k]
+            scores = np.take_along_axis(scores, order, axis=1)
+            ids = np.take_along_axis(ids, order, axis=1)
+        return scores, ids
+
+    def search(self, vector: List[float], k: int) -> List[Tuple[int, float]]:
+        if not len(self):
+            return []
+        scores, ids = self._search(np.asarray([vector], dtype=np.float32), k)
+        return [(int(i), float(s)) for s, i in zip(scores[0], ids[0]) if i != -1]
+
+    def search_many(self, vectors: np.ndarray, k: int) -> List[List[Tuple[int, float]]]:
+        """Один матричный поиск FAISS для всех векторов пакета"""
+        if not len(self):
+            return [[] for _ in range(len(vectors))]
+        scores, ids = self._search(np.array(vectors, dtype=np.float32), k)
+        return [
+            [(int(i), float(s)) for s, i in zip(row_scores, row_ids) if i != -1]
+            for row_scores, row_ids in zip(scores, ids)
+        ]
+
+    def memory_bytes(self) -> int:
+        """Размер сериализованного индекса - близок к занимаемой им памяти"""
+        if self.index is None:
+            return 0
+        size = faiss.serialize_index(self.index).nbytes
+        if self.overlay is not None:
+            size += faiss.serialize_index(self.overlay).nbytes
+        return size
+
+    def copy(self) -> "VectorIndex":
+        other = VectorIndex(spec=self.spec)
+        other.kind = self.kind
+        other.path = self.path
+        if self.frozen:
+            # Повторное отображение того же файла: страницы общие, копии в памяти нет
+            other.index = faiss.read_index(self.path, faiss.IO_FLAG_MMAP_IFC)
+            other.set_search_params()
+        elif self.index is not None:
+            other.index = faiss.clone_index(self.index)
+            other.set_search_params()
+        if self.overlay is not None:
+            other.overlay = faiss.clone_index(self.overlay)
+        other.tombstones = set(self.tombstones)
+        return other
+
+    def save(self, path: str) -> Dict:
+        """Пишет индекс снапшота (overlay предварительно сливается); возвращает его состояние"""
+        if self.frozen:
+            raise ValueError("Снапшот пишется из индекса, собранного в памяти")
+        if self.tombstones or (self.overlay is not None and self.overlay.ntotal):
+            self.compact()
+        if self.index is not None:
+            faiss.write_index(self.index, os.path.join(path, FAISS_FILE))
+        return {'kind': self.kind}
+
+    @classmethod
+    def load(cls, path: str, state: Dict, spec: VectorIndexSpec = None) -> "VectorIndex":
+        """Отображает индекс снапшота в память; spec задаёт параметры поиска"""
+        index = cls(spec=spec)
+        index.kind = state['kind']
+        if index.kind is not None:
+            index.path = os.path.join(path, FAISS_FILE)
+            index.index = faiss.read_index(index.path, faiss.IO_FLAG_MMAP_IFC)
+            index.set_search_params()
+        return index
+
+
+class BM25Index:
+    """
+    Okapi BM25 на разреженной CSR-матрице термин x документ со скорингом в NumPy.
+
+    Основной сегмент - неизменяемая CSR-матрица, по которой запрос считается
+    векторно (одна bincount по постингам терминов запроса). Новые чанки
+    попадают в небольшой дельта-сегмент, удалённые из основного помечаются
+    в маске alive; df, длины документов и средняя длина обновляются на месте,
+    так что добавление и удаление стоят O(токенов чанка). Когда дельта
+    разрастается, сегменты сливаются в новую CSR-матрицу без токенизации.
+
+    Снапшот (save/load) - массивы CSR-матриц, отображённые в память. Словарь
+    снапшота - отсортированный массив терминов (поиск через searchsorted),
+    термины, появившиеся после него, - в обычном словаре vocab. Индекс из
+    снапшота дельту сам не сливает: слияние скопировало бы матрицу в память
+    процесса.
+    """
+
+    # Дельта сливается с основным сегментом, когда превышает
+    # max(COMPACT_MIN_DOCS, COMPACT_RATIO * размер основного сегмента)
+    COMPACT_MIN_DOCS = 256
+    COMPACT_RATIO = 0.1
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.vocab: Dict[str, int] = {}
+        # Словарь снапшота: термины в UTF-8 по возрастанию и их id
+        self.frozen_terms = np.zeros(0, dtype='S1')
+        self.frozen_term_ids = np.zeros(0, dtype=np.int64)
+        self.n_terms = 0
+        self.frozen = False
+        self.df = np.zeros(0, dtype=np.int64)
+        self.n_docs = 0
+        self.total_len = 0
+        # Основной сегмент, строки отсортированы по chunk_id
+        self.base_ids = np.zeros(0, dtype=np.int64)
+        self.base_len = np.zeros(0, dtype=np.float32)
+        self.base_alive = np.zeros(0, dtype=bool)
+        self.by_term = sparse.csr_matrix((0, 0), dtype=np.float32)
+        self.by_doc = sparse.csr_matrix((0, 0), dtype=np.float32)
+        # Дельта-сегмент: chunk_id -> {term_id: tf} и term_id -> {chunk_id: tf}
+        self.delta_docs: Dict[int, Dict[int, int]] = {}
+        self.delta_postings: Dict[int, Dict[int, int]] = {}
+
+    def __len__(self):
+        return self.n_docs
+
+    def _term_id(self, term: str) -> Optional[int]:
+        term_id = self.vocab.get(term)
+        if term_id is None and len(self.frozen_terms):
+            key = term.encode("utf-8")
+            pos = int(np.searchsorted(self.frozen_terms, key))
+            if pos < len(self.frozen_terms) and self.frozen_terms[pos] == key:
+                term_id = int(self.frozen_term_ids[pos])
+        return term_id
+
+    def _term_ids(self, text: str) -> Counter:
+        tfs = Counter()
+        for term in tokenize(text):
+            term_id = self._term_id(term)
+            if term_id is None:
+                term_id = self.vocab[term] = self.n_terms
+                self.n_terms += 1
+            tfs[term_id] += 1
+        if self.n_terms > len(self.df):
+            self.df = np.concatenate([
+                self.df,
+                np.zeros(max(self.n_terms - len(self.df), len(self.df)), dtype=np.int64)
+            ])
+        return tfs
+
+    def _base_pos(self, chunk_id: int) -> Optional[int]:
+        pos = int(np.searchsorted(self.base_ids, chunk_id))
+        if pos < len(self.base_ids) and self.base_ids[pos] == chunk_id and self.base_alive[pos]:
+            return pos
+        return None
+
+    def _build_base(self, ids: List[int], rows: sparse.csr_matrix):
+        """rows: документ x термин с частотами; ids - chunk_id строк"""
+        ids = np.asarray(ids, dtype=np.int64)
+        order = np.argsort(ids, kind='stable')
+        self.base_ids = ids[order]
+        self.by_doc = rows.tocsr()[order]
+        self.base_len = np.asarray(self.by_doc.sum(axis=1), dtype=np.float32).ravel()
+        self.base_alive = np.ones(len(ids), dtype=bool)
+        self.by_term = self.by_doc.T.tocsr()
+
+    def _rows_from_tfs(self, doc_tfs: List[Dict[int, int]]) -> sparse.csr_matrix:
+        indptr = np.zeros(len(doc_tfs) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum([len(tfs) for tfs in doc_tfs])
+        indices = np.fromiter((t for tfs in doc_tfs for t in tfs), dtype=np.int64, count=indptr[-1])
+        data = np.fromiter((tf for tfs in doc_tfs for tf in tfs.values()), dtype=np.float32, count=indptr[-1])
+        return sparse.csr_matrix((data, indices, indptr), shape=(len(doc_tfs), self.n_terms))
+
+    def add_many(self, ids: List[int], texts: List[str]):
+        if self.n_docs == 0 and not self.delta_docs and not self.frozen:
+            # Первичная сборка: сразу в CSR, минуя дельту
+            doc_tfs = [self._term_ids(text) for text in texts]
+            for tfs in doc_tfs:
+                self.df[list(tfs)] += 1
+                self.total_len += sum(tfs.values())
+            self.n_docs = len(doc_tfs)
+            self._build_base(list(ids), self._rows_from_tfs(doc_tfs))
+            return
+
+        for chunk_id, text in zip(ids, texts):
+            self.add(chunk_id, text)
+
+    def add(self, chunk_id: int, text: str):
+        self.remove(chunk_id)
+        tfs = self._term_ids(text)
+        for term_id, tf in tfs.items():
+            self.delta_postings.setdefault(term_id, {})[chunk_id] = tf
+        self.df[list(tfs)] += 1
+        self.delta_docs[chunk_id] = dict(tfs)
+        self.n_docs += 1
+        self.total_len += sum(tfs.values())
+
+        if not self.frozen and len(self.delta_docs) > max(self.COMPACT_MIN_DOCS, self.COMPACT_RATIO * len(self.base_ids)):
+            self.compact()
+
+    def remove(self, chunk_id: int):
+        pos = self._base_pos(chunk_id)
+        if pos is not None:
+            start, end = self.by_doc.indptr[pos], self.by_doc.indptr[pos + 1]
+            self.df[self.by_doc.indices[start:end]] -= 1
+            self.base_alive[pos] = False
+            self.total_len -= int(self.base_len[pos])
+            self.n_docs -= 1
+            return
+
+        tfs = self.delta_docs.pop(chunk_id, None)
+        if tfs is None:
+            return
+        for term_id in tfs:
+            posting = self.delta_postings[term_id]
+            del posting[chunk_id]
+            if not posting:
+                del self.delta_postings[term_id]
+        self.df[list(tfs)] -= 1
+        self.n_docs -= 1
+        self.total_len -= sum(tfs.values())
+
+    def compact(self):
+        """Сливает живые документы основного сегмента и дельту в новую CSR-матрицу"""
+        alive = np.flatnonzero(self.base_alive)
+        base_rows = self.by_doc[alive]
+        base_rows.resize((len(alive), self.n_terms))
+        delta_ids = list(self.delta_docs)
+        delta_rows = self._rows_from_tfs([self.delta_docs[i] for i in delta_ids])
+
+        ids = self.base_ids[alive].tolist() + delta_ids
+        self._build_base(ids, sparse.vstack([base_rows, delta_rows], format='csr'))
+        self.delta_docs = {}
+        self.delta_postings = {}
+
+    def _query_terms(self, query: str) -> Tuple[List[int], np.ndarray]:
+        term_ids = [self._term_id(t) for t in set(tokenize(query))]
+        term_ids = [t for t in term_ids if t is not None and self.df[t] > 0]
+        df = self.df[term_ids]
+        return term_ids, np.log(1 + (self.n_docs - df + 0.5) / (df + 0.5))
+
+    def _avgdl(self) -> float:
+        return self.total_len / self.n_docs or 1.0
+
+    def _top_base(self, scores: np.ndarray, k: int) -> List[Tuple[int, float]]:
+        scores[~self.base_alive] = 0.0
+        candidates = np.flatnonzero(scores)
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        return list(zip(self.base_ids[candidates].tolist(), scores[candidates].tolist()))
+
+    def _delta_scores(self, term_ids: List[int], idfs: np.ndarray, avgdl: float) -> List[Tuple[int, float]]:
+        # Дельта-сегмент мал, считаем по словарям
+        scores: Dict[int, float] = {}
+        for term_id, idf in zip(term_ids, idfs):
+            for chunk_id, tf in self.delta_postings.get(term_id, {}).items():
+                dl = sum(self.delta_docs[chunk_id].values())
+                norm = tf + self.k1 * (1 - self.b + self.b * dl / avgdl)
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + float(idf) * tf * (self.k1 + 1) / norm
+        return list(scores.items())
+
+    def search(self, query: str, k: int) -> List[Tuple[int, float]]:
+        if not self.n_docs:
+            return []
+        term_ids, idfs = self._query_terms(query)
+        if not term_ids:
+            return []
+
+        avgdl = self._avgdl()
+        results: List[Tuple[int, float]] = []
+
+        # Основной сегмент: постинги терминов запроса -> одна bincount
+        rows, weights = [], []
+        for term_id, idf in zip(term_ids, idfs):
+            if term_id >= self.by_term.shape[0]:
+                continue
+            start, end = self.by_term.indptr[term_id], self.by_term.indptr[term_id + 1]
+            docs = self.by_term.indices[start:end]
+            tf = self.by_term.data[start:end]
+            norm = tf + self.k1 * (1 - self.b + self.b * self.base_len[docs] / avgdl)
+            rows.append(docs)
+            weights.append(idf * tf * (self.k1 + 1) / norm)
+
+        if rows:
+            scores = np.bincount(np.concatenate(rows), weights=np.concatenate(weights),
+                                 minlength=len(self.base_ids))
+            results.extend(self._top_base(scores, k))
+
+        if self.delta_docs:
+            results.extend(self._delta_scores(term_ids, idfs, avgdl))
+
+        return heapq.nlargest(k, results, key=lambda item: item[1])
+
+    def search_many(self, queries: List[str], k: int) -> List[List[Tuple[int, float]]]:
+        """
+        Пакетный скоринг: Q (запрос x термин, idf) @ W (термин x документ, нормированный tf).
+
+        W строится один раз на пакет и только по терминам, встречающимся в запросах.
+        """
+        if not self.n_docs:
+            return [[] for _ in queries]
+
+        avgdl = self._avgdl()
+        parsed = [self._query_terms(query) for query in queries]
+        terms = sorted({t for term_ids, _ in parsed for t in term_ids if t < self.by_term.shape[0]})
+        column = {term_id: i for i, term_id in enumerate(terms)}
+
+        # W: строки by_term для терминов пакета с BM25-нормировкой tf
+        weights = self.by_term[terms].astype(np.float32)
+        tf = weights.data
+        doc_len = self.base_len[weights.indices]
+        weights.data = tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * doc_len / avgdl))
+
+        q_rows, q_cols, q_vals = [], [], []
+        for row, (term_ids, idfs) in enumerate(parsed):
+            for term_id, idf in zip(term_ids, idfs):
+                if term_id in column:
+                    q_rows.append(row)
+                    q_cols.append(column[term_id])
+                    q_vals.append(idf)
+        query_matrix = sparse.csr_matrix(
+            (np.asarray(q_vals, dtype=np.float32), (q_rows, q_cols)),
+            shape=(len(queries), len(terms))
+        )
+        scores = (query_matrix @ weights).tocsr()
+
+        results = []
+        for row, (term_ids, idfs) in enumerate(parsed):
+            base_scores = np.zeros(len(self.base_ids), dtype=np.float64)
+            start, end = scores.indptr[row], scores.indptr[row + 1]
+            base_scores[scores.indices[start:end]] = scores.data[start:end]
+            found = self._top_base(base_scores, k)
+            if self.delta_docs and term_ids:
+                found.extend(self._delta_scores(term_ids, idfs, avgdl))
+            results.append(heapq.nlargest(k, found, key=lambda item: item[1]))
+        return results
+
+    def copy(self) -> "BM25Index":
+        """Копия для второй реплики: CSR-матрицы не меняются на месте и разделяются"""
+        other = BM25Index.__new__(BM25Index)
+        other.__dict__.update(self.__dict__)
+        other.vocab = dict(self.vocab)
+        other.df = self.df.copy()
+        other.base_alive = self.base_alive.copy()
+        other.delta_docs = dict(self.delta_docs)
+        other.delta_postings = {term_id: dict(posting) for term_id, posting in self.delta_postings.items()}
+        return other
+
+    def save(self, path: str) -> Dict:
+        """Пишет массивы снапшота (дельта предварительно сливается); возвращает состояние"""
+        if self.delta_docs or not self.base_alive.all():
+            self.compact()
+        terms = np.concatenate([
+            self.frozen_terms,
+            np.array([term.encode("utf-8") for term in self.vocab], dtype=bytes)
+        ])
+        term_ids = np.concatenate([
+            self.frozen_term_ids,
+            np.fromiter(self.vocab.values(), dtype=np.int64, count=len(self.vocab))
+        ])
+        order = np.argsort(terms, kind='stable')
+        save_array(path, "bm25_terms", terms[order])
+        save_array(path, "bm25_term_ids", term_ids[order])
+        save_array(path, "bm25_df", self.df[:self.n_terms])
+        save_array(path, "bm25_ids", self.base_ids)
+        save_array(path, "bm25_len", self.base_len)
+        for name, matrix in (("by_doc", self.by_doc), ("by_term", self.by_term)):
+            save_array(path, f"bm25_{name}_data", matrix.data)
+            save_array(path, f"bm25_{name}_indices", matrix.indices)
+            save_array(path, f"bm25_{name}_indptr", matrix.indptr)
+        return {
+            'k1': self.k1,
+            'b': self.b,
+            'n_docs': self.n_docs,
+            'total_len': self.total_len,
+            'n_terms': self.n_terms,
+            'shape': self.by_doc.shape,
+        }
+
+    @classmethod
+    def load(cls, path: str, state: Dict) -> "BM25Index":
+        """Отображает снапшот в память; df и маска alive - копии процесса, они меняются при правках"""
+        index = cls(k1=state['k1'], b=state['b'])
+        index.frozen = True
+        index.frozen_terms = load_array(path, "bm25_terms")
+        index.frozen_term_ids = load_array(path, "bm25_term_ids")
+        index.n_terms = state['n_terms']
+        index.df = np.array(load_array(path, "bm25_df"))
+        index.n_docs = state['n_docs']
+        index.total_len = state['total_len']
+        index.base_ids = load_array(path, "bm25_ids")
+        index.base_len = load_array(path, "bm25_len")
+        index.base_alive = np.ones(len(index.base_ids), dtype=bool)
+        n_rows, n_cols = state['shape']
+        index.by_doc, index.by_term = (
+            sparse.csr_matrix(
+                (load_array(path, f"bm25_{name}_data"),
+                 load_array(path, f"bm25_{name}_indices"),
+                 load_array(path, f"bm25_{name}_indptr")),
+                shape=shape, copy=False
+            )
+            for name, shape in (("by_doc", (n_rows, n_cols)), ("by_term", (n_cols, n_rows)))
+        )
+        return index
+
+
+class DocumentStore:
+    """
+    Документы (чанки) индекса по chunk_id.
+
+    Документы, добавленные в процессе, лежат в словаре added. Снапшот - плоская
+    арена: JSON-записи {page_content, metadata} всех чанков подряд в одном
+    массиве байт, их смещения и отсортированные chunk_id. Загруженная арена
+    отображена в память и общая для процессов, документ декодируется при
+    обращении; удалённые из арены помечаются в маске base_alive.
+    """
+
+    def __init__(self):
+        self.added: Dict[int, Document] = {}
+        self.added_rows: Dict[int, List[int]] = {}
+        self.base_ids = np.zeros(0, dtype=np.int64)
+        self.base_offsets = np.zeros(1, dtype=np.int64)
+        self.base_blob = np.zeros(0, dtype=np.uint8)
+        self.base_alive = np.zeros(0, dtype=bool)
+        self.base_count = 0
+
+    def __len__(self):
+        return len(self.added) + self.base_count
+
+    def __contains__(self, chunk_id: int) -> bool:
+        return chunk_id in self.added or self._base_pos(chunk_id) is not None
+
+    def __getitem__(self, chunk_id: int) -> Document:
+        doc = self.get(chunk_id)
+        if doc is None:
+            raise KeyError(chunk_id)
+        return doc
+
+    def _base_pos(self, chunk_id: int) -> Optional[int]:
+        pos = int(np.searchsorted(self.base_ids, chunk_id))
+        if pos < len(self.base_ids) and self.base_ids[pos] == chunk_id and self.base_alive[pos]:
+            return pos
+        return None
+
+    def _decode(self, pos: int) -> Document:
+        record = json.loads(self.base_blob[self.base_offsets[pos]:self.base_offsets[pos + 1]].tobytes())
+        return Document(page_content=record['page_content'], metadata=record['metadata'])
+
+    def get(self, chunk_id: int) -> Optional[Document]:
+        doc = self.added.get(chunk_id)
+        if doc is None:
+            pos = self._base_pos(chunk_id)
+            if pos is not None:
+                doc = self._decode(pos)
+        return doc
+
+    def row_chunks(self, row_id: int) -> List[int]:
+        """chunk_id строки БЗ по порядку; в арене - диапазон, id чанков строки идут подряд"""
+        start, end = np.searchsorted(self.base_ids, [row_id * CHUNK_ID_STRIDE, (row_id + 1) * CHUNK_ID_STRIDE])
+        chunk_ids = [int(self.base_ids[pos]) for pos in range(start, end) if self.base_alive[pos]]
+        return chunk_ids + self.added_rows.get(row_id, [])
+
+    def values(self) -> Iterator[Document]:
+        for pos in np.flatnonzero(self.base_alive).tolist():
+            yield self._decode(pos)
+        yield from self.added.values()
+
+    def add(self, doc: Document):
+        chunk_id = doc.metadata['chunk_id']
+        self.remove(chunk_id)
+        self.added[chunk_id] = doc
+        self.added_rows.setdefault(doc.metadata['row_id'], []).append(chunk_id)
+
+    def remove(self, chunk_id: int):
+        pos = self._base_pos(chunk_id)
+        if pos is not None:
+            self.base_alive[pos] = False
+            self.base_count -= 1
+        doc = self.added.pop(chunk_id, None)
+        if doc is None:
+            return
+        row_id = doc.metadata['row_id']
+        self.added_rows[row_id].remove(chunk_id)
+        if not self.added_rows[row_id]:
+            del self.added_rows[row_id]
+
+    def copy(self) -> "DocumentStore":
+        """Копия для второй реплики: арена общая, документы неизменяемы и разделяются"""
+        other = DocumentStore.__new__(DocumentStore)
+        other.__dict__.update(self.__dict__)
+        other.added = dict(self.added)
+        other.added_rows = {row_id: list(ids) for row_id, ids in self.added_rows.items()}
+        other.base_alive = self.base_alive.copy()
+        return other
+
+    def save(self, path: str):
+        docs = sorted(self.values(), key=lambda doc: doc.metadata['chunk_id'])
+        records = [
+            json.dumps({'page_content': doc.page_content, 'metadata': doc.metadata}, ensure_ascii=False).encode("utf-8")
+            for doc in docs
+        ]
+        offsets = np.zeros(len(records) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(record) for record in records])
+        save_array(path, "docs_ids", np.asarray([doc.metadata['chunk_id'] for doc in docs], dtype=np.int64))
+        save_array(path, "docs_offsets", offsets)
+        save_array(path, "docs_blob", np.frombuffer(b"".join(records), dtype=np.uint8))
+
+    @classmethod
+    def load(cls, path: str) -> "DocumentStore":
+        store = cls()
+        store.base_ids = load_array(path, "docs_ids")
+        store.base_offsets = load_array(path, "docs_offsets")
+        store.base_blob = load_array(path, "docs_blob")
+        store.base_alive = np.ones(len(store.base_ids), dtype=bool)
+        store.base_count = len(store.base_ids)
+        return store
+
+
+class KnowledgeIndex:
+    """
+    Векторный и лексический индексы БЗ с общими id чанков и обновлением по строкам.
+
+    Снапшот (save/load) - каталог с индексом FAISS, массивами .npy и небольшим
+    STATE_FILE. Загруженный индекс отображён в память: несколько процессов,
+    открывших один снапшот, делят его страницы, а правки после снапшота
+    каждый держит у себя поверх него.
+    """
+
+    def __init__(self, vector_spec: VectorIndexSpec = None):
+        self.vector = VectorIndex(spec=vector_spec)
+        self.bm25 = BM25Index()
+        self.questions = QuestionIndex()
+        self.docs = DocumentStore()
+
+    def __len__(self):
+        return len(self.docs)
+
+    @property
+    def documents(self) -> List[Document]:
+        return list(self.docs.values())
+
+    def add_rows(self, docs: List[Document], vectors: List[List[float]]):
+        """docs должны содержать metadata['row_id'] и metadata['chunk_id']"""
+        ids = [doc.metadata['chunk_id'] for doc in docs]
+        self.vector.add(ids, vectors)
+        self.bm25.add_many(ids, [doc.page_content for doc in docs])
+        rows = set()
+        for doc in docs:
+            self.docs.add(doc)
+            row_id = doc.metadata['row_id']
+            if row_id not in rows:
+                rows.add(row_id)
+                self.questions.add(row_id, normalize_query(str(doc.metadata.get('question', ''))))
+
+    def remove_row(self, row_id: int):
+        chunk_ids = self.docs.row_chunks(row_id)
+        self.questions.remove(row_id)
+        self.vector.remove(chunk_ids)
+        for chunk_id in chunk_ids:
+            self.bm25.remove(chunk_id)
+            self.docs.remove(chunk_id)
+
+    def copy(self) -> "KnowledgeIndex":
+        """Независимая копия для второй реплики; неизменяемые части (снапшот, документы) разделяются"""
+        other = KnowledgeIndex.__new__(KnowledgeIndex)
+        other.vector = self.vector.copy()
+        other.bm25 = self.bm25.copy()
+        other.questions = self.questions.copy()
+        other.docs = self.docs.copy()
+        return other
+
+    def save(self, path: str):
+        """Пишет снапшот; индекс должен быть собран в памяти (не загружен из снапшота)"""
+        os.makedirs(path, exist_ok=True)
+        state = {
+            'vector': self.vector.save(path),
+            'bm25': self.bm25.save(path),
+        }
+        self.questions.save(path)
+        self.docs.save(path)
+        with open(os.path.join(path, STATE_FILE), 'wb') as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, path: str, vector_spec: VectorIndexSpec = None) -> "KnowledgeIndex":
+        """
+        Отображает снапшот в память.
+
+        vector_spec должен совпадать с тем, с которым индекс собран; параметры поиска берутся из него.
+        """
+        with open(os.path.join(path, STATE_FILE), 'rb') as f:
+            state = pickle.load(f)
+        index = cls(vector_spec)
+        index.vector = VectorIndex.load(path, state['vector'], vector_spec)
+        index.bm25 = BM25Index.load(path, state['bm25'])
+        index.questions = QuestionIndex.load(path)
+        index.docs = DocumentStore.load(path)
+        return index
@@ -0,0 +1,279 @@
+import os
+import sys
+import uuid
+import sqlite3
+import hashlib
+import threading
+import pandas as pd
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from app.indexes import normalize_query
+
+
+# Колонки CSV базы знаний -> поля хранилища
+CSV_COLUMNS = {
+    'Основная категория': 'category',
+    'Подкатегория': 'subcategory',
+    'Пример вопроса': 'question',
+    'Шаблонный ответ': 'answer',
+    'Целевая аудитория': 'target_group',
+}
+
+FIELDS = ('category', 'subcategory', 'question', 'target_group', 'answer', 'is_original')
+
+# Целевая аудитория строк, добавленных модерацией
+DEFAULT_TARGET_GROUP = "все клиенты"
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class KnowledgeBaseStore:
+    """
+    База знаний в SQLite.
+
+    У строки постоянный row_id (от него считаются id чанков в индексах) и
+    уникальный ключ - нормализованный вопрос (normalize_query), так что
+    поиск строки по вопросу идёт по индексу, а правка - это UPDATE или INSERT
+    одной строки: стоимость записи O(изменённых строк), а не O(размера БЗ).
+    Каждая запись увеличивает seq; вместе со store_id он однозначно описывает
+    содержимое и служит ключом снапшота индексов. CSV - только формат
+    импорта и экспорта.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS kb_rows (
+                row_id INTEGER PRIMARY KEY,
+                question_key TEXT NOT NULL UNIQUE,
+                question TEXT NOT NULL,
+                answer TEXT NOT NULL,
+                category TEXT NOT NULL DEFAULT '',
+                subcategory TEXT NOT NULL DEFAULT '',
+                target_group TEXT NOT NULL DEFAULT '',
+                is_original INTEGER NOT NULL DEFAULT 0,
+                seq INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS ix_kb_rows_seq ON kb_rows (seq);
+            CREATE TABLE IF NOT EXISTS kb_meta (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            ) WITHOUT ROWID;
+        """)
+        if self.get_meta("store_id") is None:
+            self._set_meta("store_id", uuid.uuid4().hex)
+            self._set_meta("seq", "0")
+        self.conn.commit()
+
+        self.store_id = self.get_meta("store_id")
+
+    def __len__(self):
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM kb_rows").fetchone()[0]
+
+    @property
+    def seq(self) -> int:
+        """Номер последнего изменения; читается из базы - хранилище могут менять другие процессы"""
+        with self._lock:
+            return int(self.get_meta("seq"))
+
+    @staticmethod
+    def question_key(question: str) -> str:
+        return normalize_query(question) or question.strip().lower()
+
+    @staticmethod
+    def _row(record: sqlite3.Row) -> Dict:
+        row = {field: record[field] for field in FIELDS}
+        row['is_original'] = bool(row['is_original'])
+        return row
+
+    def get_meta(self, key: str) -> Optional[str]:
+        record = self.conn.execute("SELECT value FROM kb_meta WHERE key = ?", (key,)).fetchone()
+        return record[0] if record else None
+
+    def _set_meta(self, key: str, value: str):
+        self.conn.execute(
+            "INSERT INTO kb_meta (key, value) VALUES (?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (key, value)
+        )
+
+    def _next_seq(self) -> int:
+        # UPDATE открывает пишущую транзакцию: параллельные писатели получат разные seq
+        self.conn.execute("UPDATE kb_meta SET value = CAST(value AS INTEGER) + 1 WHERE key = 'seq'")
+        return int(self.get_meta("seq"))
+
+    def rows(self) -> Iterator[Tuple[int, Dict]]:
+        """Все строки по возрастанию row_id"""
+        with self._lock:
+            records = self.conn.execute(f"SELECT row_id, {', '.join(FIELDS)} FROM kb_rows ORDER BY row_id").fetchall()
+        for record in records:
+            yield record['row_id'], self._row(record)
+
+    def get(self, row_id: int) -> Optional[Dict]:
+        with self._lock:
+            record = self.conn.execute(
+                f"SELECT {', '.join(FIELDS)} FROM kb_rows WHERE row_id = ?", (row_id,)
+            ).fetchone()
+        return self._row(record) if record else None
+
+    def find(self, question: str) -> Optional[int]:
+        """row_id строки с тем же нормализованным вопросом"""
+        with self._lock:
+            record = self.conn.execute(
+                "SELECT row_id FROM kb_rows WHERE question_key = ?", (self.question_key(question),)
+            ).fetchone()
+        return record[0] if record else None
+
+    def changes_since(self, seq: int) -> List[Tuple[int, Dict, int]]:
+        """(row_id, строка, seq строки) для строк, изменённых после seq - в том числе другими процессами"""
+        with self._lock:
+            records = self.conn.execute(
+                f"SELECT row_id, seq, {', '.join(FIELDS)} FROM kb_rows WHERE seq > ? ORDER BY seq, row_id", (seq,)
+            ).fetchall()
+        return [(record['row_id'], self._row(record), record['seq']) for record in records]
+
+    def category_counts(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self.conn.execute("SELECT category, COUNT(*) FROM kb_rows GROUP BY category").fetchall())
+
+    def apply_changes(self, changes: List[Dict]) -> List[Tuple[int, Optional[Dict], Dict]]:
+        """
+        Применяет правки {'question', 'answer', 'taxonomy'} одной транзакцией.
+
+        Строка находится по нормализованному вопросу: есть - обновляются ответ
+        и переданные поля таксономии, нет - добавляется новая. Возвращает
+        (row_id, строка до правки или None, строка после) по каждой правке.
+        """
+        results = []
+        with self._lock, self.conn:
+            seq = self._next_seq()
+            for change in changes:
+                key = self.question_key(change['question'])
+                taxonomy = change.get('taxonomy') or {}
+                record = self.conn.execute(
+                    f"SELECT row_id, {', '.join(FIELDS)} FROM kb_rows WHERE question_key = ?", (key,)
+                ).fetchone()
+                if record is not None:
+                    old = self._row(record)
+                    new = {
+                        **old,
+                        'answer': change['answer'],
+                        'category': taxonomy.get('category', old['category']),
+                        'subcategory': taxonomy.get('subcategory', old['subcategory']),
+                    }
+                    self.conn.execute(
+                        "UPDATE kb_rows SET answer = ?, category = ?, subcategory = ?, seq = ? WHERE row_id = ?",
+                        (new['answer'], new['category'], new['subcategory'], seq, record['row_id'])
+                    )
+                    results.append((record['row_id'], old, new))
+                else:
+                    new = {
+                        'category': taxonomy.get('category', ''),
+                        'subcategory': taxonomy.get('subcategory', ''),
+                        'question': change['question'],
+                        'target_group': DEFAULT_TARGET_GROUP,
+                        'answer': change['answer'],
+                        'is_original': False,
+                    }
+                    cursor = self.conn.execute(
+                        "INSERT INTO kb_rows (question_key, question, answer, category, subcategory, "
+                        "target_group, is_original, seq) VALUES (?, ?, ?, ?, ?, ?, 0, ?)",
+                        (key, new['question'], new['answer'], new['category'], new['subcategory'],
+                         new['target_group'], seq)
+                    )
+                    results.append((cursor.lastrowid, None, new))
+        return results
+
+    def import_records(self, records: Iterable[Dict]) -> int:
+        """
+        Добавляет или обновляет строки по нормализованному вопросу (одна транзакция).
+
+        Повтор вопроса внутри records - побеждает последняя строка.
+        """
+        count = 0
+        with self._lock, self.conn:
+            seq = self._next_seq()
+            for record in records:
+                is_original = str(record.get('is_original', False)).strip().lower() == 'true'
+                self.conn.execute(
+                    "INSERT INTO kb_rows (question_key, question, answer, category, subcategory, "
+                    "target_group, is_original, seq) VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT(question_key) DO UPDATE SET question = excluded.question, "
+                    "answer = excluded.answer, category = excluded.category, "
+                    "subcategory = excluded.subcategory, target_group = excluded.target_group, "
+                    "is_original = excluded.is_original, seq = excluded.seq",
+                    (self.question_key(record['question']), record['question'], record['answer'],
+                     record.get('category') or '', record.get('subcategory') or '',
+                     record.get('target_group') or '', int(is_original), seq)
+                )
+                count += 1
+        return count
+
+    def import_frame(self, df: pd.DataFrame) -> int:
+        """DataFrame с колонками FIELDS (пустые ячейки - пустые строки)"""
+        df = df.dropna(subset=['question', 'answer'])
+        return self.import_records(df.astype(object).where(df.notna(), None).to_dict('records'))
+
+    def import_csv(self, csv_path: str) -> int:
+        count = self.import_frame(pd.read_csv(csv_path).rename(columns=CSV_COLUMNS))
+        with self._lock, self.conn:
+            self._set_meta("csv_sha256", file_sha256(csv_path))
+        return count
+
+    def export_csv(self, csv_path: str):
+        """Выгружает БЗ в CSV с исходными названиями колонок (запись через временный файл)"""
+        df = pd.DataFrame([row for _, row in self.rows()], columns=list(FIELDS))
+        df = df.rename(columns={field: column for column, field in CSV_COLUMNS.items()})
+        tmp_path = csv_path + ".tmp"
+        df.to_csv(tmp_path, index=False)
+        os.replace(tmp_path, csv_path)
+        with self._lock, self.conn:
+            self._set_meta("csv_sha256", file_sha256(csv_path))
+
+    def csv_changed(self, csv_path: str) -> bool:
+        """CSV отличается от последнего импортированного или выгруженного"""
+        return file_sha256(csv_path) != self.get_meta("csv_sha256")
+
+    def close(self):
+        self.conn.close()
+
+
+def main(argv=None) -> int:
+    """python -m app.kb_store import|export <csv> [--store PATH]"""
+    import argparse
+    from app.config import settings
+
+    parser = argparse.ArgumentParser(prog="python -m app.kb_store",
+                                     description="Импорт и экспорт базы знаний в CSV")
+    parser.add_argument("command", choices=["import", "export"])
+    parser.add_argument("csv", nargs="?", default=settings.KNOWLEDGE_BASE_PATH)
+    parser.add_argument("--store", default=settings.KB_STORE_PATH)
+    args = parser.parse_args(argv)
+
+    store = KnowledgeBaseStore(args.store)
+    if args.command == "import":
+        count = store.import_csv(args.csv)
+        print(f"Импортировано {count} строк из {args.csv}, в базе знаний {len(store)} (seq {store.seq})")
+    else:
+        store.export_csv(args.csv)
+        print(f"Выгружено {len(store)} строк в {args.csv}")
+    store.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
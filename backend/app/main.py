@@ -1,20 +1,30 @@
-from fastapi import FastAPI, Depends, HTTPException
+import json
+import asyncio
+import time
+from fastapi import FastAPI, Depends, Header, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func
+from sqlalchemy import select
 from datetime import datetime
-from typing import List
+from typing import Dict, List, Literal, Optional
 
 from app.models import (
     SearchRequest, SearchResponse, 
+    StreamSearchRequest, BatchSearchRequest, BatchSearchResponse,
     FeedbackRequest, FeedbackResponse,
     QAAddRequest, QAAddResponse,
     PendingListResponse, PendingItem,
     ResolveRequest, ResolveResponse,
+    BatchResolveRequest, BatchResolveItem, BatchResolveResponse, IndexJobStatus, IndexStatus,
     Stats
 )
-from app.database import init_db, get_session, FeedbackItem, QAQueue, generate_token
+from app.database import init_db, get_session, async_session_maker, FeedbackItem, QAQueue
+from app.feedback_queue import FeedbackQueueFull, feedback_writer
 from app.rag_service import rag_service
+from app.config import settings
+from app import metrics, moderation, tracing
+from app.profiler import profiler
 
 app = FastAPI(
     title="RAG Support API", 
@@ -49,10 +59,55 @@ app.add_middleware(
 )
 
 
+@app.middleware("http")
+async def track_request_metrics(request: Request, call_next):
+    # Метка - шаблон маршрута, а не путь: число серий не растёт от параметров
+    metrics.HTTP_IN_FLIGHT.inc()
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        metrics.HTTP_IN_FLIGHT.dec()
+        route = request.scope.get("route")
+        metrics.HTTP_REQUEST_SECONDS.labels(
+            method=request.method,
+            route=route.path if route is not None else "unmatched",
+            status=str(status)
+        ).observe(time.perf_counter() - start)
+
+
 @app.on_event("startup")
 async def startup_event():
     await init_db()
-    print("Database initialized. RAG will initialize on first request.")
+    async with async_session_maker() as session:
+        await moderation.backfill_counters(session)
+    feedback_writer.start()
+    rag_service.start_initialization()
+    print("Database initialized. RAG initialization started in background.")
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await feedback_writer.close()
+    await rag_service.close()
+
+
+# Подсказка клиенту, через сколько секунд повторить запрос, пока индекс загружается
+RETRY_AFTER_SECONDS = 5
+
+
+def ensure_rag_ready():
+    """Быстрый 503 вместо ожидания, пока индекс не готов"""
+    if not rag_service.is_ready:
+        rag_service.start_initialization()
+        raise HTTPException(
+            status_code=503,
+            detail=f"База знаний загружается ({rag_service.phase}), повторите позже",
+            headers={"Retry-After": str(RETRY_AFTER_SECONDS)}
+        )
 
 
 @app.get("/", tags=["Health"])
@@ -65,39 +120,237 @@ async def root():
     return {"status": "ok", "message": "RAG Support API is running"}
 
 
+@app.get("/ready", tags=["Health"])
+async def ready():
+    """
+    Readiness endpoint
+    
+    Возвращает фазу загрузки индекса и прогресс (эмбеддинги посчитаны / всего).
+    Отвечает 503, пока поиск недоступен, 200 - когда индекс готов.
+    """
+    state = rag_service.readiness()
+    if not state['ready']:
+        return JSONResponse(
+            status_code=503,
+            content=state,
+            headers={"Retry-After": str(RETRY_AFTER_SECONDS)}
+        )
+    return state
+
+
+@app.get("/metrics", tags=["Health"])
+async def prometheus_metrics():
+    """
+    Метрики в формате Prometheus
+    
+    Гистограммы стадий поиска, сборки и обновления индекса, запросов к API
+    эмбеддингов, HTTP-эндпоинтов и SQL-запросов; счётчики кэшей и запросов в работе.
+    """
+    body, content_type = metrics.render(rag_service.metrics_cache_stats)
+    return Response(content=body, media_type=content_type)
+
+
+def ensure_admin(token: Optional[str]):
+    if not settings.ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Админ-эндпоинты отключены: не задан ADMIN_TOKEN")
+    if token != settings.ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Нужен корректный X-Admin-Token")
+
+
+@app.post("/api/admin/profile", tags=["Admin"])
+async def run_profiler(
+    seconds: float = Query(10, gt=0),
+    interval_ms: float = Query(5, ge=1, le=1000),
+    x_admin_token: Optional[str] = Header(None)
+):
+    """
+    Сэмплирующий профайлер живого процесса на seconds секунд
+    
+    Снимает стеки всех потоков раз в interval_ms и возвращает файл в формате
+    collapsed stacks - его понимают flamegraph.pl, speedscope и inferno.
+    Одновременно работает только один сеанс (иначе 409). Длительность
+    ограничена PROFILER_MAX_SECONDS. Нужен заголовок X-Admin-Token; без
+    ADMIN_TOKEN в настройках эндпоинт отключён (404).
+    """
+    ensure_admin(x_admin_token)
+    if seconds > settings.PROFILER_MAX_SECONDS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Максимальная длительность профилирования: {settings.PROFILER_MAX_SECONDS} с"
+        )
+    
+    result = await asyncio.to_thread(profiler.run, seconds, interval_ms / 1000)
+    if result is None:
+        raise HTTPException(status_code=409, detail="Профилирование уже запущено")
+    
+    return PlainTextResponse(
+        result['collapsed'],
+        headers={
+            'Content-Disposition': f'attachment; filename="profile-{int(time.time())}.collapsed"',
+            'X-Profile-Samples': str(result['samples']),
+            'X-Profile-Duration': f"{result['duration']:.3f}",
+        }
+    )
+
+
+@app.get("/api/embeddings/cache", tags=["Health"])
+async def embedding_cache_stats():
+    """
+    Статистика кэша эмбеддингов
+
+    Возвращает количество попаданий/промахов с момента запуска и размер кэша
+    """
+    if rag_service.embedding_cache is None:
+        return {"status": "not_initialized"}
+    return rag_service.embedding_cache.stats()
+
+
+@app.get("/api/search/cache", tags=["Health"])
+async def search_cache_stats():
+    """
+    Статистика кэшей поиска
+
+    Кэш эмбеддингов запросов и кэш результатов: попадания, промахи, вытеснения, память
+    """
+    return rag_service.cache_stats()
+
+
 @app.post("/api/search", response_model=SearchResponse, tags=["Search"])
-async def search_answer(request: SearchRequest):
+async def search_answer(
+    request: SearchRequest,
+    debug: bool = False,
+    x_debug: Optional[str] = Header(None)
+):
     """
     Поиск ответа в базе знаний
     
-    Использует ensemble подход: векторный поиск (FAISS + BGE-M3) + лексический поиск (BM25)
+    Использует гибридный подход: векторный поиск (FAISS + BGE-M3) + лексический поиск (BM25),
+    слияние через weighted RRF или нормализованную сумму оценок (FUSION_METHOD)
     
     - **query**: вопрос клиента
-    - **top_k**: количество результатов (по умолчанию 3)
+    - **top_k**: количество результатов (по умолчанию 3, до 50); оценки слияния - в results_meta
+    
+    Если запрос совпадает с вопросом из базы (точно или почти точно), ответ
+    берётся без эмбеддингов; путь указан в results_meta[].path
+    (exact / near_exact / hybrid; bm25 - результаты, которыми быстрый путь
+    дополнен до top_k).
+    
+    Возвращает шаблонные ответы напрямую из базы знаний.
+    Пока индекс загружается, сразу отвечает 503 с заголовком Retry-After.
+    
+    С `?debug=true` или заголовком `X-Debug: 1` в поле debug возвращается дерево
+    span'ов запроса с длительностями: normalize, fast_path, result_cache, embed
+    (queue - ожидание батча, http - запрос к API), bm25, faiss, fusion,
+    build_result, serialize, а также db, если запрос обращался к БД.
+    """
+    ensure_rag_ready()
+    if not (debug or x_debug in ("1", "true")):
+        try:
+            result = await rag_service.search(request.query, request.top_k)
+            with metrics.stage("serialize"):
+                return SearchResponse(**result)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Ошибка поиска: {str(e)}")
+    
+    try:
+        with tracing.trace("search") as root:
+            result = await rag_service.search(request.query, request.top_k)
+            with metrics.stage("serialize"):
+                response = SearchResponse(**result)
+        # Результат может быть из кэша: дерево кладём в копию ответа
+        return response.model_copy(update={'debug': root.to_dict(root.start)})
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Ошибка поиска: {str(e)}")
+
+
+@app.post("/api/search/stream", tags=["Search"])
+async def search_stream(request: StreamSearchRequest):
+    """
+    Поиск с потоковой генерацией ответа LLM (Server-Sent Events)
+    
+    События:
+    - **retrieval** - сразу после поиска: draft, alternatives, results_meta
+    - **token** - фрагменты ответа LLM по мере генерации
+    - **fallback** - LLM не уложилась в дедлайн или вернула ошибку
+    - **done** - итоговый ответ, source: llm или template (шаблонный draft)
+    - **error** - ошибка поиска
+    
+    - **deadline_seconds**: дедлайн на весь запрос (по умолчанию LLM_STREAM_DEADLINE_SECONDS)
+    """
+    ensure_rag_ready()
     
-    Возвращает шаблонные ответы напрямую из базы знаний
+    def sse(event: str, data: dict) -> str:
+        return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+    
+    async def events():
+        try:
+            async for event, data in rag_service.search_stream(
+                request.query, request.top_k, request.deadline_seconds
+            ):
+                yield sse(event, data)
+        except Exception as e:
+            yield sse("error", {'detail': f"Ошибка поиска: {str(e)}"})
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+@app.post("/api/search/batch", response_model=BatchSearchResponse, tags=["Search"])
+async def search_batch(request: BatchSearchRequest):
     """
+    Пакетный поиск: до SEARCH_BATCH_MAX_QUERIES запросов за один вызов
+    
+    Эмбеддинги всех запросов считаются одним батчем, поиск FAISS и BM25 -
+    одним матричным проходом. Элементы items идут в порядке queries.
+    
+    - **queries**: список вопросов
+    - **top_k**: количество результатов на запрос (до 50)
+    - **stream**: true - ответ в NDJSON, по строке {"index": i, ...} на запрос
+      по мере готовности (быстрый путь и кэш - сразу)
+    """
+    ensure_rag_ready()
+    if len(request.queries) > settings.SEARCH_BATCH_MAX_QUERIES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Слишком много запросов: максимум {settings.SEARCH_BATCH_MAX_QUERIES}"
+        )
+    
+    if request.stream:
+        async def ndjson():
+            try:
+                async for i, result in rag_service.search_batch(request.queries, request.top_k):
+                    item = SearchResponse(**result).model_dump()
+                    yield json.dumps({'index': i, **item}, ensure_ascii=False) + "\n"
+            except Exception as e:
+                yield json.dumps({'error': f"Ошибка поиска: {str(e)}"}, ensure_ascii=False) + "\n"
+        
+        return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+    
     try:
-        if rag_service.vector_store is None:
-            print("Initializing RAG service...")
-            await rag_service.initialize()
-        result = await rag_service.search(request.query, request.top_k)
-        return SearchResponse(**result)
+        items = [None] * len(request.queries)
+        async for i, result in rag_service.search_batch(request.queries, request.top_k):
+            items[i] = SearchResponse(**result)
+        return BatchSearchResponse(items=items)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка поиска: {str(e)}")
 
 
 @app.post("/api/feedback", response_model=FeedbackResponse, tags=["Feedback"])
-async def send_feedback(
-    request: FeedbackRequest,
-    session: AsyncSession = Depends(get_session)
-):
+async def send_feedback(request: FeedbackRequest):
     """
     Отправка feedback от оператора
     
     Оператор может пожаловаться на неточный ответ и предложить исправление.
     Правка сохраняется со статусом 'pending' и ждет модерации.
     
+    Ответ приходит сразу: правки пишутся в базу пачками в фоне (write-behind).
+    Такая же правка (вопрос + исправленный ответ), отправленная недавно другим
+    оператором, не создаёт новую запись, а добавляет ей голос (merged=true).
+    При переполнении буфера - 503 с Retry-After.
+    
     - **original_question**: исходный вопрос клиента
     - **old_answer**: текущий ответ из базы
     - **edited_answer**: исправленный ответ
@@ -106,76 +359,66 @@ async def send_feedback(
     Возвращает уникальный токен для отслеживания
     """
     try:
-        token = generate_token()
-        
-        feedback = FeedbackItem(
-            internal_token=token,
+        token, merged = await feedback_writer.submit(
             original_question=request.original_question,
             old_answer=request.old_answer,
             edited_answer=request.edited_answer,
             note=request.note,
-            status="pending"
+            suggested_by=request.suggested_by
+        )
+        return FeedbackResponse(status="received", internal_token=token, merged=merged)
+    except FeedbackQueueFull as e:
+        raise HTTPException(
+            status_code=503,
+            detail=f"Очередь правок переполнена, повторите позже: {str(e)}",
+            headers={"Retry-After": "1"}
         )
-        
-        session.add(feedback)
-        await session.commit()
-        
-        return FeedbackResponse(status="received", internal_token=token)
     except Exception as e:
-        await session.rollback()
         raise HTTPException(status_code=500, detail=f"Ошибка сохранения feedback: {str(e)}")
 
 
 
 
 @app.get("/api/moderation/pending", response_model=PendingListResponse, tags=["Moderation"])
-async def get_pending_feedback(session: AsyncSession = Depends(get_session)):
+async def get_pending_feedback(
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    source: Optional[Literal["feedback", "qa"]] = None,
+    category: Optional[str] = None,
+    suggested_by: Optional[str] = None,
+    session: AsyncSession = Depends(get_session)
+):
     """
-    Список правок на модерации
+    Список правок на модерации (постранично)
+    
+    Правки операторов (feedback) и новые пары вопрос-ответ (qa) в одной очереди,
+    по возрастанию даты создания. Объединение делается в SQL (UNION ALL),
+    пагинация - по курсору (created_at, id), а не по OFFSET.
     
-    Возвращает все правки со статусом 'pending', которые ожидают решения модератора.
+    - **limit**: размер страницы (до 500)
+    - **cursor**: next_cursor из предыдущей страницы
+    - **source**: feedback или qa
+    - **category**: категория (есть только у qa)
+    - **suggested_by**: автор правки (есть только у feedback)
     
     Используется в Moderator UI для отображения очереди модерации.
     """
     try:
-        feedback_result = await session.execute(
-            select(FeedbackItem).where(FeedbackItem.status == "pending").order_by(FeedbackItem.created_at)
+        items, next_cursor = await moderation.pending_page(
+            session, limit, cursor, source=source, category=category, suggested_by=suggested_by
         )
-        feedback_items = feedback_result.scalars().all()
-        
-        qa_result = await session.execute(
-            select(QAQueue).where(QAQueue.status == "pending").order_by(QAQueue.created_at)
-        )
-        qa_items = qa_result.scalars().all()
-        
-        items = list(feedback_items) + [
-            type('FeedbackItem', (), {
-                'id': qa.id,
-                'question': qa.question,
-                'answer': qa.answer,
-                'category': qa.category,
-                'subcategory': qa.subcategory,
-                'status': qa.status,
-                'created_at': qa.created_at,
-                'internal_token': f'qa_{qa.id}'
-            })() for qa in qa_items
-        ]
-        
-        pending_items = [
-            PendingItem(
-                internal_token=item.internal_token,
-                original_question=item.original_question,
-                old_answer=item.old_answer,
-                edited_answer=item.edited_answer,
-                suggested_by=item.suggested_by,
-                created_at=item.created_at.isoformat()
-            )
-            for item in items
-        ]
-        
-        return PendingListResponse(items=pending_items)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка получения списка: {str(e)}")
+    
+    return PendingListResponse(
+        items=[
+            PendingItem(**{**item, 'created_at': item['created_at'].isoformat()})
+            for item in items
+        ],
+        next_cursor=next_cursor
+    )
 
 
 @app.post("/api/moderation/resolve", response_model=ResolveResponse, tags=["Moderation"])
@@ -187,20 +430,29 @@ async def resolve_feedback(
     Принять или отклонить правку (модератор)
     
     При **approve**:
-    - База знаний обновляется в памяти
-    - Индексы FAISS + BM25 пересоздаются
-    - CSV файл сохраняется на диск
     - Статус правки меняется на 'approved'
+    - Изменение БЗ ставится в очередь обновления индекса (job_id); фоновый воркер
+      склеивает одновременные правки в одну инкрементальную пересборку
+      FAISS + BM25 и одну запись в KB store
+    - Ответ ждёт применения не дольше INDEX_RESOLVE_WAIT_SECONDS:
+      reembedded=true - правка уже в индексе, false - ещё в очереди
     
     При **reject**:
     - Правка отклоняется
     - Статус правки меняется на 'rejected'
     - База знаний НЕ обновляется
     
+    Уже принятую или отклонённую правку повторно решить нельзя - 409.
+    
     - **internal_token**: токен правки из списка pending
     - **action**: "approve" или "reject"
     """
     try:
+        if request.internal_token.startswith(moderation.QA_TOKEN_PREFIX):
+            return await resolve_qa_item(request, session)
+        
+        # Правка могла ещё не дойти из буфера write-behind до базы
+        await feedback_writer.ensure_saved(request.internal_token)
         result = await session.execute(
             select(FeedbackItem).where(FeedbackItem.internal_token == request.internal_token)
         )
@@ -209,23 +461,25 @@ async def resolve_feedback(
         if not item:
             raise HTTPException(status_code=404, detail="Правка не найдена")
         
+        old_status = item.status
+        if old_status != "pending":
+            raise HTTPException(status_code=409, detail=f"Правка уже обработана ({old_status})")
         if request.action == "approve":
+            ensure_rag_ready()
             item.status = "approved"
             item.resolved_at = datetime.utcnow()
+            await moderation.bump_counters(session, moderation.feedback_resolved(item, old_status))
             await session.commit()
+            feedback_writer.forget([item.internal_token])
             
-            await rag_service.rebuild_index_for_item(
-                question=item.original_question,
-                new_answer=item.edited_answer,
-                taxonomy={}
-            )
-            
-            return ResolveResponse(status="applied", reembedded=True)
+            return await enqueue_kb_change(item.original_question, item.edited_answer, {})
         
         elif request.action == "reject":
             item.status = "rejected"
             item.resolved_at = datetime.utcnow()
+            await moderation.bump_counters(session, moderation.feedback_resolved(item, old_status))
             await session.commit()
+            feedback_writer.forget([item.internal_token])
             
             return ResolveResponse(status="rejected", reembedded=False)
         
@@ -239,41 +493,157 @@ async def resolve_feedback(
         raise HTTPException(status_code=500, detail=f"Ошибка обработки: {str(e)}")
 
 
+async def enqueue_kb_change(question: str, answer: str, taxonomy: Dict) -> ResolveResponse:
+    """Ставит принятую правку в очередь обновления индекса и ждёт её не дольше INDEX_RESOLVE_WAIT_SECONDS"""
+    job = rag_service.submit_kb_changes([{'question': question, 'answer': answer, 'taxonomy': taxonomy}])
+    job = await rag_service.index_updates.wait(job, settings.INDEX_RESOLVE_WAIT_SECONDS)
+    if job.status == "failed":
+        raise HTTPException(status_code=500, detail=f"Ошибка обновления индекса: {job.error}")
+    return ResolveResponse(status="applied", reembedded=job.status == "done", job_id=job.id)
+
+
+async def resolve_qa_item(request: ResolveRequest, session: AsyncSession) -> ResolveResponse:
+    """Решение по новой паре вопрос-ответ из QAQueue (токен qa_<id>)"""
+    qa_id = request.internal_token[len(moderation.QA_TOKEN_PREFIX):]
+    item = await session.get(QAQueue, int(qa_id)) if qa_id.isdigit() else None
+    if not item:
+        raise HTTPException(status_code=404, detail="Правка не найдена")
+    if item.status != "pending":
+        raise HTTPException(status_code=409, detail=f"Правка уже обработана ({item.status})")
+    
+    old_status = item.status
+    if request.action == "approve":
+        ensure_rag_ready()
+        item.status = "approved"
+        item.resolved_at = datetime.utcnow()
+        await moderation.bump_counters(session, moderation.qa_resolved(item, old_status))
+        await session.commit()
+        
+        return await enqueue_kb_change(
+            item.question, item.answer, {'category': item.category, 'subcategory': item.subcategory}
+        )
+    
+    if request.action == "reject":
+        item.status = "rejected"
+        item.resolved_at = datetime.utcnow()
+        await moderation.bump_counters(session, moderation.qa_resolved(item, old_status))
+        await session.commit()
+        return ResolveResponse(status="rejected", reembedded=False)
+    
+    raise HTTPException(status_code=400, detail="Неверное действие")
+
+
+@app.post("/api/moderation/resolve/batch", response_model=BatchResolveResponse, tags=["Moderation"])
+async def resolve_feedback_batch(
+    request: BatchResolveRequest,
+    session: AsyncSession = Depends(get_session)
+):
+    """
+    Принять или отклонить несколько правок за один запрос (модератор)
+    
+    Все смены статусов - в одной транзакции. Все принятые правки применяются
+    к базе знаний одним заданием: один пересчёт эмбеддингов изменённых строк,
+    одна запись в KB store и одна публикация индекса. Задание выполняется в фоне,
+    его состояние - GET /api/index/jobs/{job_id}.
+    
+    - **items**: список {internal_token, action}, до MODERATION_BATCH_MAX_ITEMS
+    
+    Решаются только правки на модерации (pending). Статус по каждой правке:
+    applied, rejected, not_found, already_resolved (уже принята или отклонена -
+    не меняется), invalid_action, duplicate
+    """
+    if len(request.items) > settings.MODERATION_BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Слишком много правок: {len(request.items)} > {settings.MODERATION_BATCH_MAX_ITEMS}"
+        )
+    if any(item.action == "approve" for item in request.items):
+        ensure_rag_ready()
+    
+    try:
+        # Правки могли ещё не дойти из буфера write-behind до базы
+        for item in request.items:
+            await feedback_writer.ensure_saved(item.internal_token)
+        results, changes = await moderation.resolve_batch(
+            session, [(item.internal_token, item.action) for item in request.items]
+        )
+        await session.commit()
+    except Exception as e:
+        await session.rollback()
+        raise HTTPException(status_code=500, detail=f"Ошибка обработки: {str(e)}")
+    feedback_writer.forget(
+        result['internal_token'] for result in results if result['status'] in ("applied", "rejected")
+    )
+    
+    job = rag_service.submit_kb_changes(changes) if changes else None
+    return BatchResolveResponse(
+        items=[BatchResolveItem(**result) for result in results],
+        job_id=job.id if job else None
+    )
+
+
+@app.get("/api/index/jobs/{job_id}", response_model=IndexJobStatus, tags=["Index"])
+async def get_index_job(job_id: str):
+    """
+    Состояние задания обновления индекса
+    
+    queued / running / done / failed, стадия выполнения (kb / embedding /
+    publishing), версия опубликованного индекса, сколько заданий применено
+    той же пересборкой, и ошибка, если была. Задания хранятся в воркере,
+    который их принял: при нескольких воркерах uvicorn запрос на другой
+    воркер вернёт 404.
+    """
+    job = rag_service.index_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Задание не найдено")
+    return IndexJobStatus(**job.to_dict())
+
+
+@app.get("/api/index/status", response_model=IndexStatus, tags=["Index"])
+async def get_index_status():
+    """
+    Состояние индекса и очереди обновлений
+    
+    Версия опубликованного индекса, число строк БЗ и чанков, отображённый
+    снапшот и seq хранилища, до которого доведён индекс этого воркера, задания
+    в очереди и выполняющиеся, итог последней пересборки.
+    """
+    return IndexStatus(**rag_service.index_status())
+
+
 @app.get("/api/moderation/stats", response_model=Stats, tags=["Moderation"])
 async def get_moderation_stats(session: AsyncSession = Depends(get_session)):
     """
     Статистика модерации
     
     Возвращает:
-    - Количество правок на модерации (pending)
-    - Количество принятых правок (approved)
-    - Количество отклоненных правок (rejected)
+    - Количество правок операторов на модерации (pending)
+    - Количество принятых правок (approved), включая новые пары вопрос-ответ
+    - Количество отклоненных правок (rejected), включая новые пары вопрос-ответ
+    - Среднее время от создания правки или пары до решения
+    - Покрытие категорий базы знаний (число вопросов и доля)
+    - Активность операторов: предложено / принято / отклонено
     
+    Счётчики обновляются в тех же транзакциях, что и правки, поэтому запрос
+    читает одну маленькую таблицу и не зависит от числа правок.
     Используется в Moderator UI для отображения метрик
     """
     try:
-        total_pending = await session.scalar(
-            select(func.count()).select_from(FeedbackItem).where(FeedbackItem.status == "pending")
-        )
-        
-        total_approved = await session.scalar(
-            select(func.count()).select_from(FeedbackItem).where(FeedbackItem.status == "approved")
-        )
-        
-        total_rejected = await session.scalar(
-            select(func.count()).select_from(FeedbackItem).where(FeedbackItem.status == "rejected")
-        )
-        
-        return Stats(
-            total_pending=total_pending or 0,
-            total_approved=total_approved or 0,
-            total_rejected=total_rejected or 0,
-            avg_response_time="N/A",
-            category_coverage=None,
-            operator_activity=None
-        )
+        counters = await moderation.read_counters(session)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка получения статистики: {str(e)}")
+    
+    resolved = counters.get('resolution:count', 0)
+    avg_seconds = counters.get('resolution:seconds', 0) / resolved if resolved else None
+    return Stats(
+        total_pending=int(counters.get('feedback:pending', 0)),
+        total_approved=int(counters.get('feedback:approved', 0) + counters.get('qa:approved', 0)),
+        total_rejected=int(counters.get('feedback:rejected', 0) + counters.get('qa:rejected', 0)),
+        avg_response_time=moderation.format_duration(avg_seconds),
+        avg_resolution_seconds=round(avg_seconds, 1) if avg_seconds is not None else None,
+        category_coverage=rag_service.category_coverage() or None,
+        operator_activity=moderation.operator_activity(counters) or None
+    )
 
 
 if __name__ == "__main__":
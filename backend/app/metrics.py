@@ -0,0 +1,137 @@
+import os
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, Optional
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+)
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from app import tracing
+
+
+# Границы гистограмм: от сотен микросекунд (FAISS/BM25) до минут (полная сборка)
+FAST_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                0.1, 0.25, 0.5, 1.0, 2.5)
+SLOW_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+SEARCH_STAGES = ("normalize", "fast_path", "result_cache", "embed", "bm25", "faiss", "fusion",
+                 "build_result", "serialize")
+
+SEARCH_STAGE_SECONDS = Histogram(
+    "rag_search_stage_seconds", "Время стадий поиска", ["stage"], buckets=FAST_BUCKETS
+)
+SEARCH_PATHS = Counter(
+    "rag_search_total", "Поисковые запросы по пути ответа", ["path"]
+)
+INDEX_BUILD_SECONDS = Histogram(
+    "rag_index_build_seconds", "Полная сборка индексов (_build_indices)", buckets=SLOW_BUCKETS
+)
+INDEX_REBUILD_SECONDS = Histogram(
+    "rag_index_rebuild_seconds", "Инкрементальное обновление индекса по строке БЗ", buckets=SLOW_BUCKETS
+)
+EMBEDDING_REQUEST_SECONDS = Histogram(
+    "rag_embedding_request_seconds", "HTTP-запрос к API эмбеддингов", ["mode"], buckets=SLOW_BUCKETS
+)
+EMBEDDING_BATCH_SIZE = Histogram(
+    "rag_embedding_batch_size", "Число текстов в одном запросе к API эмбеддингов", ["mode"],
+    buckets=BATCH_BUCKETS
+)
+EMBEDDING_IN_FLIGHT = Gauge(
+    "rag_embedding_requests_in_flight", "Запросы к API эмбеддингов в процессе", ["mode"],
+    multiprocess_mode="livesum"
+)
+HTTP_REQUEST_SECONDS = Histogram(
+    "rag_http_request_seconds", "Обработка HTTP-запроса", ["method", "route", "status"],
+    buckets=FAST_BUCKETS + SLOW_BUCKETS[-8:]
+)
+HTTP_IN_FLIGHT = Gauge(
+    "rag_http_requests_in_flight", "HTTP-запросы в обработке", multiprocess_mode="livesum"
+)
+DB_QUERY_SECONDS = Histogram(
+    "rag_db_query_seconds", "Выполнение SQL-запроса", ["statement"], buckets=FAST_BUCKETS
+)
+FEEDBACK_QUEUE_DEPTH = Gauge(
+    "rag_feedback_queue_depth", "Правки в буфере write-behind, ещё не записанные в базу",
+    multiprocess_mode="livesum"
+)
+FEEDBACK_FLUSH_SIZE = Histogram(
+    "rag_feedback_flush_size", "Новых правок в одной пачке INSERT", buckets=BATCH_BUCKETS + (512, 1024)
+)
+FEEDBACK_SUBMISSIONS = Counter(
+    "rag_feedback_submissions_total", "Отправки правок по результату", ["result"]
+)
+
+# Дочерние серии с фиксированными метками создаются заранее: на горячем пути нет поиска по меткам
+_STAGES = {stage: SEARCH_STAGE_SECONDS.labels(stage=stage) for stage in SEARCH_STAGES}
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Гистограмма стадии; при включённой трассировке запроса - ещё и span"""
+    start = time.perf_counter()
+    try:
+        with tracing.span(name):
+            yield
+    finally:
+        _STAGES[name].observe(time.perf_counter() - start)
+
+
+def instrument_engine(sync_engine):
+    """Время каждого SQL-запроса по типу оператора (SELECT / INSERT / UPDATE ...)"""
+    from sqlalchemy import event
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        start = conn.info["query_start"].pop()
+        end = time.perf_counter()
+        kind = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "OTHER"
+        DB_QUERY_SECONDS.labels(statement=kind).observe(end - start)
+        tracing.record("db", start, end, statement=kind)
+
+
+class CacheCollector:
+    """
+    Счётчики кэшей читаются в момент scrape из их собственной статистики,
+    поэтому на пути запроса не добавляется ни одной операции.
+    """
+
+    def __init__(self, stats: Callable[[], Dict]):
+        self._stats = stats
+
+    def collect(self):
+        hits = CounterMetricFamily("rag_cache_hits", "Попадания в кэш", labels=["cache"])
+        misses = CounterMetricFamily("rag_cache_misses", "Промахи кэша", labels=["cache"])
+        entries = GaugeMetricFamily("rag_cache_entries", "Записей в кэше", labels=["cache"])
+        for name, stats in self._stats().items():
+            if not stats:
+                continue
+            hits.add_metric([name], stats.get('hits', 0))
+            misses.add_metric([name], stats.get('misses', 0))
+            entries.add_metric([name], stats.get('entries', 0))
+        yield hits
+        yield misses
+        yield entries
+
+
+def render(cache_stats: Optional[Callable[[], Dict]] = None):
+    """
+    Тело и Content-Type ответа /metrics.
+
+    При нескольких воркерах uvicorn задайте PROMETHEUS_MULTIPROC_DIR: метрики
+    всех процессов агрегируются из общего каталога (кэши - только текущего воркера).
+    """
+    registry = REGISTRY
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    output = generate_latest(registry)
+    if cache_stats is not None:
+        cache_registry = CollectorRegistry()
+        cache_registry.register(CacheCollector(cache_stats))
+        output += generate_latest(cache_registry)
+    return output, CONTENT_TYPE_LATEST
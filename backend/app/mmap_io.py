@@ -0,0 +1,17 @@
+import os
+import numpy as np
+
+
+def save_array(path: str, name: str, array: np.ndarray):
+    np.save(os.path.join(path, name + ".npy"), np.ascontiguousarray(array), allow_pickle=False)
+
+
+def load_array(path: str, name: str) -> np.ndarray:
+    """
+    Массив снапшота, отображённый в память только для чтения.
+
+    Страницы файла общие для всех процессов, открывших тот же снапшот:
+    воркер uvicorn не держит собственную копию. Изменяемые при правках
+    массивы вызывающий копирует сам (np.array(...)).
+    """
+    return np.load(os.path.join(path, name + ".npy"), mmap_mode='r')
@@ -1,10 +1,10 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import List, Optional, Dict, Any
 
 
 class SearchRequest(BaseModel):
     query: str
-    top_k: int = 3
+    top_k: int = Field(3, ge=1, le=50)
 
 
 class SearchResponse(BaseModel):
@@ -12,6 +12,23 @@ class SearchResponse(BaseModel):
     alternatives: List[str]
     results_meta: List[Dict[str, Any]]
     internal_token: Optional[str] = None
+    index_version: Optional[int] = None
+    debug: Optional[Dict[str, Any]] = None  # дерево span'ов при ?debug=true / X-Debug: 1
+
+
+class StreamSearchRequest(SearchRequest):
+    # Дедлайн генерации, секунды; по умолчанию LLM_STREAM_DEADLINE_SECONDS
+    deadline_seconds: Optional[float] = Field(None, gt=0, le=300)
+
+
+class BatchSearchRequest(BaseModel):
+    queries: List[str] = Field(..., min_length=1)
+    top_k: int = Field(3, ge=1, le=50)
+    stream: bool = False  # NDJSON: по строке на запрос по мере готовности
+
+
+class BatchSearchResponse(BaseModel):
+    items: List[SearchResponse]
 
 
 class FeedbackRequest(BaseModel):
@@ -19,11 +36,13 @@ class FeedbackRequest(BaseModel):
     old_answer: str
     edited_answer: str
     note: Optional[str] = None
+    suggested_by: Optional[str] = None  # оператор, для статистики активности
 
 
 class FeedbackResponse(BaseModel):
     status: str
     internal_token: str
+    merged: bool = False  # такая же правка уже ждёт модерации, засчитан голос
 
 
 class Taxonomy(BaseModel):
@@ -48,11 +67,16 @@ class PendingItem(BaseModel):
     old_answer: str
     edited_answer: str
     suggested_by: Optional[str] = None
+    votes: int = 1  # одинаковые правки от разных операторов схлопываются в одну
     created_at: str
+    source: str = "feedback"  # feedback - правка оператора, qa - новая пара вопрос-ответ
+    category: Optional[str] = None
+    subcategory: Optional[str] = None
 
 
 class PendingListResponse(BaseModel):
     items: List[PendingItem]
+    next_cursor: Optional[str] = None  # None - это последняя страница
 
 
 class ResolveRequest(BaseModel):
@@ -62,7 +86,57 @@ class ResolveRequest(BaseModel):
 
 class ResolveResponse(BaseModel):
     status: str
-    reembedded: bool
+    reembedded: bool  # правка уже в опубликованном индексе
+    job_id: Optional[str] = None  # задание обновления индекса (GET /api/index/jobs/{job_id})
+
+
+class BatchResolveRequest(BaseModel):
+    items: List[ResolveRequest] = Field(..., min_length=1)
+
+
+class BatchResolveItem(BaseModel):
+    internal_token: str
+    status: str  # applied / rejected / not_found / already_resolved / invalid_action / duplicate
+
+
+class BatchResolveResponse(BaseModel):
+    items: List[BatchResolveItem]
+    job_id: Optional[str] = None  # задание обновления индекса; None - принятых правок нет
+
+
+class IndexJobStatus(BaseModel):
+    job_id: str
+    status: str  # queued / running / done / failed
+    stage: Optional[str] = None  # kb / embedding / publishing
+    items: int
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    index_version: Optional[int] = None
+    coalesced: Optional[int] = None  # заданий, применённых одной пересборкой
+    error: Optional[str] = None
+
+
+class IndexStatus(BaseModel):
+    index_version: int
+    phase: str
+    rows: int
+    chunks: int
+    # Фактический тип векторного индекса (flat, если векторов мало для обучения IVF/PQ)
+    vector_index_type: Optional[str] = None
+    # seq хранилища БЗ, до которого доведён индекс этого воркера, и отображённый снапшот
+    kb_seq: Optional[int] = None
+    index_kb_seq: Optional[int] = None
+    snapshot: Optional[str] = None
+    snapshot_kb_seq: Optional[int] = None
+    rows_since_snapshot: int = 0
+    queued_jobs: int
+    queued_changes: int
+    running_jobs: List[str]
+    running_stage: Optional[str] = None
+    last_update: Optional[Dict[str, Any]] = None
+    debounce_seconds: float
+    max_delay_seconds: float
 
 
 class Stats(BaseModel):
@@ -70,6 +144,7 @@ class Stats(BaseModel):
     total_approved: int
     total_rejected: int
     avg_response_time: str
+    avg_resolution_seconds: Optional[float] = None
     category_coverage: Optional[Dict] = None
     operator_activity: Optional[Dict] = None
 
@@ -0,0 +1,371 @@
+import base64
+import json
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import String, and_, cast, func, literal, null, or_, select, union_all
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import FeedbackItem, ModerationCounter, QAQueue
+
+
+SOURCES = ("feedback", "qa")
+
+# Токены элементов QAQueue: у таблицы нет собственного токена
+QA_TOKEN_PREFIX = "qa_"
+
+# Автор правки, если оператор не указан
+ANONYMOUS = "anonymous"
+
+# Признак того, что счётчики заполнены по существующим данным
+COUNTERS_READY = "counters:initialized"
+
+
+def encode_cursor(created_at: datetime, source: str, item_id: int) -> str:
+    raw = json.dumps([created_at.isoformat(), source, item_id]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str, int]:
+    """ValueError, если курсор повреждён"""
+    try:
+        created_at, source, item_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return datetime.fromisoformat(created_at), str(source), int(item_id)
+    except Exception as e:
+        raise ValueError(f"Некорректный курсор: {cursor}") from e
+
+
+def _after_cursor(model, source: str, cursor: Optional[Tuple[datetime, str, int]]):
+    """
+    Условие keyset для одной ветки UNION: (created_at, source, id) > курсора.
+
+    source в ветке постоянен, поэтому сравнение сводится к условию по
+    (created_at, id), которое обслуживается индексом (status, created_at, id).
+    """
+    if cursor is None:
+        return None
+    created_at, cursor_source, cursor_id = cursor
+    if source > cursor_source:
+        return model.created_at >= created_at
+    if source < cursor_source:
+        return model.created_at > created_at
+    # created_at >= ... отдельным конъюнктом: по нему SQLite строит диапазон индекса
+    return and_(
+        model.created_at >= created_at,
+        or_(model.created_at > created_at, model.id > cursor_id)
+    )
+
+
+def _feedback_branch(limit: int, cursor, suggested_by: Optional[str]):
+    conditions = [FeedbackItem.status == "pending"]
+    if suggested_by is not None:
+        conditions.append(FeedbackItem.suggested_by == suggested_by)
+    after = _after_cursor(FeedbackItem, "feedback", cursor)
+    if after is not None:
+        conditions.append(after)
+    return (
+        select(
+            literal("feedback").label("source"),
+            FeedbackItem.id.label("id"),
+            FeedbackItem.internal_token.label("internal_token"),
+            FeedbackItem.original_question.label("original_question"),
+            FeedbackItem.old_answer.label("old_answer"),
+            FeedbackItem.edited_answer.label("edited_answer"),
+            FeedbackItem.suggested_by.label("suggested_by"),
+            FeedbackItem.votes.label("votes"),
+            cast(null(), String).label("category"),
+            cast(null(), String).label("subcategory"),
+            FeedbackItem.created_at.label("created_at"),
+        )
+        .where(*conditions)
+        .order_by(FeedbackItem.created_at, FeedbackItem.id)
+        .limit(limit)
+    )
+
+
+def _qa_branch(limit: int, cursor, category: Optional[str]):
+    conditions = [QAQueue.status == "pending"]
+    if category is not None:
+        conditions.append(QAQueue.category == category)
+    after = _after_cursor(QAQueue, "qa", cursor)
+    if after is not None:
+        conditions.append(after)
+    return (
+        select(
+            literal("qa").label("source"),
+            QAQueue.id.label("id"),
+            (literal(QA_TOKEN_PREFIX) + cast(QAQueue.id, String)).label("internal_token"),
+            QAQueue.question.label("original_question"),
+            literal("").label("old_answer"),
+            QAQueue.answer.label("edited_answer"),
+            cast(null(), String).label("suggested_by"),
+            literal(1).label("votes"),
+            QAQueue.category.label("category"),
+            QAQueue.subcategory.label("subcategory"),
+            QAQueue.created_at.label("created_at"),
+        )
+        .where(*conditions)
+        .order_by(QAQueue.created_at, QAQueue.id)
+        .limit(limit)
+    )
+
+
+async def pending_page(session: AsyncSession, limit: int, cursor: Optional[str] = None,
+                       source: Optional[str] = None, category: Optional[str] = None,
+                       suggested_by: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+    """
+    Страница очереди модерации в порядке (created_at, source, id) и курсор следующей.
+
+    Каждая ветка UNION ALL читает не больше limit + 1 строк по индексу
+    (status, created_at, id), поэтому время ответа не зависит от длины очереди.
+    category есть только у QAQueue, suggested_by - только у FeedbackItem:
+    фильтр по ним исключает другую таблицу.
+    """
+    decoded = decode_cursor(cursor) if cursor else None
+    sources = [source] if source else list(SOURCES)
+    if category is not None and "feedback" in sources:
+        sources.remove("feedback")
+    if suggested_by is not None and "qa" in sources:
+        sources.remove("qa")
+
+    branches = []
+    if "feedback" in sources:
+        branches.append(_feedback_branch(limit + 1, decoded, suggested_by).subquery())
+    if "qa" in sources:
+        branches.append(_qa_branch(limit + 1, decoded, category).subquery())
+    if not branches:
+        return [], None
+
+    merged = union_all(*(select(*branch.c) for branch in branches)).subquery()
+    rows = (await session.execute(
+        select(merged)
+        .order_by(merged.c.created_at, merged.c.source, merged.c.id)
+        .limit(limit + 1)
+    )).mappings().all()
+
+    items = [dict(row) for row in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        last = items[-1]
+        next_cursor = encode_cursor(last['created_at'], last['source'], last['id'])
+    return items, next_cursor
+
+
+def _upsert(dialect: str):
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert
+
+
+async def bump_counters(session: AsyncSession, deltas: Dict[str, float]):
+    """
+    Атомарно прибавляет deltas к счётчикам в текущей транзакции сессии.
+
+    Коммит - вместе с изменением самой правки, так что счётчики не расходятся с данными.
+    """
+    deltas = {name: delta for name, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    insert = _upsert(session.bind.dialect.name)
+    statement = insert(ModerationCounter).values(
+        [{'name': name, 'value': delta} for name, delta in deltas.items()]
+    )
+    await session.execute(statement.on_conflict_do_update(
+        index_elements=[ModerationCounter.name],
+        set_={'value': ModerationCounter.value + statement.excluded.value}
+    ))
+
+
+def feedback_created(suggested_by: Optional[str]) -> Dict[str, float]:
+    return {
+        'feedback:pending': 1,
+        f"operator:{suggested_by or ANONYMOUS}:submitted": 1,
+    }
+
+
+def feedback_resolved(item: FeedbackItem, old_status: str) -> Dict[str, float]:
+    """Дельты счётчиков при смене статуса правки old_status -> item.status"""
+    if old_status == item.status:
+        return {}
+    deltas = {f"feedback:{old_status}": -1, f"feedback:{item.status}": 1}
+    if old_status == "pending" and item.resolved_at and item.created_at:
+        deltas['resolution:count'] = 1
+        deltas['resolution:seconds'] = (item.resolved_at - item.created_at).total_seconds()
+        deltas[f"operator:{item.suggested_by or ANONYMOUS}:{item.status}"] = 1
+    return deltas
+
+
+def qa_resolved(item: QAQueue, old_status: str) -> Dict[str, float]:
+    """
+    Дельты счётчиков при решении пары из QAQueue.
+
+    Пары добавляются в очередь в обход приложения, поэтому счётчика pending и
+    автора у них нет: учитываются решение и время до него.
+    """
+    if old_status != "pending" or item.status == old_status:
+        return {}
+    deltas = {f"qa:{item.status}": 1}
+    if item.resolved_at and item.created_at:
+        deltas['resolution:count'] = 1
+        deltas['resolution:seconds'] = (item.resolved_at - item.created_at).total_seconds()
+    return deltas
+
+
+async def resolve_batch(session: AsyncSession,
+                        decisions: List[Tuple[str, str]]) -> Tuple[List[Dict], List[Dict]]:
+    """
+    Решения (token, action) по нескольким правкам в текущей транзакции сессии.
+
+    Правки читаются двумя запросами (feedback и qa), счётчики обновляются одним
+    UPSERT; commit - на вызывающем. Решаются только правки в статусе pending:
+    по уже принятым или отклонённым возвращается already_resolved, их статус и
+    БЗ не меняются. Возвращает результат по каждому токену и изменения БЗ по
+    принятым правкам ({'question', 'answer', 'taxonomy'}).
+    """
+    feedback_tokens = [token for token, _ in decisions if not token.startswith(QA_TOKEN_PREFIX)]
+    qa_ids = [
+        int(token[len(QA_TOKEN_PREFIX):]) for token, _ in decisions
+        if token.startswith(QA_TOKEN_PREFIX) and token[len(QA_TOKEN_PREFIX):].isdigit()
+    ]
+    items = {}
+    if feedback_tokens:
+        rows = await session.execute(select(FeedbackItem).where(
+            FeedbackItem.internal_token.in_(feedback_tokens), FeedbackItem.status == "pending"
+        ))
+        items.update({item.internal_token: item for item in rows.scalars()})
+    if qa_ids:
+        rows = await session.execute(select(QAQueue).where(QAQueue.id.in_(qa_ids), QAQueue.status == "pending"))
+        items.update({f"{QA_TOKEN_PREFIX}{item.id}": item for item in rows.scalars()})
+
+    # Токены без pending-правки: уже решённые отличаем от несуществующих
+    resolved = set()
+    missing_feedback = [token for token in feedback_tokens if token not in items]
+    if missing_feedback:
+        rows = await session.execute(
+            select(FeedbackItem.internal_token).where(FeedbackItem.internal_token.in_(missing_feedback))
+        )
+        resolved.update(rows.scalars())
+    missing_qa = [qa_id for qa_id in qa_ids if f"{QA_TOKEN_PREFIX}{qa_id}" not in items]
+    if missing_qa:
+        rows = await session.execute(select(QAQueue.id).where(QAQueue.id.in_(missing_qa)))
+        resolved.update(f"{QA_TOKEN_PREFIX}{qa_id}" for qa_id in rows.scalars())
+
+    results, changes = [], []
+    deltas: Dict[str, float] = {}
+    seen = set()
+    now = datetime.utcnow()
+    for token, action in decisions:
+        item = items.get(token)
+        if token in seen:
+            status = "duplicate"
+        elif action not in ("approve", "reject"):
+            status = "invalid_action"
+        elif token in resolved:
+            status = "already_resolved"
+        elif item is None:
+            status = "not_found"
+        else:
+            status = "applied" if action == "approve" else "rejected"
+            new_status = "approved" if action == "approve" else "rejected"
+            old_status = item.status
+            item.status = new_status
+            item.resolved_at = now
+            if isinstance(item, QAQueue):
+                item_deltas = qa_resolved(item, old_status)
+                change = {'question': item.question, 'answer': item.answer,
+                          'taxonomy': {'category': item.category, 'subcategory': item.subcategory}}
+            else:
+                item_deltas = feedback_resolved(item, old_status)
+                change = {'question': item.original_question, 'answer': item.edited_answer, 'taxonomy': {}}
+            for name, delta in item_deltas.items():
+                deltas[name] = deltas.get(name, 0) + delta
+            if action == "approve":
+                changes.append(change)
+        seen.add(token)
+        results.append({'internal_token': token, 'status': status})
+
+    await bump_counters(session, deltas)
+    return results, changes
+
+
+async def backfill_counters(session: AsyncSession):
+    """
+    Один раз заполняет счётчики по уже существующим правкам
+    (один агрегирующий запрос с GROUP BY), дальше они только инкрементируются.
+    """
+    if await session.get(ModerationCounter, COUNTERS_READY) is not None:
+        return
+    # Маркер вставляется первым: если параллельный воркер успел раньше, тут будет IntegrityError
+    session.add(ModerationCounter(name=COUNTERS_READY, value=1))
+    try:
+        await session.flush()
+    except IntegrityError:
+        await session.rollback()
+        return
+
+    def resolution(model):
+        if session.bind.dialect.name == "postgresql":
+            return func.sum(func.extract("epoch", model.resolved_at - model.created_at))
+        return func.sum(func.julianday(model.resolved_at) - func.julianday(model.created_at)) * 86400
+
+    rows = (await session.execute(
+        select(
+            FeedbackItem.status,
+            FeedbackItem.suggested_by,
+            func.count(),
+            func.count(FeedbackItem.resolved_at),
+            resolution(FeedbackItem),
+        ).group_by(FeedbackItem.status, FeedbackItem.suggested_by)
+    )).all()
+    qa_rows = (await session.execute(
+        select(QAQueue.status, func.count(), func.count(QAQueue.resolved_at), resolution(QAQueue))
+        .where(QAQueue.status != "pending")
+        .group_by(QAQueue.status)
+    )).all()
+
+    deltas: Dict[str, float] = {}
+    for status, suggested_by, total, resolved, seconds in rows:
+        operator = suggested_by or ANONYMOUS
+        deltas[f"feedback:{status}"] = deltas.get(f"feedback:{status}", 0) + total
+        deltas[f"operator:{operator}:submitted"] = deltas.get(f"operator:{operator}:submitted", 0) + total
+        if status != "pending" and resolved:
+            deltas[f"operator:{operator}:{status}"] = deltas.get(f"operator:{operator}:{status}", 0) + resolved
+            deltas['resolution:count'] = deltas.get('resolution:count', 0) + resolved
+            deltas['resolution:seconds'] = deltas.get('resolution:seconds', 0) + (seconds or 0)
+    for status, total, resolved, seconds in qa_rows:
+        deltas[f"qa:{status}"] = total
+        if resolved:
+            deltas['resolution:count'] = deltas.get('resolution:count', 0) + resolved
+            deltas['resolution:seconds'] = deltas.get('resolution:seconds', 0) + (seconds or 0)
+
+    await bump_counters(session, deltas)
+    await session.commit()
+
+
+async def read_counters(session: AsyncSession) -> Dict[str, float]:
+    """Все счётчики одним SELECT по маленькой таблице (строк - по числу операторов)"""
+    rows = (await session.execute(select(ModerationCounter.name, ModerationCounter.value))).all()
+    return {name: value for name, value in rows}
+
+
+def format_duration(seconds: Optional[float]) -> str:
+    if seconds is None:
+        return "N/A"
+    minutes, secs = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    days, hours = divmod(hours, 24)
+    if days:
+        return f"{days}д {hours}ч {minutes}м"
+    if hours:
+        return f"{hours}ч {minutes}м"
+    return f"{minutes}м {secs}с"
+
+
+def operator_activity(counters: Dict[str, float]) -> Dict[str, Dict[str, int]]:
+    activity: Dict[str, Dict[str, int]] = {}
+    for name, value in counters.items():
+        if name.startswith("operator:"):
+            operator, _, event = name[len("operator:"):].rpartition(":")
+            activity.setdefault(operator, {'submitted': 0, 'approved': 0, 'rejected': 0})[event] = int(value)
+    return activity
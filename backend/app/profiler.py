@@ -0,0 +1,81 @@
+import os
+import sys
+import time
+import threading
+from collections import Counter
+from typing import Dict, Optional
+
+
+class SamplingProfiler:
+    """
+    Сэмплирующий профайлер всех потоков процесса.
+
+    Раз в interval секунд снимает стеки через sys._current_frames() и считает
+    одинаковые стеки. Результат - collapsed stacks ("поток;f1;f2 N"), формат
+    flamegraph.pl / speedscope / inferno. Код приложения не инструментируется,
+    накладные расходы пропорциональны частоте сэмплов, а не нагрузке.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Подписи фреймов по объекту кода на время прогона: поиск по sys.path -
+        # один раз на функцию, а не на каждый фрейм каждого сэмпла
+        self._labels: Dict = {}
+        self.running = False
+
+    def _frame_label(self, frame) -> str:
+        code = frame.f_code
+        label = self._labels.get(code)
+        if label is None:
+            filename = code.co_filename
+            for path in sys.path:
+                if path and filename.startswith(path):
+                    filename = os.path.relpath(filename, path)
+                    break
+            label = self._labels[code] = f"{code.co_name} ({filename}:{code.co_firstlineno})"
+        return label
+
+    def _sample(self, own_thread: int, stacks: Counter):
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_thread:
+                continue
+            labels = []
+            while frame is not None:
+                labels.append(self._frame_label(frame))
+                frame = frame.f_back
+            labels.append(names.get(thread_id, str(thread_id)))
+            stacks[";".join(reversed(labels))] += 1
+
+    def run(self, seconds: float, interval: float = 0.005) -> Optional[Dict]:
+        """
+        Сэмплирует seconds секунд (блокирует вызывающий поток).
+
+        Возвращает {'collapsed', 'samples', 'duration'} или None, если
+        профилирование уже идёт.
+        """
+        if not self._lock.acquire(blocking=False):
+            return None
+        self.running = True
+        try:
+            own_thread = threading.get_ident()
+            stacks: Counter = Counter()
+            samples = 0
+            start = time.perf_counter()
+            deadline = start + seconds
+            while time.perf_counter() < deadline:
+                self._sample(own_thread, stacks)
+                samples += 1
+                time.sleep(interval)
+            return {
+                'collapsed': "".join(f"{stack} {count}\n" for stack, count in stacks.most_common()),
+                'samples': samples,
+                'duration': time.perf_counter() - start,
+            }
+        finally:
+            self._labels.clear()
+            self.running = False
+            self._lock.release()
+
+
+profiler = SamplingProfiler()
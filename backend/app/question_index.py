@@ -0,0 +1,218 @@
+import zlib
+import hashlib
+import numpy as np
+from typing import Dict, Optional, Set, Tuple
+from app.mmap_io import load_array, save_array
+
+
+# Простое число Мерсенна 2^31 - 1: a * x + b помещается в int64 без переполнения
+_PRIME = (1 << 31) - 1
+
+
+def _key_hash(data: bytes) -> int:
+    """64-битный ключ для отсортированных массивов снапшота"""
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "little")
+
+
+class QuestionIndex:
+    """
+    Индекс вопросов БЗ для быстрого пути поиска без эмбеддингов.
+
+    - exact: хэш-таблица нормализованный вопрос -> row_id
+    - near_exact: MinHash по символьным 3-граммам с LSH-бакетами; кандидат
+      принимается, если оценка Жаккара не ниже порога
+
+    Ожидает уже нормализованный текст (см. indexes.normalize_query).
+
+    Загруженный из снапшота индекс хранит вопросы в отображённых в память
+    массивах: 64-битные хэши вопросов и LSH-бакетов отсортированы и ищутся
+    через searchsorted, сигнатуры - матрица строк. Совпадение хэша
+    проверяется по тексту вопроса (UTF-8 подряд в base_blob, смещения в
+    base_offsets). Строки, изменённые после
+    снапшота, живут в словарях, как у индекса в памяти; их прежние версии
+    помечаются в маске base_alive.
+    """
+
+    NUM_PERM = 64
+    BANDS = 16
+    SHINGLE = 3
+
+    def __init__(self):
+        rng = np.random.default_rng(20240601)
+        self._a = rng.integers(1, _PRIME, self.NUM_PERM, dtype=np.int64)
+        self._b = rng.integers(0, _PRIME, self.NUM_PERM, dtype=np.int64)
+        self.exact: Dict[str, int] = {}
+        self.row_keys: Dict[int, str] = {}
+        self.signatures: Dict[int, np.ndarray] = {}
+        self.buckets: Dict[Tuple[int, bytes], Set[int]] = {}
+        # Неизменяемая часть из снапшота: позиции строк в base_rows (отсортированы)
+        self.base_rows = np.zeros(0, dtype=np.int64)
+        self.base_alive = np.zeros(0, dtype=bool)
+        self.base_signatures = np.zeros((0, self.NUM_PERM), dtype=np.int64)
+        self.base_offsets = np.zeros(1, dtype=np.int64)
+        self.base_blob = np.zeros(0, dtype=np.uint8)
+        self.exact_keys = np.zeros(0, dtype=np.uint64)
+        self.exact_pos = np.zeros(0, dtype=np.int64)
+        self.bucket_keys = np.zeros(0, dtype=np.uint64)
+        self.bucket_pos = np.zeros(0, dtype=np.int64)
+        self.base_count = 0
+
+    def __len__(self):
+        return len(self.row_keys) + self.base_count
+
+    @staticmethod
+    def _positions(keys: np.ndarray, positions: np.ndarray, key: int) -> np.ndarray:
+        key = np.uint64(key)
+        return positions[np.searchsorted(keys, key, side='left'):np.searchsorted(keys, key, side='right')]
+
+    @staticmethod
+    def _bucket_hash(key: Tuple[int, bytes]) -> int:
+        return _key_hash(key[0].to_bytes(2, "little") + key[1])
+
+    def _signature(self, normalized: str) -> Optional[np.ndarray]:
+        text = f" {normalized} "
+        if len(normalized) < self.SHINGLE:
+            return None
+        shingles = np.fromiter(
+            {zlib.crc32(text[i:i + self.SHINGLE].encode("utf-8")) & _PRIME
+             for i in range(len(text) - self.SHINGLE + 1)},
+            dtype=np.int64
+        )
+        return ((np.outer(self._a, shingles) + self._b[:, None]) % _PRIME).min(axis=1)
+
+    def _base_question(self, pos: int) -> str:
+        return self.base_blob[self.base_offsets[pos]:self.base_offsets[pos + 1]].tobytes().decode("utf-8")
+
+    def _bands(self, signature: np.ndarray):
+        rows = self.NUM_PERM // self.BANDS
+        return [(band, signature[band * rows:(band + 1) * rows].tobytes()) for band in range(self.BANDS)]
+
+    def add(self, row_id: int, normalized: str):
+        self.remove(row_id)
+        self.exact[normalized] = row_id
+        self.row_keys[row_id] = normalized
+
+        signature = self._signature(normalized)
+        if signature is None:
+            return
+        self.signatures[row_id] = signature
+        for key in self._bands(signature):
+            self.buckets.setdefault(key, set()).add(row_id)
+
+    def remove(self, row_id: int):
+        pos = int(np.searchsorted(self.base_rows, row_id))
+        if pos < len(self.base_rows) and self.base_rows[pos] == row_id and self.base_alive[pos]:
+            self.base_alive[pos] = False
+            self.base_count -= 1
+
+        normalized = self.row_keys.pop(row_id, None)
+        if normalized is None:
+            return
+        if self.exact.get(normalized) == row_id:
+            del self.exact[normalized]
+
+        signature = self.signatures.pop(row_id, None)
+        if signature is None:
+            return
+        for key in self._bands(signature):
+            bucket = self.buckets.get(key)
+            if bucket is not None:
+                bucket.discard(row_id)
+                if not bucket:
+                    del self.buckets[key]
+
+    def lookup(self, normalized: str, near_threshold: Optional[float] = 0.85) -> Optional[Tuple[int, str, float]]:
+        """
+        Возвращает (row_id, 'exact' | 'near_exact', сходство) или None.
+
+        near_threshold=None отключает поиск почти-дубликатов.
+        """
+        row_id = self.exact.get(normalized)
+        if row_id is not None:
+            return row_id, "exact", 1.0
+        for pos in self._positions(self.exact_keys, self.exact_pos, _key_hash(normalized.encode("utf-8"))):
+            # Хэш 64-битный: совпадение подтверждается текстом
+            if self.base_alive[pos] and self._base_question(pos) == normalized:
+                return int(self.base_rows[pos]), "exact", 1.0
+
+        if near_threshold is None:
+            return None
+        signature = self._signature(normalized)
+        if signature is None:
+            return None
+
+        candidates = {}
+        base_candidates = set()
+        for key in self._bands(signature):
+            for candidate in self.buckets.get(key, ()):
+                candidates[candidate] = self.signatures[candidate]
+            if len(self.bucket_keys):
+                base_candidates.update(self._positions(self.bucket_keys, self.bucket_pos, self._bucket_hash(key)).tolist())
+        for pos in base_candidates:
+            if self.base_alive[pos]:
+                candidates[int(self.base_rows[pos])] = self.base_signatures[pos]
+
+        best = None
+        for candidate, candidate_signature in candidates.items():
+            similarity = float(np.mean(candidate_signature == signature))
+            if similarity >= near_threshold and (best is None or similarity > best[2]):
+                best = (candidate, "near_exact", similarity)
+        return best
+
+    def copy(self) -> "QuestionIndex":
+        """Копия для второй реплики: массивы снапшота общие, изменяемое - своё"""
+        other = QuestionIndex.__new__(QuestionIndex)
+        other.__dict__.update(self.__dict__)
+        other.exact = dict(self.exact)
+        other.row_keys = dict(self.row_keys)
+        other.signatures = dict(self.signatures)
+        other.buckets = {key: set(rows) for key, rows in self.buckets.items()}
+        other.base_alive = self.base_alive.copy()
+        return other
+
+    def save(self, path: str):
+        """Пишет массивы снапшота; только для индекса, собранного в памяти"""
+        if len(self.base_rows):
+            raise ValueError("Снапшот пишется из индекса, собранного в памяти")
+        rows = np.asarray(sorted(self.row_keys), dtype=np.int64)
+        position = {int(row_id): pos for pos, row_id in enumerate(rows)}
+        texts = [self.row_keys[row_id].encode("utf-8") for row_id in rows.tolist()]
+        hashes = np.fromiter((_key_hash(text) for text in texts), dtype=np.uint64, count=len(rows))
+        offsets = np.zeros(len(texts) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(text) for text in texts])
+        signatures = np.zeros((len(rows), self.NUM_PERM), dtype=np.int64)
+        for row_id, signature in self.signatures.items():
+            signatures[position[row_id]] = signature
+        bucket_keys, bucket_pos = [], []
+        for key, bucket in self.buckets.items():
+            key_hash = self._bucket_hash(key)
+            for row_id in bucket:
+                bucket_keys.append(key_hash)
+                bucket_pos.append(position[row_id])
+        bucket_keys = np.asarray(bucket_keys, dtype=np.uint64)
+        bucket_order = np.argsort(bucket_keys, kind='stable')
+        exact_order = np.argsort(hashes, kind='stable')
+
+        save_array(path, "questions_rows", rows)
+        save_array(path, "questions_signatures", signatures)
+        save_array(path, "questions_offsets", offsets)
+        save_array(path, "questions_blob", np.frombuffer(b"".join(texts), dtype=np.uint8))
+        save_array(path, "questions_exact_keys", hashes[exact_order])
+        save_array(path, "questions_exact_pos", exact_order)
+        save_array(path, "questions_bucket_keys", bucket_keys[bucket_order])
+        save_array(path, "questions_bucket_pos", np.asarray(bucket_pos, dtype=np.int64)[bucket_order])
+
+    @classmethod
+    def load(cls, path: str) -> "QuestionIndex":
+        index = cls()
+        index.base_rows = load_array(path, "questions_rows")
+        index.base_signatures = load_array(path, "questions_signatures")
+        index.base_offsets = load_array(path, "questions_offsets")
+        index.base_blob = load_array(path, "questions_blob")
+        index.exact_keys = load_array(path, "questions_exact_keys")
+        index.exact_pos = load_array(path, "questions_exact_pos")
+        index.bucket_keys = load_array(path, "questions_bucket_keys")
+        index.bucket_pos = load_array(path, "questions_bucket_pos")
+        index.base_alive = np.ones(len(index.base_rows), dtype=bool)
+        index.base_count = len(index.base_rows)
+        return index
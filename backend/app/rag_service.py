@@ -1,32 +1,177 @@
-import pandas as pd
 import os
-import pickle
-from typing import List, Dict, Tuple
-from langchain_community.document_loaders import DataFrameLoader
+import sys
+import time
+import asyncio
+import numpy as np
+from typing import AsyncIterator, Callable, List, Dict, Tuple, Optional
+from langchain_core.documents import Document
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import FAISS
-from langchain_community.retrievers import BM25Retriever
-from langchain.retrievers import EnsembleRetriever
 from langchain_openai import ChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate
 from app.embeddings import BGEM3Embeddings
+from app.embedding_cache import EmbeddingCache
+from app.kb_store import KnowledgeBaseStore
+from app.indexes import KnowledgeIndex, VectorIndexSpec, make_chunk_id, normalize_query
+from app.index_holder import IndexHolder
+from app.index_snapshot import SnapshotStore
+from app.ranker import HybridRanker, RankedChunk
+from app.cache import TTLCache
+from app.answer_cache import SemanticAnswerCache
+from app.index_jobs import IndexJob, IndexUpdateQueue, JobRegistry
+from app import tracing
+from app.metrics import (
+    INDEX_BUILD_SECONDS, INDEX_REBUILD_SECONDS, SEARCH_PATHS, stage
+)
 from app.config import settings
 
 
+# Версия формата снапшота индексов: при несовместимых изменениях увеличить
+INDEX_FORMAT_VERSION = 8
+
+
+def result_size(result: Dict) -> int:
+    """
+    Память результата поиска в кэше без сериализации: sys.getsizeof словарей
+    и строк, O(числа результатов). draft и alternatives ссылаются на те же
+    строки, что answer в results_meta, и отдельно не считаются.
+    """
+    size = sys.getsizeof(result)
+    if not result['results_meta']:
+        size += sys.getsizeof(result['draft'])
+    for meta in result['results_meta']:
+        size += sys.getsizeof(meta) + sys.getsizeof(meta['question']) + sys.getsizeof(meta['answer'])
+    return size
+
+
 class RAGService:
     def __init__(self):
         self.embeddings = None
-        self.vector_store = None
-        self.bm25_retriever = None
-        self.ensemble_retriever = None
+        self.embedding_cache = None
+        self.indices = IndexHolder()
+        self.vector_spec = VectorIndexSpec(
+            kind=settings.VECTOR_INDEX_TYPE,
+            hnsw_m=settings.VECTOR_INDEX_HNSW_M,
+            ef_construction=settings.VECTOR_INDEX_HNSW_EF_CONSTRUCTION,
+            ef_search=settings.VECTOR_INDEX_HNSW_EF_SEARCH,
+            nlist=settings.VECTOR_INDEX_IVF_NLIST,
+            nprobe=settings.VECTOR_INDEX_IVF_NPROBE,
+            pq_m=settings.VECTOR_INDEX_PQ_M,
+            pq_nbits=settings.VECTOR_INDEX_PQ_NBITS,
+            train_sample=settings.VECTOR_INDEX_TRAIN_SAMPLE
+        )
+        self.ranker = HybridRanker(
+            method=settings.FUSION_METHOD,
+            bm25_weight=settings.BM25_WEIGHT,
+            vector_weight=settings.VECTOR_WEIGHT,
+            rrf_k=settings.RRF_K,
+            candidates=settings.HYBRID_CANDIDATES
+        )
+        self.query_embedding_cache = TTLCache(
+            maxsize=settings.QUERY_EMBEDDING_CACHE_SIZE,
+            ttl=settings.QUERY_EMBEDDING_CACHE_TTL_SECONDS,
+            sizeof=lambda vector: vector.nbytes
+        )
+        self.result_cache = TTLCache(
+            maxsize=settings.RESULT_CACHE_SIZE,
+            ttl=settings.RESULT_CACHE_TTL_SECONDS,
+            sizeof=result_size
+        )
+        # Ключ результата содержит версию индекса; при публикации старые записи просто освобождаем
+        self.indices.add_listener(lambda version: self.result_cache.clear())
+        self.answer_cache = SemanticAnswerCache(
+            maxsize=settings.ANSWER_CACHE_SIZE,
+            threshold=settings.ANSWER_CACHE_THRESHOLD,
+            ttl=settings.ANSWER_CACHE_TTL_SECONDS
+        )
         self.llm = None
-        self.df = None
-        self.documents = None
-        
+        self.kb: Optional[KnowledgeBaseStore] = None
+        # Число вопросов БЗ по категориям; пересчитывается при изменении БЗ, читается за O(1)
+        self.category_counts: Dict[str, int] = {}
+        self.splitter = RecursiveCharacterTextSplitter(
+            chunk_size=settings.CHUNK_SIZE,
+            chunk_overlap=settings.CHUNK_OVERLAP
+        )
+        self._update_lock = asyncio.Lock()
+        self.index_jobs = JobRegistry()
+        self.index_updates = IndexUpdateQueue(
+            self.apply_kb_changes,
+            self.index_jobs,
+            debounce=settings.INDEX_UPDATE_DEBOUNCE_MS / 1000,
+            max_delay=settings.INDEX_UPDATE_MAX_DELAY_MS / 1000,
+            max_changes=settings.INDEX_UPDATE_MAX_CHANGES
+        )
+        self.snapshots: Optional[SnapshotStore] = None
+        # Манифест отображённого снапшота; seq хранилища, до которого доведён опубликованный индекс
+        self.snapshot_manifest: Optional[Dict] = None
+        self.index_seq = 0
+        # Строк, изменённых поверх снапшота: при превышении порога пишется новый
+        self.rows_since_snapshot = 0
+        self._sync_task: Optional[asyncio.Task] = None
+        self._init_task: Optional[asyncio.Task] = None
+        self.phase = "idle"
+        self.progress = {'embedded': 0, 'total': 0}
+        self.error: Optional[str] = None
+    
+    @property
+    def is_ready(self) -> bool:
+        return self.phase == "ready"
+    
+    def start_initialization(self) -> asyncio.Task:
+        """
+        Запускает инициализацию в фоне ровно один раз (single-flight).
+        
+        Повторные вызовы возвращают ту же задачу; после ошибки можно перезапустить.
+        """
+        if self._init_task is None or (self._init_task.done() and not self.is_ready):
+            self._init_task = asyncio.create_task(self._initialize_guarded())
+        return self._init_task
+    
+    async def close(self):
+        # Принятые правки уже записаны в базу как approved: применяем их до выхода
+        await self.index_updates.close()
+        if self._sync_task is not None:
+            self._sync_task.cancel()
+            self._sync_task = None
+        if self.embeddings is not None:
+            await self.embeddings.aclose()
+    
+    async def _initialize_guarded(self):
+        try:
+            await self.initialize()
+        except Exception as e:
+            self.phase = "failed"
+            self.error = str(e)
+            print(f"Ошибка инициализации RAG сервиса: {e}")
+    
+    def readiness(self) -> Dict:
+        return {
+            'ready': self.is_ready,
+            'phase': self.phase,
+            'progress': dict(self.progress),
+            'index_version': self.indices.version,
+            'error': self.error,
+        }
+    
     async def initialize(self):
         print("Инициализация RAG сервиса...")
+        self.phase = "loading_kb"
+        self.error = None
         
-        self.embeddings = BGEM3Embeddings(api_key=settings.API_KEY)
+        os.makedirs("./data", exist_ok=True)
+        
+        self.embedding_cache = EmbeddingCache(
+            settings.EMBEDDING_CACHE_PATH,
+            dtype=settings.EMBEDDING_CACHE_DTYPE
+        )
+        self.embeddings = BGEM3Embeddings(
+            api_key=settings.API_KEY,
+            base_url=settings.LLM_BASE_URL,
+            model=settings.EMBEDDING_MODEL,
+            cache=self.embedding_cache,
+            query_batch_window_ms=settings.EMBEDDING_BATCH_WINDOW_MS,
+            max_query_batch=settings.EMBEDDING_MAX_QUERY_BATCH,
+            max_connections=settings.EMBEDDING_MAX_CONNECTIONS
+        )
         
         self.llm = ChatOpenAI(
             api_key=settings.API_KEY,
@@ -35,75 +180,322 @@ class RAGService:
             temperature=0.3
         )
         
-        os.makedirs("./data", exist_ok=True)
+        self.kb = KnowledgeBaseStore(settings.KB_STORE_PATH)
+        self.snapshots = SnapshotStore(settings.VECTOR_STORE_PATH)
         
-        # Загружаем данные из CSV файла
-        csv_path = "/home/kate/T1-hackathon/backend/data/knowledge_base_augmented2.csv"
-        print(f"Загрузка базы знаний из {csv_path}...")
-        
-        self.df = pd.read_csv(csv_path)
-        
-        # Переименовываем колонки в нужный формат
-        self.df = self.df.rename(columns={
-            'Основная категория': 'category',
-            'Подкатегория': 'subcategory',
-            'Пример вопроса': 'question',
-            'Шаблонный ответ': 'answer',
-            'Целевая аудитория': 'target_group'
-        })
+        # Воркеры uvicorn стартуют одновременно: импорт и сборку выполняет тот,
+        # кто первым взял блокировку, остальные отображают в память его снапшот
+        self.phase = "waiting_for_snapshot"
+        index, manifest, seq, changed = await asyncio.to_thread(self._open_snapshot)
+        print(f"Загружено {len(self.kb)} записей из базы знаний")
+        self._count_categories()
         
-        # Удаляем пустые строки
-        self.df = self.df.dropna(subset=['question', 'answer'])
-        
-        print(f"Загружено {len(self.df)} записей из базы знаний")
-        print("Создание индексов...")
-        await self._build_indices()
-        
-        retriever = self.vector_store.as_retriever(search_kwargs={"k": settings.TOP_K})
-        self.bm25_retriever.k = settings.TOP_K
-        
-        self.ensemble_retriever = EnsembleRetriever(
-            retrievers=[self.bm25_retriever, retriever],
-            weights=[settings.BM25_WEIGHT, settings.VECTOR_WEIGHT]
-        )
+        await asyncio.to_thread(self.indices.publish, index)
+        self.snapshot_manifest = manifest
+        self.index_seq = seq
+        self.rows_since_snapshot = changed
+        self.answer_cache.clear()
+        self._sync_task = asyncio.create_task(self._sync_loop())
+        self.phase = "ready"
         
         print("RAG сервис инициализирован успешно!")
     
-    async def _build_indices(self):
-        loader = DataFrameLoader(self.df, page_content_column='answer')
-        documents = loader.load()
-        
-        for i, doc in enumerate(documents):
-            if i < len(self.df):
-                row = self.df.iloc[i]
-                doc.metadata = {
-                    'category': row.get('category', ''),
-                    'subcategory': row.get('subcategory', ''),
-                    'question': row.get('question', ''),
-                    'target_group': row.get('target_group', ''),
-                }
-        
-        splitter = RecursiveCharacterTextSplitter(
-            chunk_size=settings.CHUNK_SIZE,
-            chunk_overlap=settings.CHUNK_OVERLAP
-        )
-        self.documents = splitter.split_documents(documents)
-        
-        print(f"Создание эмбеддингов для {len(self.documents)} документов...")
-        self.vector_store = FAISS.from_documents(self.documents, self.embeddings)
-        
-        print("Создание BM25 индекса...")
-        self.bm25_retriever = BM25Retriever.from_documents(self.documents)
+    def _count_categories(self):
+        self.category_counts = self.kb.category_counts()
+    
+    def _recount_categories(self, old: Optional[Dict], new: Dict):
+        """Инкрементальный пересчёт category_counts после правки строки"""
+        if old is not None:
+            self.category_counts[old['category']] -= 1
+            if not self.category_counts[old['category']]:
+                del self.category_counts[old['category']]
+        self.category_counts[new['category']] = self.category_counts.get(new['category'], 0) + 1
+    
+    def category_coverage(self) -> Dict[str, Dict]:
+        total = sum(self.category_counts.values())
+        return {
+            category: {'questions': int(count), 'share': round(count / total, 4)}
+            for category, count in self.category_counts.items()
+        }
+    
+    def _row_documents(self, row_id: int, row) -> List[Document]:
+        """Чанки ответа одной строки БЗ с постоянными id"""
+        metadata = {
+            'category': row.get('category', ''),
+            'subcategory': row.get('subcategory', ''),
+            'question': row.get('question', ''),
+            'target_group': row.get('target_group', ''),
+            'row_id': int(row_id),
+        }
+        return [
+            Document(page_content=chunk, metadata={**metadata, 'chunk_id': make_chunk_id(row_id, n)})
+            for n, chunk in enumerate(self.splitter.split_text(row['answer']))
+        ]
+    
+    @INDEX_BUILD_SECONDS.time()
+    def _build_indices(self, report: bool = True) -> KnowledgeIndex:
+        """Полная сборка из хранилища; report=False - фоновая сборка, phase и progress не меняются"""
+        documents = []
+        for row_id, row in self.kb.rows():
+            documents.extend(self._row_documents(row_id, row))
+        
+        print(f"Создание эмбеддингов для {len(documents)} документов...")
+        if report:
+            self.phase = "embedding"
+            self.progress = {'embedded': 0, 'total': len(documents)}
+        
+        # Эмбеддинги считаются порциями, чтобы /ready показывал прогресс
+        texts = [doc.page_content for doc in documents]
+        step = self.embeddings.batch_size * self.embeddings.max_workers
+        vectors = []
+        for i in range(0, len(texts), step):
+            vectors.extend(self.embeddings.embed_documents(texts[i:i + step]))
+            if report:
+                self.progress['embedded'] = len(vectors)
+        print(f"Кэш эмбеддингов: {self.embedding_cache.stats()}")
+        
+        print("Создание FAISS и BM25 индексов...")
+        if report:
+            self.phase = "indexing"
+        index = KnowledgeIndex(self.vector_spec)
+        index.add_rows(documents, vectors)
+        
+        print(f"Индексы созданы! Векторный индекс: {index.vector.kind}")
+        return index
+    
+    def _build_manifest(self) -> Dict:
+        """
+        Описание входных данных индекса: снапшот совместим только при полном совпадении.
         
-        print("Индексы созданы!")
+        Содержимое БЗ описывается store_id хранилища; kb_seq снапшота - до какой
+        правки он собран, более поздние правки применяются поверх (_catch_up).
+        """
+        return {
+            'format_version': INDEX_FORMAT_VERSION,
+            'kb_store_id': self.kb.store_id,
+            'embedding_model': settings.EMBEDDING_MODEL,
+            'chunk_size': settings.CHUNK_SIZE,
+            'chunk_overlap': settings.CHUNK_OVERLAP,
+            'vector_index': self.vector_spec.build_params(),
+        }
+    
+    def _snapshot_compatible(self, saved: Dict) -> bool:
+        manifest = self._build_manifest()
+        return 'snapshot' in saved and {key: saved.get(key) for key in manifest} == manifest
+    
+    @staticmethod
+    def _snapshot_threshold(manifest: Dict) -> float:
+        """Сколько правок поверх снапшота допускается, прежде чем записать новый"""
+        return max(settings.INDEX_SNAPSHOT_MIN_CHANGES, settings.INDEX_SNAPSHOT_CHANGE_RATIO * manifest['num_rows'])
+    
+    def _open_snapshot(self) -> Tuple[KnowledgeIndex, Dict, int, int]:
+        """
+        Открывает текущий снапшот, при необходимости собрав его под блокировкой.
+        
+        Возвращает (индекс, манифест снапшота, seq хранилища, до которого
+        доведён индекс, число строк, изменённых поверх снапшота).
+        """
+        with self.snapshots.lock():
+            # База знаний - в SQLite; CSV импортируется только в пустое хранилище
+            csv_path = settings.KNOWLEDGE_BASE_PATH
+            if not len(self.kb):
+                print(f"Импорт базы знаний из {csv_path}...")
+                self.kb.import_csv(csv_path)
+            elif os.path.exists(csv_path) and self.kb.csv_changed(csv_path):
+                print(f"{csv_path} изменён после последнего импорта/экспорта; "
+                      f"применить: python -m app.kb_store import")
+            
+            self.phase = "loading_snapshot"
+            manifest = self.snapshots.read_manifest()
+            if manifest is not None and not self._snapshot_compatible(manifest):
+                print("Снапшот индексов устарел, требуется пересборка")
+                manifest = None
+            if manifest is not None:
+                changed = len(self.kb.changes_since(manifest['kb_seq']))
+                if changed > self._snapshot_threshold(manifest):
+                    print(f"После снапшота изменено {changed} строк, требуется пересборка")
+                    manifest = None
+            
+            index = self._load_snapshot(manifest) if manifest is not None else None
+            if index is None:
+                print("Создание индексов...")
+                manifest = self._write_snapshot()
+                index = self.snapshots.load(manifest, self.vector_spec)
+        
+        seq, changed = self._catch_up(index, manifest['kb_seq'])
+        return index, manifest, seq, changed
+    
+    def _load_snapshot(self, manifest: Dict) -> Optional[KnowledgeIndex]:
+        try:
+            index = self.snapshots.load(manifest, self.vector_spec)
+        except Exception as e:
+            print(f"Не удалось загрузить снапшот индексов: {e}")
+            return None
+        print(f"Снапшот индексов {manifest['snapshot']} отображён в память ({len(index)} документов)")
+        return index
+    
+    def _write_snapshot(self, report: bool = True) -> Dict:
+        """Собирает индексы из хранилища и пишет снапшот; вызывать под self.snapshots.lock()"""
+        # seq читается до строк: правки, попавшие между ними, будут применены повторно - это безопасно
+        manifest = {**self._build_manifest(), 'kb_seq': self.kb.seq}
+        manifest = self.snapshots.save(self._build_indices(report), manifest)
+        print(f"Снапшот индексов {manifest['snapshot']} сохранён в {settings.VECTOR_STORE_PATH}")
+        return manifest
+    
+    def _catch_up(self, index: KnowledgeIndex, seq: int) -> Tuple[int, int]:
+        """
+        Применяет к ещё не опубликованному индексу правки хранилища после seq.
+        
+        Возвращает (seq последней правки, число изменённых строк).
+        """
+        changes = self.kb.changes_since(seq)
+        if changes:
+            self._apply_rows(index, *self._embed_rows(changes))
+            seq = max(row_seq for _, _, row_seq in changes)
+        return seq, len(changes)
+    
+    def _embed_rows(self, changes: List[Tuple[int, Dict, int]]) -> Tuple[List[int], List[Document], List[List[float]]]:
+        """Чанки и эмбеддинги изменённых строк; правки других воркеров уже в общем кэше эмбеддингов"""
+        documents = [doc for row_id, row, _ in changes for doc in self._row_documents(row_id, row)]
+        vectors = self.embeddings.embed_documents([doc.page_content for doc in documents])
+        return [row_id for row_id, _, _ in changes], documents, vectors
+    
+    @staticmethod
+    def _apply_rows(index: KnowledgeIndex, row_ids: List[int], documents: List[Document],
+                    vectors: List[List[float]]):
+        for row_id in row_ids:
+            index.remove_row(row_id)
+        index.add_rows(documents, vectors)
+    
+    def cache_stats(self) -> Dict:
+        return {
+            'query_embeddings': self.query_embedding_cache.stats(),
+            'results': self.result_cache.stats(),
+            'answers': self.answer_cache.stats(),
+        }
+    
+    def metrics_cache_stats(self) -> Dict:
+        """Статистика всех кэшей для /metrics"""
+        return {
+            **self.cache_stats(),
+            'embeddings': self.embedding_cache.stats() if self.embedding_cache else None,
+        }
+    
+    async def _embed_query(self, query: str, normalized: str) -> np.ndarray:
+        vector = self.query_embedding_cache.get(normalized)
+        tracing.annotate(cache_hit=vector is not None)
+        if vector is None:
+            vector = np.asarray(await self.embeddings.aembed_query(query), dtype=np.float32)
+            self.query_embedding_cache.set(normalized, vector)
+        return vector
+    
+    def _fast_path(self, index: KnowledgeIndex, query: str, normalized: str,
+                   top_k: int) -> Optional[Tuple[List[RankedChunk], str]]:
+        """Совпадение с вопросом из БЗ: ответ этой строки + BM25, без обращения к API эмбеддингов"""
+        if not settings.QUESTION_FAST_PATH:
+            return None
+        near_threshold = settings.NEAR_DUPLICATE_THRESHOLD if settings.NEAR_DUPLICATE_FAST_PATH else None
+        match = index.questions.lookup(normalized, near_threshold)
+        if match is None:
+            return None
+        
+        row_id, path, similarity = match
+        pinned = [
+            RankedChunk(doc=index.docs[chunk_id], score=similarity, path=path)
+            for chunk_id in index.docs.row_chunks(row_id)
+        ]
+        return self.ranker.fill_lexical(index, query, pinned, top_k), path
     
     async def search(self, query: str, top_k: int = 3) -> Dict:
-        docs = self.ensemble_retriever.get_relevant_documents(query)[:top_k]
-        
+        with stage("normalize"):
+            normalized = normalize_query(query)
+        
+        with stage("fast_path"), self.indices.read() as current:
+            fast = self._fast_path(current.index, query, normalized, top_k)
+            tracing.annotate(matched=fast[1] if fast else None, index_version=current.version)
+        if fast is not None:
+            ranked, path = fast
+            SEARCH_PATHS.labels(path=path).inc()
+            return self._build_result(ranked, current.version, path)
+        
+        with stage("result_cache"):
+            cached = self.result_cache.get((normalized, top_k, self.indices.version))
+            tracing.annotate(hit=cached is not None)
+        if cached is not None:
+            SEARCH_PATHS.labels(path="cached").inc()
+            return cached
+        
+        with stage("embed"):
+            vector = await self._embed_query(query, normalized)
+        # Поиск закрепляет текущую версию: публикация новой его не затронет
+        with self.indices.read() as current:
+            ranked = self.ranker.rank(current.index, query, vector, top_k)
+        
+        result = self._build_result(ranked, current.version, "hybrid")
+        self.result_cache.set((normalized, top_k, current.version), result)
+        SEARCH_PATHS.labels(path="hybrid").inc()
+        return result
+    
+    async def search_batch(self, queries: List[str], top_k: int = 3) -> AsyncIterator[Tuple[int, Dict]]:
+        """
+        Пакетный поиск. Отдаёт пары (номер запроса, результат) по мере готовности:
+        сначала быстрый путь и кэш, затем остальные после одного батча
+        эмбеддингов и одного матричного прохода FAISS/BM25.
+        """
+        normalized = [normalize_query(query) for query in queries]
+        pending: Dict[str, List[int]] = {}
+
+        with self.indices.read() as current:
+            ready = []
+            for i, (query, key) in enumerate(zip(queries, normalized)):
+                fast = self._fast_path(current.index, query, key, top_k)
+                if fast is not None:
+                    ranked, path = fast
+                    ready.append((i, self._build_result(ranked, current.version, path)))
+                    continue
+                cached = self.result_cache.get((key, top_k, current.version))
+                if cached is not None:
+                    ready.append((i, cached))
+                else:
+                    pending.setdefault(key, []).append(i)
+        for item in ready:
+            yield item
+        if not pending:
+            return
+
+        # Одинаковые после нормализации запросы считаются один раз
+        keys = list(pending)
+        texts = [queries[pending[key][0]] for key in keys]
+        vectors = [self.query_embedding_cache.get(key) for key in keys]
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            with stage("embed"):
+                computed = await asyncio.to_thread(self.embeddings.embed_documents, [texts[i] for i in missing])
+            for i, vector in zip(missing, computed):
+                vectors[i] = np.asarray(vector, dtype=np.float32)
+                self.query_embedding_cache.set(keys[i], vectors[i])
+
+        def rank():
+            with self.indices.read() as current:
+                return current.version, self.ranker.rank_many(current.index, texts, np.vstack(vectors), top_k)
+
+        version, ranked_lists = await asyncio.to_thread(rank)
+        for key, ranked in zip(keys, ranked_lists):
+            result = self._build_result(ranked, version, "hybrid")
+            self.result_cache.set((key, top_k, version), result)
+            for i in pending[key]:
+                yield i, result
+
+    def _build_result(self, ranked: List[RankedChunk], version: int, path: str) -> Dict:
+        with stage("build_result"):
+            return self._result_payload(ranked, version, path)
+    
+    def _result_payload(self, ranked: List[RankedChunk], version: int, path: str) -> Dict:
         results_meta = []
         contexts = []
         
-        for doc in docs:
+        for item in ranked:
+            doc = item.doc
             meta = doc.metadata
             results_meta.append({
                 'question': meta.get('question', ''),
@@ -113,7 +505,12 @@ class RAGService:
                     'subcategory': meta.get('subcategory', ''),
                     'subtopic': ''
                 },
-                'updated_at': None
+                'updated_at': None,
+                'score': item.score,
+                'bm25_score': item.bm25_score,
+                'vector_score': item.vector_score,
+                'path': item.path or path,
+                'chunk_id': meta.get('chunk_id')
             })
             contexts.append(doc.page_content)
         
@@ -129,20 +526,17 @@ class RAGService:
             'draft': draft,
             'alternatives': alternatives,
             'results_meta': results_meta,
-            'internal_token': None
+            'internal_token': None,
+            'index_version': version
         }
     
-    async def _generate_answer(self, question: str, contexts: List[str]) -> str:
-        if not contexts:
-            return "К сожалению, я не нашёл подходящей информации для ответа на этот вопрос. Пожалуйста, обратитесь в контакт-центр."
-        
-        context_text = "\n\n".join(contexts)
-        
+    def _answer_chain(self):
+        """Промпт + LLM; контекст и вопрос подставляются как переменные шаблона"""
         prompt = ChatPromptTemplate.from_messages([
             ("system", "Ты - помощник службы поддержки банка ВТБ (Беларусь). Твоя задача - давать точные, ясные и вежливые ответы на вопросы клиентов на основе предоставленной информации из базы знаний."),
-            ("user", f"""На основе следующей информации из базы знаний:
+            ("user", """На основе следующей информации из базы знаний:
 
-{context_text}
+{context}
 
 Ответь на вопрос клиента: {question}
 
@@ -154,70 +548,253 @@ class RAGService:
 - Не придумывай информацию
 """)
         ])
+        return prompt | self.llm
+    
+    async def _cached_answer(self, question: str, context_ids: List[int]) -> Tuple[Optional[str], Optional[np.ndarray]]:
+        """Ответ из семантического кэша и эмбеддинг вопроса (для записи в кэш)"""
+        if self.answer_cache.maxsize <= 0 or not context_ids:
+            return None, None
+        vector = await self._embed_query(question, normalize_query(question))
+        return self.answer_cache.get(vector, context_ids), vector
+    
+    async def _generate_answer(self, question: str, contexts: List[str],
+                               context_ids: Optional[List[int]] = None) -> str:
+        """
+        Ответ LLM по контекстам. С context_ids (chunk_id контекстов) ответ
+        берётся из семантического кэша и сохраняется в него.
+        """
+        if not contexts:
+            return "К сожалению, я не нашёл подходящей информации для ответа на этот вопрос. Пожалуйста, обратитесь в контакт-центр."
         
-        chain = prompt | self.llm
+        cached, vector = await self._cached_answer(question, context_ids or [])
+        if cached is not None:
+            return cached
         
         try:
-            response = await chain.ainvoke({
-                "context": context_text,
+            response = await self._answer_chain().ainvoke({
+                "context": "\n\n".join(contexts),
                 "question": question
             })
+            if vector is not None:
+                self.answer_cache.set(vector, context_ids, response.content)
             return response.content
         except Exception as e:
             print(f"Ошибка генерации ответа: {e}")
             return contexts[0] if contexts else "Произошла ошибка при генерации ответа."
     
-    async def save_knowledge_base(self):
-        csv_path = "/home/kate/T1-hackathon/backend/data/knowledge_base_augmented2.csv"
-        print(f"Сохранение базы знаний в {csv_path}...")
+    async def search_stream(self, query: str, top_k: int = 3,
+                            deadline: Optional[float] = None) -> AsyncIterator[Tuple[str, Dict]]:
+        """
+        Поиск с потоковой генерацией ответа: пары (событие, данные).
+        
+        - retrieval: draft и results_meta сразу после поиска
+        - token: очередной фрагмент ответа LLM
+        - fallback: LLM не успела к дедлайну или упала, ответ - шаблонный draft
+        - done: итоговый ответ и его источник (llm / cache / template)
+        """
+        deadline = deadline or settings.LLM_STREAM_DEADLINE_SECONDS
+        started = time.monotonic()
+        
+        result = await self.search(query, top_k)
+        yield "retrieval", {
+            'draft': result['draft'],
+            'alternatives': result['alternatives'],
+            'results_meta': result['results_meta'],
+            'index_version': result['index_version'],
+        }
         
-        save_df = self.df.rename(columns={
-            'category': 'Основная категория',
-            'subcategory': 'Подкатегория',
-            'question': 'Пример вопроса',
-            'answer': 'Шаблонный ответ',
-            'target_group': 'Целевая аудитория'
+        contexts = [meta['answer'] for meta in result['results_meta']]
+        if not contexts or self.llm is None:
+            yield "done", {'answer': result['draft'], 'source': 'template'}
+            return
+        
+        context_ids = [meta['chunk_id'] for meta in result['results_meta']]
+        cached, vector = await self._cached_answer(query, context_ids)
+        if cached is not None:
+            yield "token", {'text': cached}
+            yield "done", {'answer': cached, 'source': 'cache'}
+            return
+        
+        # Дедлайн общий на запрос: время поиска уже из него вычтено
+        stream = self._answer_chain().astream({
+            "context": "\n\n".join(contexts),
+            "question": query
         })
-        
-        save_df.to_csv(csv_path, index=False)
-        print("База знаний сохранена!")
+        parts = []
+        try:
+            while True:
+                remaining = deadline - (time.monotonic() - started)
+                if remaining <= 0:
+                    raise asyncio.TimeoutError
+                try:
+                    chunk = await asyncio.wait_for(stream.__anext__(), remaining)
+                except StopAsyncIteration:
+                    break
+                if chunk.content:
+                    parts.append(chunk.content)
+                    yield "token", {'text': chunk.content}
+        except asyncio.TimeoutError:
+            yield "fallback", {'reason': 'deadline', 'deadline_seconds': deadline}
+            yield "done", {'answer': result['draft'], 'source': 'template'}
+            return
+        except Exception as e:
+            print(f"Ошибка потоковой генерации ответа: {e}")
+            yield "fallback", {'reason': 'error', 'detail': str(e)}
+            yield "done", {'answer': result['draft'], 'source': 'template'}
+            return
+        finally:
+            await stream.aclose()
+        
+        answer = "".join(parts).strip()
+        if not answer:
+            yield "fallback", {'reason': 'empty'}
+            yield "done", {'answer': result['draft'], 'source': 'template'}
+            return
+        if vector is not None:
+            self.answer_cache.set(vector, context_ids, answer)
+        yield "done", {'answer': answer, 'source': 'llm'}
     
-    async def rebuild_index_for_item(self, question: str, new_answer: str, taxonomy: Dict):
-        print(f"Обновление индекса для вопроса: {question}")
+    def submit_kb_changes(self, changes: List[Dict]) -> IndexJob:
+        """
+        Ставит обновление БЗ и индекса в очередь index_updates.
         
-        mask = self.df['question'] == question
-        if mask.any():
-            self.df.loc[mask, 'answer'] = new_answer
-            if taxonomy:
-                if 'category' in taxonomy:
-                    self.df.loc[mask, 'category'] = taxonomy['category']
-                if 'subcategory' in taxonomy:
-                    self.df.loc[mask, 'subcategory'] = taxonomy['subcategory']
-        else:
-            new_row = {
-                'category': taxonomy.get('category', ''),
-                'subcategory': taxonomy.get('subcategory', ''),
-                'question': question,
-                'target_group': 'все клиенты',
-                'answer': new_answer,
-                'is_original': False
-            }
-            self.df = pd.concat([self.df, pd.DataFrame([new_row])], ignore_index=True)
-        
-        await self._build_indices()
-        
-        retriever = self.vector_store.as_retriever(search_kwargs={"k": settings.TOP_K})
-        self.bm25_retriever.k = settings.TOP_K
-        
-        self.ensemble_retriever = EnsembleRetriever(
-            retrievers=[self.bm25_retriever, retriever],
-            weights=[settings.BM25_WEIGHT, settings.VECTOR_WEIGHT]
+        changes - словари {'question', 'answer', 'taxonomy'}. Статус - по job.id в index_jobs.
+        """
+        return self.index_updates.submit(changes)
+    
+    def index_status(self) -> Dict:
+        return {
+            'index_version': self.indices.version,
+            'phase': self.phase,
+            'rows': len(self.kb) if self.kb is not None else 0,
+            'chunks': len(self.indices.current.index) if self.indices.current else 0,
+            'vector_index_type': self.indices.current.index.vector.kind if self.indices.current else None,
+            'kb_seq': self.kb.seq if self.kb is not None else None,
+            'index_kb_seq': self.index_seq,
+            'snapshot': self.snapshot_manifest['snapshot'] if self.snapshot_manifest else None,
+            'snapshot_kb_seq': self.snapshot_manifest['kb_seq'] if self.snapshot_manifest else None,
+            'rows_since_snapshot': self.rows_since_snapshot,
+            **self.index_updates.status(),
+        }
+    
+    async def apply_kb_changes(self, changes: List[Dict],
+                               on_stage: Optional[Callable[[str], None]] = None) -> int:
+        """Все правки - одной транзакцией хранилища, одним пересчётом эмбеддингов и одной публикацией индекса"""
+        # Запись в хранилище и доводка индекса (_sync) идут по очереди: каждая читает
+        # changes_since от index_seq, до которого дошла предыдущая, и строки попадают
+        # в индекс в порядке seq хранилища
+        async with self._update_lock:
+            with INDEX_REBUILD_SECONDS.time():
+                return await self._apply_kb_changes(changes, on_stage or (lambda stage: None))
+    
+    async def _apply_kb_changes(self, changes: List[Dict], on_stage: Callable[[str], None]) -> int:
+        print(f"Обновление индекса: {len(changes)} правок")
+        on_stage("kb")
+        
+        # Несколько правок одного вопроса - применяется последняя
+        latest = {KnowledgeBaseStore.question_key(change['question']): change for change in changes}
+        await asyncio.to_thread(self.kb.apply_changes, list(latest.values()))
+        
+        # Вместе с этими правками в индекс попадут и ещё не подхваченные правки других воркеров
+        version, rows = await self._sync(on_stage)
+        print(f"Индекс обновлён! Версия {version}, строк: {rows}")
+        return version
+    
+    async def _sync(self, on_stage: Callable[[str], None] = lambda stage: None) -> Tuple[int, int]:
+        """
+        Доводит опубликованный индекс до хранилища: строки с seq новее index_seq.
+        
+        Правки, принятые другим воркером, этот применяет у себя сам; их
+        эмбеддинги уже в общем кэше, поэтому к API эмбеддингов он не обращается.
+        Возвращает (версию индекса, число применённых строк).
+        """
+        changes = await asyncio.to_thread(self.kb.changes_since, self.index_seq)
+        if not changes:
+            return self.indices.version, 0
+        
+        current = self.indices.current.index
+        old_rows = {row_id: self._indexed_row(current, row_id) for row_id, _, _ in changes}
+        
+        # Эмбеддинги и публикация - вне event loop, поиск продолжает работать на текущей версии
+        on_stage("embedding")
+        row_ids, documents, vectors = await asyncio.to_thread(self._embed_rows, changes)
+        
+        on_stage("publishing")
+        version = await asyncio.to_thread(
+            self.indices.update, lambda index: self._apply_rows(index, row_ids, documents, vectors)
         )
-        
-        await self.save_knowledge_base()
-        
-        print("Индекс обновлён!")
+        for row_id, row, _ in changes:
+            self._recount_categories(old_rows[row_id], row)
+        # Ответы LLM, построенные на старом тексте этих строк, больше не верны
+        self.answer_cache.invalidate_rows(row_ids)
+        self.index_seq = max(row_seq for _, _, row_seq in changes)
+        self.rows_since_snapshot += len(changes)
+        return version, len(changes)
+    
+    @staticmethod
+    def _indexed_row(index: KnowledgeIndex, row_id: int) -> Optional[Dict]:
+        """Метаданные строки в индексе (до правки); None - строки в индексе нет"""
+        chunk_ids = index.docs.row_chunks(row_id)
+        return index.docs[chunk_ids[0]].metadata if chunk_ids else None
+    
+    async def _sync_loop(self):
+        """
+        Синхронизация с другими воркерами раз в INDEX_SYNC_INTERVAL_SECONDS.
+        
+        Подхватывает правки хранилища, сделанные другими процессами,
+        переходит на новый снапшот, если его записал другой воркер, и пишет
+        новый сам, когда правок поверх текущего накопилось больше порога.
+        """
+        while True:
+            await asyncio.sleep(settings.INDEX_SYNC_INTERVAL_SECONDS)
+            try:
+                async with self._update_lock:
+                    await self._remap()
+                    await self._sync()
+                if self.rows_since_snapshot > self._snapshot_threshold(self.snapshot_manifest):
+                    await self._refresh_snapshot()
+            except Exception as e:
+                print(f"Ошибка синхронизации индекса: {e}")
+    
+    async def _remap(self):
+        """Переходит на текущий снапшот из манифеста, если он новее отображённого"""
+        manifest = await asyncio.to_thread(self.snapshots.read_manifest)
+        if (manifest is None or manifest.get('snapshot') == self.snapshot_manifest['snapshot']
+                or not self._snapshot_compatible(manifest)):
+            return
+        index = await asyncio.to_thread(self._load_snapshot, manifest)
+        if index is None:
+            return
+        seq, changed = await asyncio.to_thread(self._catch_up, index, manifest['kb_seq'])
+        await asyncio.to_thread(self.indices.publish, index)
+        self.snapshot_manifest = manifest
+        self.index_seq = seq
+        self.rows_since_snapshot = changed
+        self._count_categories()
+        self.answer_cache.clear()
+    
+    async def _refresh_snapshot(self):
+        """
+        Новый снапшот вместо накопившихся поверх текущего правок.
+        
+        Пишет его воркер, взявший блокировку (эмбеддинги - из кэша), поиск
+        тем временем идёт по текущему индексу; на новый снапшот все воркеры,
+        включая этот, переходят в _remap.
+        """
+        def write() -> Optional[Dict]:
+            with self.snapshots.lock(blocking=False) as acquired:
+                if not acquired:
+                    return None
+                latest = self.snapshots.read_manifest()
+                if latest is not None and latest.get('snapshot') != self.snapshot_manifest['snapshot']:
+                    # Другой воркер уже записал новый снапшот
+                    return None
+                print(f"Поверх снапшота изменено {self.rows_since_snapshot} строк, запись нового снапшота...")
+                return self._write_snapshot(report=False)
+        
+        if await asyncio.to_thread(write) is not None:
+            async with self._update_lock:
+                await self._remap()
 
 
 rag_service = RAGService()
-
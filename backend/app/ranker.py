@@ -0,0 +1,122 @@
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+from langchain_core.documents import Document
+from app.indexes import KnowledgeIndex
+from app.metrics import stage
+
+
+FUSION_METHODS = ("rrf", "blend")
+
+
+@dataclass
+class RankedChunk:
+    doc: Document
+    score: float
+    bm25_score: Optional[float] = None
+    vector_score: Optional[float] = None
+    # Как найден чанк, если не тем же путём, что весь результат (exact, near_exact, bm25)
+    path: Optional[str] = None
+
+
+def _min_max(scores: Dict[int, float]) -> Dict[int, float]:
+    if not scores:
+        return {}
+    low, high = min(scores.values()), max(scores.values())
+    if high == low:
+        return {chunk_id: 1.0 for chunk_id in scores}
+    return {chunk_id: (score - low) / (high - low) for chunk_id, score in scores.items()}
+
+
+class HybridRanker:
+    """
+    Гибридное ранжирование: BM25 (CSR) + FAISS со слиянием результатов.
+
+    - rrf: взвешенный Reciprocal Rank Fusion, w / (rrf_k + rank)
+    - blend: min-max нормализация оценок кандидатов и взвешенная сумма
+
+    Из каждого индекса берётся max(candidates, 3 * top_k) кандидатов, поэтому
+    top_k запроса соблюдается, даже если он больше TOP_K по умолчанию.
+    """
+
+    def __init__(self, method: str = "rrf", bm25_weight: float = 0.4, vector_weight: float = 0.6,
+                 rrf_k: int = 60, candidates: int = 50):
+        if method not in FUSION_METHODS:
+            raise ValueError(f"Неизвестный метод слияния: {method}, ожидается один из {FUSION_METHODS}")
+        self.method = method
+        self.bm25_weight = bm25_weight
+        self.vector_weight = vector_weight
+        self.rrf_k = rrf_k
+        self.candidates = candidates
+
+    def rank(self, index: KnowledgeIndex, query: str, vector: List[float], top_k: int) -> List[RankedChunk]:
+        n_candidates = max(self.candidates, 3 * top_k)
+        with stage("bm25"):
+            bm25 = dict(index.bm25.search(query, n_candidates))
+        with stage("faiss"):
+            dense = dict(index.vector.search(vector, n_candidates))
+        with stage("fusion"):
+            return self.fuse(index, bm25, dense, top_k)
+
+    def rank_many(self, index: KnowledgeIndex, queries: List[str], vectors,
+                  top_k: int) -> List[List[RankedChunk]]:
+        """Пакетная версия rank: один матричный поиск FAISS и один проход BM25"""
+        n_candidates = max(self.candidates, 3 * top_k)
+        with stage("bm25"):
+            bm25 = index.bm25.search_many(queries, n_candidates)
+        with stage("faiss"):
+            dense = index.vector.search_many(vectors, n_candidates)
+        with stage("fusion"):
+            return [
+                self.fuse(index, dict(lexical), dict(semantic), top_k)
+                for lexical, semantic in zip(bm25, dense)
+            ]
+
+    def fill_lexical(self, index: KnowledgeIndex, query: str, pinned: List[RankedChunk],
+                     top_k: int) -> List[RankedChunk]:
+        """Дополняет найденные без эмбеддинга чанки результатами BM25 до top_k"""
+        results = list(pinned[:top_k])
+        seen = {item.doc.page_content for item in results}
+        for chunk_id, score in index.bm25.search(query, max(self.candidates, 3 * top_k)):
+            if len(results) >= top_k:
+                break
+            doc = index.docs[chunk_id]
+            if doc.page_content in seen:
+                continue
+            seen.add(doc.page_content)
+            results.append(RankedChunk(doc=doc, score=0.0, bm25_score=score, path="bm25"))
+        return results
+
+    def fuse(self, index: KnowledgeIndex, bm25: Dict[int, float], dense: Dict[int, float],
+             top_k: int) -> List[RankedChunk]:
+        """Сливает оценки кандидатов (chunk_id -> score) двух индексов"""
+        if self.method == "rrf":
+            fused = {}
+            for scores, weight in ((bm25, self.bm25_weight), (dense, self.vector_weight)):
+                ordered = sorted(scores, key=scores.get, reverse=True)
+                for rank, chunk_id in enumerate(ordered, start=1):
+                    fused[chunk_id] = fused.get(chunk_id, 0.0) + weight / (self.rrf_k + rank)
+        else:
+            bm25_norm, dense_norm = _min_max(bm25), _min_max(dense)
+            fused = {
+                chunk_id: self.bm25_weight * bm25_norm.get(chunk_id, 0.0)
+                + self.vector_weight * dense_norm.get(chunk_id, 0.0)
+                for chunk_id in bm25.keys() | dense.keys()
+            }
+
+        # Дубли ответов (аугментированные вопросы с одним ответом) схлопываются по тексту
+        results: List[RankedChunk] = []
+        seen = set()
+        for chunk_id in sorted(fused, key=fused.get, reverse=True):
+            doc = index.docs[chunk_id]
+            if doc.page_content in seen:
+                continue
+            seen.add(doc.page_content)
+            results.append(RankedChunk(
+                doc=doc,
+                score=fused[chunk_id],
+                bm25_score=bm25.get(chunk_id),
+                vector_score=dense.get(chunk_id)
+            ))
+            if len(results) == top_k:
+                break
+        return results
@@ -0,0 +1,76 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional
+
+
+@dataclass
+class Span:
+    name: str
+    start: float
+    end: Optional[float] = None
+    attrs: Dict[str, Any] = field(default_factory=dict)
+    children: List["Span"] = field(default_factory=list)
+
+    def to_dict(self, origin: float) -> Dict:
+        end = self.end if self.end is not None else time.perf_counter()
+        node = {
+            'name': self.name,
+            'start_ms': round((self.start - origin) * 1000, 3),
+            'duration_ms': round((end - self.start) * 1000, 3),
+        }
+        if self.attrs:
+            node['attrs'] = self.attrs
+        if self.children:
+            node['children'] = [child.to_dict(origin) for child in self.children]
+        return node
+
+
+# Текущий span запроса; None - трассировка выключена и span() ничего не делает
+_current: ContextVar[Optional[Span]] = ContextVar("rag_span", default=None)
+
+
+def active() -> bool:
+    return _current.get() is not None
+
+
+@contextmanager
+def trace(name: str) -> Iterator[Span]:
+    """Корневой span запроса: всё, что вызвано внутри (и в asyncio.to_thread), попадает в дерево"""
+    root = Span(name=name, start=time.perf_counter())
+    token = _current.set(root)
+    try:
+        yield root
+    finally:
+        root.end = time.perf_counter()
+        _current.reset(token)
+
+
+@contextmanager
+def span(name: str, **attrs) -> Iterator[Optional[Span]]:
+    parent = _current.get()
+    if parent is None:
+        yield None
+        return
+    child = Span(name=name, start=time.perf_counter(), attrs=attrs)
+    parent.children.append(child)
+    token = _current.set(child)
+    try:
+        yield child
+    finally:
+        child.end = time.perf_counter()
+        _current.reset(token)
+
+
+def record(name: str, start: float, end: float, **attrs):
+    """Добавляет уже завершившийся интервал (perf_counter) в текущий span"""
+    parent = _current.get()
+    if parent is not None:
+        parent.children.append(Span(name=name, start=start, end=end, attrs=attrs))
+
+
+def annotate(**attrs):
+    current = _current.get()
+    if current is not None:
+        current.attrs.update(attrs)
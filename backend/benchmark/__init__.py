@@ -0,0 +1,13 @@
+"""
+Офлайн-бенчмарк поиска по базе знаний.
+
+Запуск из каталога backend:
+
+    python -m benchmark --out benchmark_results/run.json
+
+Эталон - knowledge_base_augmented2.csv: индекс строится по исходным строкам
+(is_original=True), запросами служат аугментированные вопросы
+(is_original=False), правильный ответ - строка с тем же шаблонным ответом.
+Эмбеддинги считаются локально детерминированной заменой bge-m3, поэтому
+прогон не требует сети и воспроизводим.
+"""
@@ -0,0 +1,134 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Tuple
+from app.kb_store import file_sha256
+
+DEFAULT_CSV = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                           "data", "knowledge_base_augmented2.csv")
+
+# Ключ строки результата для сравнения прогонов
+ROW_KEY = ('chunk_size', 'fusion', 'bm25_weight', 'vector_weight', 'top_k', 'fast_path')
+
+
+def parse_weights(value: str) -> Tuple[float, float]:
+    """'0.4:0.6' -> (bm25_weight, vector_weight)"""
+    try:
+        bm25, vector = value.split(":")
+        return float(bm25), float(vector)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Ожидается BM25:VECTOR, например 0.4:0.6, получено {value}")
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def compare(rows: List[Dict], baseline: Dict, max_recall_drop: float,
+            max_latency_increase: float) -> List[str]:
+    """Регрессии относительно прошлого прогона: падение качества или рост p95"""
+    previous = {tuple(row[k] for k in ROW_KEY): row for row in baseline['results']}
+    regressions = []
+    for row in rows:
+        old = previous.get(tuple(row[k] for k in ROW_KEY))
+        # Разные наборы запросов (--limit, другой CSV) не сравниваются
+        if old is None or old.get('num_queries') != row['num_queries']:
+            continue
+        name = ", ".join(f"{k}={row[k]}" for k in ROW_KEY)
+        for metric in [k for k in row if k.startswith('recall@')] + ['mrr']:
+            if metric in old and old[metric] - row[metric] > max_recall_drop:
+                regressions.append(f"{name}: {metric} {old[metric]} -> {row[metric]}")
+        old_p95, new_p95 = old['latency_ms']['p95'], row['latency_ms']['p95']
+        if old_p95 and (new_p95 - old_p95) / old_p95 > max_latency_increase:
+            regressions.append(f"{name}: latency p95 {old_p95}ms -> {new_p95}ms")
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmark",
+        description="Офлайн-бенчмарк поиска: Recall@k, MRR, время сборки, латентность, пиковый RSS"
+    )
+    parser.add_argument("--csv", default=DEFAULT_CSV, help="CSV базы знаний с колонкой is_original")
+    parser.add_argument("--chunk-sizes", type=int, nargs="+", default=[500])
+    parser.add_argument("--top-k", type=int, nargs="+", default=[3, 5])
+    parser.add_argument("--weights", type=parse_weights, nargs="+", default=[(0.4, 0.6)],
+                        help="пары BM25:VECTOR, например 0.4:0.6 0.2:0.8")
+    parser.add_argument("--fusion", nargs="+", default=["rrf"], choices=["rrf", "blend"])
+    parser.add_argument("--no-fast-path", action="store_true",
+                        help="отключить быстрый путь по совпадению вопроса")
+    parser.add_argument("--dim", type=int, default=384, help="размерность офлайн-эмбеддингов")
+    parser.add_argument("--embedding-latency-ms", type=float, default=0.0,
+                        help="имитация времени ответа API эмбеддингов на батч")
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--limit", type=int, default=0, help="ограничить число запросов")
+    parser.add_argument("--out", default="benchmark_results/latest.json")
+    parser.add_argument("--baseline", help="JSON прошлого прогона для поиска регрессий")
+    parser.add_argument("--max-recall-drop", type=float, default=0.01)
+    parser.add_argument("--max-latency-increase", type=float, default=0.25,
+                        help="допустимый относительный рост p95")
+    args = parser.parse_args(argv)
+
+    # Каждый размер чанка - в свежем процессе: честные время сборки и пиковый RSS
+    context = multiprocessing.get_context("spawn")
+    rows: List[Dict] = []
+    for chunk_size in args.chunk_sizes:
+        params = {
+            'csv_path': args.csv,
+            'chunk_size': chunk_size,
+            'top_k': args.top_k,
+            'weights': args.weights,
+            'fusion_methods': args.fusion,
+            'fast_path': not args.no_fast_path,
+            'dim': args.dim,
+            'embedding_latency_ms': args.embedding_latency_ms,
+            'warmup': args.warmup,
+            'limit': args.limit,
+        }
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            from benchmark.retrieval import run_chunk_size
+            rows.extend(executor.submit(run_chunk_size, params).result())
+
+    report = {
+        'meta': {
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'git_commit': git_commit(),
+            'dataset': os.path.basename(args.csv),
+            'dataset_sha256': file_sha256(args.csv),
+            'embeddings': f"hashing-{args.dim}",
+            'embedding_latency_ms': args.embedding_latency_ms,
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+        },
+        'results': rows,
+    }
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+    with open(args.out, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Результаты сохранены в {args.out}")
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(rows, baseline, args.max_recall_drop, args.max_latency_increase)
+        for line in regressions:
+            print(f"РЕГРЕССИЯ: {line}")
+        if regressions:
+            return 1
+        print("Регрессий относительно базового прогона нет")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,209 @@
+"""
+Бенчмарк векторных индексов: recall, латентность и память по типам FAISS.
+
+    python -m benchmark.ann --types flat flat_fp16 hnsw ivf_flat ivf_sq8 ivf_pq \\
+        --ef-search 16 32 64 128 --nprobe 1 4 16 64 --scale 200000
+
+Корпус - чанки базы знаний, нарезанные как в RAGService. Векторы берутся из
+персистентного кэша эмбеддингов (--embedding-cache: настоящие векторы
+EMBEDDING_MODEL, запросы - отложенная часть корпуса) или считаются офлайн
+feature hashing (запросы - вопросы из CSV). --scale дополняет корпус
+зашумлёнными копиями его векторов до заданного размера, чтобы оценить
+индексы на будущей, большей БЗ. Эталон recall@k - точный поиск flat по
+тому же корпусу. Каждый тип строится один раз, параметры поиска (efSearch
+HNSW, nprobe IVF) перебираются без пересборки.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+# Бенчмарк не обращается к API, но Settings требует ключ
+os.environ.setdefault("API_KEY", "offline")
+
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from app.config import settings
+from app.embedding_cache import EmbeddingCache
+from app.indexes import VECTOR_INDEX_TYPES, VectorIndex, VectorIndexSpec
+from app.kb_store import CSV_COLUMNS
+from benchmark.__main__ import DEFAULT_CSV
+from benchmark.offline_embeddings import hashing_vector
+from benchmark.retrieval import latency_summary
+
+
+def load_corpus(args) -> Tuple[np.ndarray, np.ndarray]:
+    """(векторы корпуса, векторы запросов), нормированные"""
+    rng = np.random.default_rng(args.seed)
+    if args.embedding_cache:
+        vectors = EmbeddingCache(args.embedding_cache).vectors(args.model)
+        if len(vectors) < 2:
+            raise SystemExit(f"В {args.embedding_cache} нет векторов модели {args.model}")
+        order = rng.permutation(len(vectors))
+        n_queries = min(args.queries, max(1, len(vectors) // 10))
+        corpus, queries = vectors[order[n_queries:]], vectors[order[:n_queries]]
+    else:
+        df = pd.read_csv(args.csv).rename(columns=CSV_COLUMNS).dropna(subset=['question', 'answer'])
+        splitter = RecursiveCharacterTextSplitter(
+            chunk_size=settings.CHUNK_SIZE,
+            chunk_overlap=settings.CHUNK_OVERLAP
+        )
+        texts = [chunk for answer in df['answer'] for chunk in splitter.split_text(answer)]
+        questions = df['question'].tolist()
+        questions = [questions[i] for i in rng.permutation(len(questions))[:args.queries]]
+        corpus = np.asarray([hashing_vector(text, args.dim) for text in texts], dtype=np.float32)
+        queries = np.asarray([hashing_vector(question, args.dim) for question in questions], dtype=np.float32)
+
+    if args.scale > len(corpus):
+        # Синтетика: случайный вектор корпуса + гауссов шум относительной нормы noise
+        base = corpus[rng.integers(0, len(corpus), size=args.scale - len(corpus))]
+        noise = rng.standard_normal(base.shape).astype(np.float32)
+        noise *= args.noise * np.linalg.norm(base, axis=1, keepdims=True) / np.sqrt(base.shape[1])
+        corpus = np.vstack([corpus, base + noise])
+
+    corpus = np.ascontiguousarray(corpus, dtype=np.float32)
+    queries = np.ascontiguousarray(queries, dtype=np.float32)
+    corpus /= np.linalg.norm(corpus, axis=1, keepdims=True)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    return corpus, queries
+
+
+def recall_at(found: List[List[Tuple[int, float]]], truth: List[List[Tuple[int, float]]], k: int) -> float:
+    hits = [
+        len({i for i, _ in got[:k]} & {i for i, _ in exact[:k]}) / max(1, min(k, len(exact)))
+        for got, exact in zip(found, truth)
+    ]
+    return round(float(np.mean(hits)), 4)
+
+
+def evaluate(index: VectorIndex, queries: np.ndarray, truth: List[List[Tuple[int, float]]],
+             k: int, warmup: int) -> Dict:
+    for query in queries[:warmup]:
+        index.search(query, k)
+
+    latencies, found = [], []
+    for query in queries:
+        start = time.perf_counter()
+        found.append(index.search(query, k))
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    index.search_many(queries, k)
+    batch_seconds = time.perf_counter() - start
+
+    return {
+        **{f'recall@{at}': recall_at(found, truth, at) for at in sorted({1, 10, k}) if at <= k},
+        'latency_ms': latency_summary(latencies),
+        'batch_qps': round(len(queries) / batch_seconds, 1),
+    }
+
+
+def run(args) -> List[Dict]:
+    corpus, queries = load_corpus(args)
+    ids = list(range(len(corpus)))
+    print(f"Корпус: {len(corpus)} векторов размерности {corpus.shape[1]}, запросов: {len(queries)}")
+
+    exact = VectorIndex(spec=VectorIndexSpec(kind="flat"))
+    exact.add(ids, corpus)
+    truth = exact.search_many(queries, args.k)
+
+    rows = []
+    for kind in args.types:
+        spec = VectorIndexSpec(
+            kind=kind,
+            hnsw_m=args.hnsw_m,
+            ef_construction=args.ef_construction,
+            nlist=args.nlist,
+            pq_m=args.pq_m,
+            pq_nbits=args.pq_nbits,
+            train_sample=args.train_sample
+        )
+        index = VectorIndex(spec=spec)
+        start = time.perf_counter()
+        index.add(ids, corpus)
+        build_seconds = time.perf_counter() - start
+        memory = index.memory_bytes()
+
+        if index.kind == "hnsw":
+            grid = [{'ef_search': value} for value in args.ef_search]
+        elif index.kind.startswith("ivf"):
+            grid = [{'nprobe': value} for value in args.nprobe]
+        else:
+            grid = [{}]
+
+        for params in grid:
+            index.set_search_params(**params)
+            metrics = evaluate(index, queries, truth, args.k, args.warmup)
+            rows.append({
+                'type': kind,
+                'built_as': index.kind,
+                'build_params': spec.build_params(),
+                'search_params': params,
+                'num_vectors': len(corpus),
+                'dim': int(corpus.shape[1]),
+                'build_seconds': round(build_seconds, 3),
+                'memory_mb': round(memory / 2 ** 20, 2),
+                'bytes_per_vector': round(memory / len(corpus), 1),
+                **metrics,
+            })
+            print(f"{kind:10} {json.dumps(params):20} recall@{args.k}={metrics[f'recall@{args.k}']:<7} "
+                  f"p50={metrics['latency_ms']['p50']}ms p99={metrics['latency_ms']['p99']}ms "
+                  f"память={rows[-1]['memory_mb']}MB сборка={rows[-1]['build_seconds']}s")
+        del index
+    return rows
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmark.ann",
+        description="Бенчмарк векторных индексов FAISS: recall, латентность, память"
+    )
+    parser.add_argument("--types", nargs="+", default=list(VECTOR_INDEX_TYPES), choices=VECTOR_INDEX_TYPES)
+    parser.add_argument("--csv", default=DEFAULT_CSV, help="CSV базы знаний (корпус без --embedding-cache)")
+    parser.add_argument("--embedding-cache", help="SQLite-кэш эмбеддингов: настоящие векторы корпуса")
+    parser.add_argument("--model", default=settings.EMBEDDING_MODEL, help="модель в кэше эмбеддингов")
+    parser.add_argument("--dim", type=int, default=1024, help="размерность офлайн-эмбеддингов")
+    parser.add_argument("--scale", type=int, default=0,
+                        help="дополнить корпус зашумлёнными копиями до этого числа векторов")
+    parser.add_argument("--noise", type=float, default=0.3, help="относительная норма шума синтетики")
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[16, 32, 64, 128])
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--hnsw-m", type=int, default=settings.VECTOR_INDEX_HNSW_M)
+    parser.add_argument("--ef-construction", type=int, default=settings.VECTOR_INDEX_HNSW_EF_CONSTRUCTION)
+    parser.add_argument("--nlist", type=int, default=settings.VECTOR_INDEX_IVF_NLIST,
+                        help="число кластеров IVF, 0 - 4 * sqrt(N)")
+    parser.add_argument("--pq-m", type=int, default=settings.VECTOR_INDEX_PQ_M)
+    parser.add_argument("--pq-nbits", type=int, default=settings.VECTOR_INDEX_PQ_NBITS)
+    parser.add_argument("--train-sample", type=int, default=settings.VECTOR_INDEX_TRAIN_SAMPLE)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="benchmark_results/ann.json")
+    args = parser.parse_args(argv)
+
+    rows = run(args)
+    report = {
+        'meta': {
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'corpus': args.embedding_cache or os.path.basename(args.csv),
+            'embeddings': args.model if args.embedding_cache else f"hashing-{args.dim}",
+            'scale': args.scale,
+            'k': args.k,
+        },
+        'results': rows,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+    with open(args.out, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Результаты сохранены в {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
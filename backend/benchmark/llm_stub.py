@@ -0,0 +1,210 @@
+"""
+Локальная замена SciBox API (OpenAI-совместимая) для нагрузочных тестов.
+
+    python -m benchmark.llm_stub --port 8100 --latency-ms 40 --error-rate 0.01 --rate-limit 200
+
+Backend направляется на неё через LLM_BASE_URL=http://localhost:8100/v1.
+Эмбеддинги детерминированы (hashing_vector), ответ чата собирается из
+контекста промпта, так что прогоны воспроизводимы и не тратят квоту.
+"""
+import argparse
+import asyncio
+import json
+import random
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Union
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel
+
+from benchmark.offline_embeddings import hashing_vector
+
+
+class StubConfig(BaseModel):
+    dim: int = 1024
+    latency_ms: float = 0.0            # базовая задержка на запрос
+    per_item_latency_ms: float = 0.0   # добавка за каждый текст в батче эмбеддингов
+    jitter_ms: float = 0.0             # равномерный шум задержки
+    token_latency_ms: float = 5.0      # пауза между чанками при stream=true
+    error_rate: float = 0.0            # доля ответов 500
+    rate_limit: float = 0.0            # запросов в секунду, 0 - без ограничения
+    burst: int = 0                     # ёмкость token bucket, по умолчанию = rate_limit
+    seed: int = 42
+
+
+class EmbeddingsRequest(BaseModel):
+    model: str = "bge-m3"
+    input: Union[str, List[str]]
+
+
+class ChatMessage(BaseModel):
+    role: str
+    content: Any = ""
+
+
+class ChatRequest(BaseModel):
+    model: str = "stub"
+    messages: List[ChatMessage]
+    stream: bool = False
+    max_tokens: Optional[int] = None
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.capacity = burst or max(1, int(rate))
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> Optional[float]:
+        """None - запрос пропущен, иначе секунды до появления токена"""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return None
+            return (1 - self.tokens) / self.rate
+
+
+def _chat_answer(messages: List[ChatMessage], max_tokens: Optional[int]) -> str:
+    """Первый абзац контекста из промпта RAGService._generate_answer (или эхо)"""
+    text = str(messages[-1].content) if messages else ""
+    parts = [p.strip() for p in text.split("\n\n") if p.strip()]
+    answer = parts[1] if len(parts) > 2 else text
+    words = answer.split()
+    return " ".join(words[:max_tokens] if max_tokens else words)
+
+
+def create_app(config: StubConfig) -> FastAPI:
+    app = FastAPI(title="LLM stub", version="1.0.0")
+    rng = random.Random(config.seed)
+    bucket = TokenBucket(config.rate_limit, config.burst) if config.rate_limit > 0 else None
+    counters = {'requests': 0, 'rate_limited': 0, 'errors': 0, 'embedded_texts': 0}
+
+    async def admit(items: int = 1) -> Optional[JSONResponse]:
+        counters['requests'] += 1
+        if bucket is not None:
+            retry_after = bucket.acquire()
+            if retry_after is not None:
+                counters['rate_limited'] += 1
+                return JSONResponse(
+                    status_code=429,
+                    content={'error': {'message': 'Rate limit exceeded', 'type': 'rate_limit_error'}},
+                    headers={'Retry-After': f"{retry_after:.3f}"}
+                )
+
+        delay = config.latency_ms + config.per_item_latency_ms * items + rng.uniform(0, config.jitter_ms)
+        if delay > 0:
+            await asyncio.sleep(delay / 1000)
+
+        if config.error_rate and rng.random() < config.error_rate:
+            counters['errors'] += 1
+            return JSONResponse(
+                status_code=500,
+                content={'error': {'message': 'Injected failure', 'type': 'server_error'}}
+            )
+        return None
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: EmbeddingsRequest):
+        texts = [request.input] if isinstance(request.input, str) else request.input
+        rejected = await admit(len(texts))
+        if rejected is not None:
+            return rejected
+
+        counters['embedded_texts'] += len(texts)
+        tokens = sum(len(t.split()) for t in texts)
+        return {
+            'object': 'list',
+            'model': request.model,
+            'data': [
+                {'object': 'embedding', 'index': i, 'embedding': hashing_vector(text, config.dim)}
+                for i, text in enumerate(texts)
+            ],
+            'usage': {'prompt_tokens': tokens, 'total_tokens': tokens},
+        }
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: ChatRequest):
+        rejected = await admit()
+        if rejected is not None:
+            return rejected
+
+        answer = _chat_answer(request.messages, request.max_tokens)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        created = int(time.time())
+        prompt_tokens = sum(len(str(m.content).split()) for m in request.messages)
+        usage = {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': len(answer.split()),
+            'total_tokens': prompt_tokens + len(answer.split()),
+        }
+
+        if not request.stream:
+            return {
+                'id': completion_id,
+                'object': 'chat.completion',
+                'created': created,
+                'model': request.model,
+                'choices': [{
+                    'index': 0,
+                    'message': {'role': 'assistant', 'content': answer},
+                    'finish_reason': 'stop',
+                }],
+                'usage': usage,
+            }
+
+        async def events():
+            def chunk(delta: Dict, finish_reason: Optional[str] = None) -> str:
+                payload = {
+                    'id': completion_id,
+                    'object': 'chat.completion.chunk',
+                    'created': created,
+                    'model': request.model,
+                    'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}],
+                }
+                return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+            yield chunk({'role': 'assistant', 'content': ''})
+            for word in answer.split(" "):
+                if config.token_latency_ms:
+                    await asyncio.sleep(config.token_latency_ms / 1000)
+                yield chunk({'content': word + " "})
+            yield chunk({}, finish_reason='stop')
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.get("/v1/models")
+    async def models():
+        return {'object': 'list', 'data': [{'id': 'bge-m3', 'object': 'model'}, {'id': 'stub', 'object': 'model'}]}
+
+    @app.get("/stats")
+    async def stats():
+        return {**counters, 'config': config.model_dump()}
+
+    return app
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmark.llm_stub",
+                                     description="Локальная OpenAI-совместимая замена SciBox API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    for name, field in StubConfig.model_fields.items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=type(field.default), default=field.default)
+    args = vars(parser.parse_args(argv))
+
+    import uvicorn
+    host, port = args.pop("host"), args.pop("port")
+    uvicorn.run(create_app(StubConfig(**args)), host=host, port=port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,327 @@
+"""
+Асинхронный нагрузочный тест backend.
+
+    python -m benchmark.load --url http://localhost:8000 --concurrency 1 4 16 64
+
+С --workers N сам поднимает локальную замену SciBox (llm_stub) и uvicorn
+с N воркерами во временном каталоге, так что прогон не трогает рабочие
+данные и не требует сети. Для каждого уровня конкурентности (закрытая
+модель: каждый клиент шлёт следующий запрос после ответа) меряет
+пропускную способность и гистограммы латентности по эндпоинтам, затем
+определяет точку насыщения.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+import httpx
+import numpy as np
+import pandas as pd
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_CSV = os.path.join(BACKEND_DIR, "data", "knowledge_base_augmented2.csv")
+
+# Границы корзин гистограммы, мс
+HISTOGRAM_BOUNDS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+
+OPERATIONS = ("search", "feedback", "resolve")
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    """'search=90,feedback=8,resolve=2' -> нормированные доли"""
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"Неизвестная операция {name}, ожидается одна из {OPERATIONS}")
+        mix[name] = float(weight)
+    total = sum(mix.values())
+    if total <= 0:
+        raise argparse.ArgumentTypeError("Сумма долей должна быть положительной")
+    return {name: weight / total for name, weight in mix.items()}
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {op: [] for op in OPERATIONS}
+        self.errors: Dict[str, Dict[str, int]] = {op: {} for op in OPERATIONS}
+
+    def record(self, op: str, seconds: float, status: Optional[int]):
+        if status is not None and status < 400:
+            self.latencies[op].append(seconds)
+        else:
+            key = str(status) if status is not None else "transport"
+            self.errors[op][key] = self.errors[op].get(key, 0) + 1
+
+    def summary(self, elapsed: float) -> Dict:
+        per_op = {}
+        for op in OPERATIONS:
+            ms = np.asarray(self.latencies[op]) * 1000
+            errors = sum(self.errors[op].values())
+            if not len(ms) and not errors:
+                continue
+            counts = np.histogram(ms, bins=[0] + HISTOGRAM_BOUNDS_MS + [np.inf])[0] if len(ms) else []
+            per_op[op] = {
+                'ok': int(len(ms)),
+                'errors': self.errors[op],
+                'throughput_rps': round(len(ms) / elapsed, 2),
+                'latency_ms': {
+                    'mean': round(float(ms.mean()), 2),
+                    'p50': round(float(np.percentile(ms, 50)), 2),
+                    'p95': round(float(np.percentile(ms, 95)), 2),
+                    'p99': round(float(np.percentile(ms, 99)), 2),
+                    'max': round(float(ms.max()), 2),
+                } if len(ms) else None,
+                'histogram_ms': {
+                    f"<={bound}" if bound != np.inf else f">{HISTOGRAM_BOUNDS_MS[-1]}": int(count)
+                    for bound, count in zip(HISTOGRAM_BOUNDS_MS + [np.inf], counts)
+                },
+            }
+
+        all_ms = np.concatenate([np.asarray(v) for v in self.latencies.values()]) * 1000
+        total_errors = sum(sum(e.values()) for e in self.errors.values())
+        total = len(all_ms) + total_errors
+        return {
+            'throughput_rps': round(len(all_ms) / elapsed, 2),
+            'error_rate': round(total_errors / total, 4) if total else 0.0,
+            'p50_ms': round(float(np.percentile(all_ms, 50)), 2) if len(all_ms) else None,
+            'p99_ms': round(float(np.percentile(all_ms, 99)), 2) if len(all_ms) else None,
+            'operations': per_op,
+        }
+
+
+class LoadGenerator:
+    def __init__(self, url: str, queries: List[str], mix: Dict[str, float], approve_ratio: float,
+                 top_k: int, seed: int):
+        self.url = url.rstrip("/")
+        self.queries = queries
+        self.mix = mix
+        self.approve_ratio = approve_ratio
+        self.top_k = top_k
+        self.rng = random.Random(seed)
+        # Токены созданных правок: из них берутся задачи для resolve
+        self.tokens: List[str] = []
+
+    def _choose(self) -> str:
+        op = self.rng.choices(list(self.mix), weights=list(self.mix.values()))[0]
+        if op == "resolve" and not self.tokens:
+            return "feedback"
+        return op
+
+    async def _request(self, client: httpx.AsyncClient, op: str) -> httpx.Response:
+        query = self.rng.choice(self.queries)
+        if op == "search":
+            return await client.post(f"{self.url}/api/search", json={'query': query, 'top_k': self.top_k})
+        if op == "feedback":
+            response = await client.post(f"{self.url}/api/feedback", json={
+                'original_question': query,
+                'old_answer': "",
+                'edited_answer': f"Нагрузочный тест: уточнённый ответ на вопрос «{query}»",
+                'note': "load test",
+            })
+            if response.status_code < 400:
+                self.tokens.append(response.json()['internal_token'])
+            return response
+        token = self.tokens.pop(self.rng.randrange(len(self.tokens)))
+        action = "approve" if self.rng.random() < self.approve_ratio else "reject"
+        return await client.post(f"{self.url}/api/moderation/resolve",
+                                 json={'internal_token': token, 'action': action})
+
+    async def _client_loop(self, client: httpx.AsyncClient, recorder: Recorder, deadline: float):
+        while time.perf_counter() < deadline:
+            op = self._choose()
+            start = time.perf_counter()
+            try:
+                status = (await self._request(client, op)).status_code
+            except httpx.HTTPError:
+                status = None
+            recorder.record(op, time.perf_counter() - start, status)
+
+    async def run_step(self, concurrency: int, duration: float) -> Dict:
+        limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+        async with httpx.AsyncClient(limits=limits, timeout=60) as client:
+            recorder = Recorder()
+            start = time.perf_counter()
+            deadline = start + duration
+            await asyncio.gather(*(self._client_loop(client, recorder, deadline) for _ in range(concurrency)))
+            return {'concurrency': concurrency, **recorder.summary(time.perf_counter() - start)}
+
+
+def find_saturation(steps: List[Dict], slo_p99_ms: float, max_error_rate: float,
+                    min_gain: float = 0.05) -> Dict:
+    """
+    Точка насыщения - последний уровень конкурентности, который ещё
+    увеличил пропускную способность не меньше чем на min_gain и уложился
+    в SLO по p99 и долю ошибок.
+    """
+    best = None
+    reason = "не достигнута в заданном диапазоне"
+    for step in steps:
+        if step['error_rate'] > max_error_rate:
+            reason = f"доля ошибок {step['error_rate']} при concurrency={step['concurrency']}"
+            break
+        if step['p99_ms'] is not None and step['p99_ms'] > slo_p99_ms:
+            reason = f"p99 {step['p99_ms']}ms > {slo_p99_ms}ms при concurrency={step['concurrency']}"
+            break
+        if best is not None and step['throughput_rps'] < best['throughput_rps'] * (1 + min_gain):
+            reason = f"прирост пропускной способности < {int(min_gain * 100)}% при concurrency={step['concurrency']}"
+            break
+        best = step
+    return {
+        'concurrency': best['concurrency'] if best else None,
+        'throughput_rps': best['throughput_rps'] if best else None,
+        'p99_ms': best['p99_ms'] if best else None,
+        'reason': reason,
+    }
+
+
+def _wait_ready(url: str, process: subprocess.Popen, timeout: float, consecutive: int = 1):
+    """Ждёт подряд consecutive ответов 200 (при нескольких воркерах /ready попадает в разные)"""
+    deadline = time.monotonic() + timeout
+    ok = 0
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Процесс {' '.join(process.args)} завершился с кодом {process.returncode}")
+        try:
+            ok = ok + 1 if httpx.get(url, timeout=2).status_code == 200 else 0
+        except httpx.HTTPError:
+            ok = 0
+        if ok >= consecutive:
+            return
+        time.sleep(0.2)
+    raise TimeoutError(f"{url} не ответил 200 за {timeout} с")
+
+
+@contextmanager
+def local_stack(workers: int, port: int, stub_port: int, stub_args: List[str], csv_path: str,
+                ready_timeout: float) -> Iterator[str]:
+    """llm_stub + uvicorn с workers воркерами во временном каталоге; отдаёт URL backend"""
+    workdir = tempfile.mkdtemp(prefix="rag-load-")
+    os.makedirs(os.path.join(workdir, "data"))
+    kb_path = os.path.join(workdir, "data", os.path.basename(csv_path))
+    shutil.copy(csv_path, kb_path)
+
+    env = {
+        **os.environ,
+        'API_KEY': os.environ.get('API_KEY', 'offline'),
+        'LLM_BASE_URL': f"http://127.0.0.1:{stub_port}/v1",
+        'KNOWLEDGE_BASE_PATH': kb_path,
+        'DATABASE_URL': f"sqlite+aiosqlite:///{os.path.join(workdir, 'data', 'feedback.db')}",
+        'PYTHONPATH': BACKEND_DIR + os.pathsep + os.environ.get('PYTHONPATH', ''),
+    }
+    processes = []
+    try:
+        processes.append(subprocess.Popen(
+            [sys.executable, "-m", "benchmark.llm_stub", "--port", str(stub_port), *stub_args],
+            cwd=BACKEND_DIR, env=env
+        ))
+        _wait_ready(f"http://127.0.0.1:{stub_port}/v1/models", processes[-1], ready_timeout)
+
+        processes.append(subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app.main:app", "--app-dir", BACKEND_DIR,
+             "--host", "127.0.0.1", "--port", str(port), "--workers", str(workers), "--log-level", "warning"],
+            cwd=workdir, env=env
+        ))
+        url = f"http://127.0.0.1:{port}"
+        _wait_ready(f"{url}/ready", processes[-1], ready_timeout, consecutive=3 * workers)
+        yield url
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def load_queries(csv_path: str) -> List[str]:
+    df = pd.read_csv(csv_path)
+    return df['Пример вопроса'].dropna().astype(str).tolist()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmark.load",
+                                     description="Нагрузочный тест /api/search, /api/feedback, /api/moderation/resolve")
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="уже запущенный backend")
+    parser.add_argument("--workers", type=int, nargs="*",
+                        help="поднять локальный стек с этим числом воркеров uvicorn (можно несколько)")
+    parser.add_argument("--port", type=int, default=8200, help="порт локального backend")
+    parser.add_argument("--stub-port", type=int, default=8100)
+    parser.add_argument("--stub-latency-ms", type=float, default=30.0)
+    parser.add_argument("--stub-error-rate", type=float, default=0.0)
+    parser.add_argument("--stub-rate-limit", type=float, default=0.0)
+    parser.add_argument("--csv", default=DEFAULT_CSV, help="источник вопросов (и БЗ локального стека)")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("search=90,feedback=8,resolve=2"))
+    parser.add_argument("--approve-ratio", type=float, default=0.2,
+                        help="доля approve среди resolve (approve переиндексирует строку)")
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32, 64])
+    parser.add_argument("--duration", type=float, default=15.0, help="секунд на уровень конкурентности")
+    parser.add_argument("--slo-p99-ms", type=float, default=100.0)
+    parser.add_argument("--max-error-rate", type=float, default=0.01)
+    parser.add_argument("--ready-timeout", type=float, default=300.0)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", default="benchmark_results/load.json")
+    args = parser.parse_args(argv)
+
+    queries = load_queries(args.csv)
+    stub_args = ["--latency-ms", str(args.stub_latency_ms),
+                 "--error-rate", str(args.stub_error_rate),
+                 "--rate-limit", str(args.stub_rate_limit)]
+
+    def sweep(url: str) -> Dict:
+        generator = LoadGenerator(url, queries, args.mix, args.approve_ratio, args.top_k, args.seed)
+        steps = []
+        for concurrency in args.concurrency:
+            step = asyncio.run(generator.run_step(concurrency, args.duration))
+            steps.append(step)
+            print(f"concurrency={concurrency}: {step['throughput_rps']} req/s, "
+                  f"p50={step['p50_ms']}ms p99={step['p99_ms']}ms ошибки={step['error_rate']}")
+        saturation = find_saturation(steps, args.slo_p99_ms, args.max_error_rate)
+        print(f"Насыщение: concurrency={saturation['concurrency']}, "
+              f"{saturation['throughput_rps']} req/s ({saturation['reason']})")
+        return {'steps': steps, 'saturation': saturation}
+
+    runs = []
+    if args.workers:
+        for workers in args.workers:
+            print(f"=== uvicorn --workers {workers} ===")
+            with local_stack(workers, args.port, args.stub_port, stub_args, args.csv, args.ready_timeout) as url:
+                runs.append({'workers': workers, 'url': url, **sweep(url)})
+    else:
+        runs.append({'workers': None, 'url': args.url, **sweep(args.url)})
+
+    report = {
+        'meta': {
+            'created_at': time.strftime("%Y-%m-%dT%H:%M:%S"),
+            'mix': args.mix,
+            'approve_ratio': args.approve_ratio,
+            'duration_seconds': args.duration,
+            'slo_p99_ms': args.slo_p99_ms,
+            'stub': {
+                'latency_ms': args.stub_latency_ms,
+                'error_rate': args.stub_error_rate,
+                'rate_limit': args.stub_rate_limit,
+            } if args.workers else None,
+        },
+        'runs': runs,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+    with open(args.out, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Результаты сохранены в {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,57 @@
+import asyncio
+import time
+import zlib
+import numpy as np
+from typing import List
+from app.embeddings import BGEM3Embeddings
+from app.indexes import normalize_query
+
+
+def hashing_vector(text: str, dim: int = 384) -> List[float]:
+    """
+    Детерминированный эмбеддинг без модели: feature hashing слов и символьных
+    3-грамм со знаком, sqrt-взвешивание частот, L2-нормировка.
+
+    Похожие по лексике тексты получают близкие векторы, поэтому
+    качество гибридного поиска остаётся осмысленным.
+    """
+    normalized = normalize_query(text)
+    padded = f" {normalized} "
+    features = normalized.split() + [padded[i:i + 3] for i in range(len(padded) - 2)]
+
+    vector = np.zeros(dim, dtype=np.float32)
+    for feature in features:
+        h = zlib.crc32(feature.encode("utf-8"))
+        vector[h % dim] += 1.0 if (h >> 16) & 1 else -1.0
+    vector = np.sign(vector) * np.sqrt(np.abs(vector))
+
+    norm = np.linalg.norm(vector)
+    if norm:
+        vector /= norm
+    return vector.tolist()
+
+
+class HashingEmbeddings(BGEM3Embeddings):
+    """
+    BGEM3Embeddings с подменой HTTP-вызовов на hashing_vector.
+
+    Кэш, батчинг документов и склейка запросов работают как в проде;
+    latency_ms имитирует время ответа API на один батч.
+    """
+
+    def __init__(self, dim: int = 384, latency_ms: float = 0.0, **kwargs):
+        kwargs.setdefault("api_key", "offline")
+        kwargs.setdefault("model", f"hashing-{dim}")
+        super().__init__(**kwargs)
+        self.dim = dim
+        self.latency = latency_ms / 1000
+
+    def _post_batch(self, texts):
+        if self.latency:
+            time.sleep(self.latency)
+        return [hashing_vector(text, self.dim) for text in texts]
+
+    async def _apost_batch(self, texts):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return [hashing_vector(text, self.dim) for text in texts]
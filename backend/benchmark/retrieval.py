@@ -0,0 +1,166 @@
+import os
+import sys
+import time
+import asyncio
+import resource
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Set, Tuple
+
+# Бенчмарк не обращается к API, но Settings требует ключ
+os.environ.setdefault("API_KEY", "offline")
+
+from app.config import settings
+from app.embedding_cache import EmbeddingCache
+from app.kb_store import CSV_COLUMNS, KnowledgeBaseStore
+from app.ranker import HybridRanker
+from app.rag_service import RAGService
+from benchmark.offline_embeddings import HashingEmbeddings
+
+
+RECALL_AT = (1, 3, 5, 10)
+
+
+def load_ground_truth(csv_path: str) -> Tuple[pd.DataFrame, List[Tuple[str, Set[str]]]]:
+    """
+    Делит CSV на базу знаний (is_original=True) и запросы (is_original=False).
+
+    Для каждого запроса релевантны все исходные строки с тем же шаблонным
+    ответом; запросы, ответа которых нет среди исходных строк, отбрасываются.
+    """
+    df = pd.read_csv(csv_path).rename(columns=CSV_COLUMNS).dropna(subset=['question', 'answer'])
+    original = df['is_original'].astype(str).str.lower() == 'true'
+    kb = df[original].reset_index(drop=True)
+
+    questions_by_answer: Dict[str, Set[str]] = {}
+    for question, answer in zip(kb['question'], kb['answer']):
+        questions_by_answer.setdefault(answer, set()).add(question)
+
+    queries = [
+        (question, questions_by_answer[answer])
+        for question, answer in zip(df.loc[~original, 'question'], df.loc[~original, 'answer'])
+        if answer in questions_by_answer
+    ]
+    return kb, queries
+
+
+def peak_rss_mb() -> float:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux отдаёт килобайты, macOS - байты
+    return round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def latency_summary(latencies: List[float]) -> Dict:
+    ms = np.asarray(latencies) * 1000
+    return {
+        'mean': round(float(ms.mean()), 3),
+        'p50': round(float(np.percentile(ms, 50)), 3),
+        'p90': round(float(np.percentile(ms, 90)), 3),
+        'p95': round(float(np.percentile(ms, 95)), 3),
+        'p99': round(float(np.percentile(ms, 99)), 3),
+        'max': round(float(ms.max()), 3),
+    }
+
+
+async def _evaluate(service: RAGService, queries: List[Tuple[str, Set[str]]], top_k: int,
+                    warmup: int) -> Dict:
+    for question, _ in queries[:warmup]:
+        await service.search(question, top_k)
+
+    latencies, ranks, paths = [], [], {}
+    for question, relevant in queries:
+        start = time.perf_counter()
+        result = await service.search(question, top_k)
+        latencies.append(time.perf_counter() - start)
+
+        rank = None
+        for position, meta in enumerate(result['results_meta'], start=1):
+            if meta['question'] in relevant:
+                rank = position
+                break
+        ranks.append(rank)
+        path = result['results_meta'][0]['path'] if result['results_meta'] else 'empty'
+        paths[path] = paths.get(path, 0) + 1
+
+    n = len(queries)
+    return {
+        **{f'recall@{k}': round(sum(1 for r in ranks if r and r <= k) / n, 4)
+           for k in RECALL_AT if k <= top_k},
+        'mrr': round(sum(1 / r for r in ranks if r) / n, 4),
+        'latency_ms': latency_summary(latencies),
+        'paths': paths,
+    }
+
+
+def run_chunk_size(params: Dict) -> List[Dict]:
+    """
+    Один размер чанка: строит индекс и прогоняет сетку весов и TOP_K.
+
+    Запускается в отдельном процессе, чтобы время сборки и пиковый RSS
+    не зависели от предыдущих конфигураций.
+    """
+    settings.CHUNK_SIZE = params['chunk_size']
+    settings.CHUNK_OVERLAP = min(settings.CHUNK_OVERLAP, params['chunk_size'] // 2)
+    # Кэши результатов и эмбеддингов запросов выключены: меряем сам поиск
+    settings.RESULT_CACHE_SIZE = 0
+    settings.QUERY_EMBEDDING_CACHE_SIZE = 0
+    settings.QUESTION_FAST_PATH = params['fast_path']
+
+    kb, queries = load_ground_truth(params['csv_path'])
+    if params.get('limit'):
+        queries = queries[:params['limit']]
+
+    service = RAGService()
+    service.kb = KnowledgeBaseStore(":memory:")
+    service.kb.import_frame(kb)
+    service.embedding_cache = EmbeddingCache(":memory:")
+    service.embeddings = HashingEmbeddings(
+        dim=params['dim'],
+        latency_ms=params['embedding_latency_ms'],
+        cache=service.embedding_cache,
+        query_batch_window_ms=settings.EMBEDDING_BATCH_WINDOW_MS,
+        max_query_batch=settings.EMBEDDING_MAX_QUERY_BATCH
+    )
+
+    start = time.perf_counter()
+    index = service._build_indices()
+    build_seconds = time.perf_counter() - start
+    service.indices.publish(index)
+    build_rss = peak_rss_mb()
+
+    async def evaluate_grid() -> List[Dict]:
+        rows = []
+        for fusion in params['fusion_methods']:
+            for bm25_weight, vector_weight in params['weights']:
+                service.ranker = HybridRanker(
+                    method=fusion,
+                    bm25_weight=bm25_weight,
+                    vector_weight=vector_weight,
+                    rrf_k=settings.RRF_K,
+                    candidates=settings.HYBRID_CANDIDATES
+                )
+                for top_k in params['top_k']:
+                    metrics = await _evaluate(service, queries, top_k, params['warmup'])
+                    rows.append({
+                        'chunk_size': params['chunk_size'],
+                        'fusion': fusion,
+                        'bm25_weight': bm25_weight,
+                        'vector_weight': vector_weight,
+                        'top_k': top_k,
+                        'fast_path': params['fast_path'],
+                        'num_chunks': len(index),
+                        'num_queries': len(queries),
+                        'build_seconds': round(build_seconds, 4),
+                        'build_peak_rss_mb': build_rss,
+                        **metrics,
+                    })
+                    print(f"chunk_size={params['chunk_size']} {fusion} "
+                          f"w={bm25_weight}/{vector_weight} top_k={top_k}: "
+                          f"mrr={metrics['mrr']} p95={metrics['latency_ms']['p95']}ms")
+        await service.close()
+        return rows
+
+    rows = asyncio.run(evaluate_grid())
+    for row in rows:
+        row['peak_rss_mb'] = peak_rss_mb()
+    return rows
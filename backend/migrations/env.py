@@ -0,0 +1,50 @@
+import asyncio
+from logging.config import fileConfig
+from sqlalchemy.engine import Connection
+from alembic import context
+from app.database import Base, database_url, engine
+
+
+config = context.config
+target_metadata = Base.metadata
+
+
+def do_run_migrations(connection: Connection):
+    context.configure(
+        connection=connection,
+        target_metadata=target_metadata,
+        # SQLite не умеет ALTER большинства конструкций - пересборка таблицы
+        render_as_batch=connection.dialect.name == "sqlite",
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+async def run_async_migrations():
+    async with engine.connect() as connection:
+        await connection.run_sync(do_run_migrations)
+    await engine.dispose()
+
+
+def run_migrations_offline():
+    """alembic upgrade head --sql: SQL-скрипт без подключения к базе"""
+    context.configure(
+        url=database_url(),
+        target_metadata=target_metadata,
+        literal_binds=True,
+        dialect_opts={"paramstyle": "named"},
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+# init_db() передаёт открытое соединение приложения; CLI alembic подключается сам
+connection = config.attributes.get("connection")
+if connection is not None:
+    do_run_migrations(connection)
+elif context.is_offline_mode():
+    run_migrations_offline()
+else:
+    if config.config_file_name is not None:
+        fileConfig(config.config_file_name)
+    asyncio.run(run_async_migrations())
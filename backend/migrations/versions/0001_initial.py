@@ -0,0 +1,49 @@
+"""Исходная схема: правки операторов и очередь новых вопросов
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18
+
+Базы, созданные до Alembic через create_all, помечаются этой ревизией
+без выполнения (см. app.database.init_db).
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "feedback_items",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("internal_token", sa.String(255), nullable=False, unique=True),
+        sa.Column("original_question", sa.Text(), nullable=False),
+        sa.Column("old_answer", sa.Text(), nullable=False),
+        sa.Column("edited_answer", sa.Text(), nullable=False),
+        sa.Column("note", sa.Text(), nullable=True),
+        sa.Column("status", sa.String(50), nullable=False),
+        sa.Column("suggested_by", sa.String(255), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.Column("resolved_at", sa.DateTime(), nullable=True),
+    )
+    op.create_table(
+        "qa_queue",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("question", sa.Text(), nullable=False),
+        sa.Column("answer", sa.Text(), nullable=False),
+        sa.Column("category", sa.String(255), nullable=False),
+        sa.Column("subcategory", sa.String(255), nullable=False),
+        sa.Column("subtopic", sa.String(255), nullable=True),
+        sa.Column("status", sa.String(50), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+    )
+
+
+def downgrade():
+    op.drop_table("qa_queue")
+    op.drop_table("feedback_items")
@@ -0,0 +1,43 @@
+"""Индексы очереди модерации и таблица счётчиков
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18
+
+До Alembic индексы и moderation_counters создавались через create_all,
+поэтому миграция пропускает уже существующие объекты.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+INDEXES = {
+    "ix_feedback_items_status_created": "feedback_items",
+    "ix_qa_queue_status_created": "qa_queue",
+}
+
+
+def upgrade():
+    # В режиме --sql подключения нет: скрипт создаёт всё безусловно
+    inspector = None if op.get_context().as_sql else sa.inspect(op.get_bind())
+    for name, table in INDEXES.items():
+        if inspector is None or name not in {index['name'] for index in inspector.get_indexes(table)}:
+            op.create_index(name, table, ["status", "created_at", "id"])
+    if inspector is None or not inspector.has_table("moderation_counters"):
+        op.create_table(
+            "moderation_counters",
+            sa.Column("name", sa.String(255), primary_key=True),
+            sa.Column("value", sa.Float(), nullable=False),
+        )
+
+
+def downgrade():
+    op.drop_table("moderation_counters")
+    for name, table in INDEXES.items():
+        op.drop_index(name, table_name=table)
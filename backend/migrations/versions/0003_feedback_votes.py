@@ -0,0 +1,24 @@
+"""Голоса за правку: одинаковые правки схлопываются в одну
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("feedback_items") as batch:
+        batch.add_column(sa.Column("votes", sa.Integer(), nullable=False, server_default="1"))
+
+
+def downgrade():
+    with op.batch_alter_table("feedback_items") as batch:
+        batch.drop_column("votes")
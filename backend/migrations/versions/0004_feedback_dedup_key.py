@@ -0,0 +1,56 @@
+"""Ключ правки: одна правка на модерации на (вопрос, исправленный ответ)
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18
+
+Ключ уже существующих правок на модерации считается здесь же. Если
+одинаковых правок несколько, ключ получает самая ранняя, голоса остальных
+не переносятся - они остаются отдельными правками.
+"""
+import hashlib
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+PENDING = sa.text("status = 'pending'")
+
+
+def dedup_key(original_question: str, edited_answer: str) -> str:
+    # Копия FeedbackWriter.dedup_key на момент миграции
+    return hashlib.sha256(f"{original_question.strip()}\0{edited_answer.strip()}".encode("utf-8")).hexdigest()
+
+
+def upgrade():
+    with op.batch_alter_table("feedback_items") as batch:
+        batch.add_column(sa.Column("dedup_key", sa.String(64), nullable=True))
+
+    if not op.get_context().as_sql:
+        bind = op.get_bind()
+        rows = bind.execute(sa.text(
+            "SELECT id, original_question, edited_answer FROM feedback_items "
+            "WHERE status = 'pending' ORDER BY created_at, id"
+        )).fetchall()
+        seen = set()
+        for row_id, question, answer in rows:
+            key = dedup_key(question, answer)
+            if key in seen:
+                continue
+            seen.add(key)
+            bind.execute(sa.text("UPDATE feedback_items SET dedup_key = :key WHERE id = :id"),
+                         {'key': key, 'id': row_id})
+
+    op.create_index("ix_feedback_items_pending_dedup", "feedback_items", ["dedup_key"], unique=True,
+                    sqlite_where=PENDING, postgresql_where=PENDING)
+
+
+def downgrade():
+    op.drop_index("ix_feedback_items_pending_dedup", table_name="feedback_items")
+    with op.batch_alter_table("feedback_items") as batch:
+        batch.drop_column("dedup_key")
@@ -0,0 +1,45 @@
+"""Время решения пар из очереди QA
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18
+
+Если счётчики модерации уже заполнены (app.moderation.backfill_counters),
+к ним добавляются уже решённые пары QA - без времени решения, его не
+сохраняли.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("qa_queue") as batch:
+        batch.add_column(sa.Column("resolved_at", sa.DateTime(), nullable=True))
+
+    if op.get_context().as_sql:
+        return
+    bind = op.get_bind()
+    initialized = bind.execute(sa.text(
+        "SELECT 1 FROM moderation_counters WHERE name = 'counters:initialized'"
+    )).first()
+    if initialized is None:
+        return
+    rows = bind.execute(sa.text(
+        "SELECT status, COUNT(*) FROM qa_queue WHERE status != 'pending' GROUP BY status"
+    )).fetchall()
+    for status, total in rows:
+        bind.execute(sa.text(
+            "INSERT INTO moderation_counters (name, value) VALUES (:name, :value) "
+            "ON CONFLICT (name) DO UPDATE SET value = moderation_counters.value + excluded.value"
+        ), {'name': f"qa:{status}", 'value': total})
+
+
+def downgrade():
+    with op.batch_alter_table("qa_queue") as batch:
+        batch.drop_column("resolved_at")
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# Settings требует ключ API; тесты к API не обращаются
+os.environ.setdefault("API_KEY", "test")
+os.environ.setdefault("DB_AUTO_MIGRATE", "false")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,146 @@
+import asyncio
+import pytest
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from app.database import Base, FeedbackItem, ModerationCounter
+from app.feedback_queue import FeedbackWriter
+
+
+@pytest.fixture
+def session_maker(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'feedback.db'}")
+
+    async def create():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+
+    asyncio.run(create())
+    yield async_sessionmaker(engine, expire_on_commit=False)
+    asyncio.run(engine.dispose())
+
+
+def writer(session_maker, **kwargs) -> FeedbackWriter:
+    return FeedbackWriter(session_maker, flush_interval=0.01, **kwargs)
+
+
+async def feedback_rows(session_maker):
+    async with session_maker() as session:
+        rows = await session.execute(select(FeedbackItem).order_by(FeedbackItem.id))
+        return rows.scalars().all()
+
+
+async def counter(session_maker, name: str) -> float:
+    async with session_maker() as session:
+        item = await session.get(ModerationCounter, name)
+        return item.value if item else 0
+
+
+def test_two_writers_share_pending_item(session_maker):
+    """Одна и та же правка через два воркера - одна правка на модерации с двумя голосами"""
+    async def scenario():
+        first, second = writer(session_maker), writer(session_maker)
+        token, merged = await first.submit("Как сменить тариф?", "старый", "В приложении")
+        await first.flush()
+        other, other_merged = await second.submit(" Как сменить тариф? ", "старый", "В приложении ")
+        await second.flush()
+        # Повтор после записи во втором воркере - голос той же правки
+        await second.submit("Как сменить тариф?", "старый", "В приложении")
+        await second.flush()
+        await first.close()
+        await second.close()
+
+        rows = await feedback_rows(session_maker)
+        assert not merged and not other_merged
+        assert [(row.internal_token, row.votes, row.status) for row in rows] == [(token, 3, "pending")]
+        assert await counter(session_maker, "feedback:pending") == 1
+
+    asyncio.run(scenario())
+
+
+def test_concurrent_writers(session_maker):
+    """Воркеры пишут одинаковые правки одновременно: гонку разрешает уникальный индекс и повтор записи"""
+    async def scenario():
+        writers = [writer(session_maker) for _ in range(4)]
+        for w in writers:
+            await w.submit("Вопрос", "старый", "новый")
+        # Фоновые записи идут параллельно; close() дожидается, пока каждая дойдёт до базы
+        await asyncio.gather(*(w.close() for w in writers))
+
+        rows = await feedback_rows(session_maker)
+        assert [(row.status, row.votes) for row in rows] == [("pending", 4)]
+        assert await counter(session_maker, "feedback:pending") == 1
+
+    asyncio.run(scenario())
+
+
+def test_duplicate_of_resolved_item_is_new(session_maker):
+    """Правка, решённая другим воркером, не получает голосов - повтор становится новой правкой"""
+    async def scenario():
+        first, second = writer(session_maker), writer(session_maker)
+        token, _ = await first.submit("Вопрос", "старый", "новый")
+        await first.flush()
+        async with session_maker() as session:
+            await session.execute(
+                update(FeedbackItem).where(FeedbackItem.internal_token == token).values(status="rejected")
+            )
+            await session.commit()
+        _, merged = await first.submit("Вопрос", "старый", "новый")
+        await second.submit("Вопрос", "старый", "новый")
+        await first.flush()
+        await second.flush()
+        await first.close()
+        await second.close()
+
+        rows = await feedback_rows(session_maker)
+        assert merged
+        assert [(row.status, row.votes) for row in rows] == [("rejected", 1), ("pending", 2)]
+
+    asyncio.run(scenario())
+
+
+def test_unique_pending_dedup_key(session_maker):
+    """Вторую правку на модерации с тем же ключом база не пропускает, решённую - пропускает"""
+    async def scenario():
+        dedup_key = FeedbackWriter.dedup_key("Вопрос", "ответ")
+        row = dict(original_question="Вопрос", old_answer="", edited_answer="ответ", dedup_key=dedup_key)
+        async with session_maker() as session:
+            session.add(FeedbackItem(internal_token="a", status="rejected", **row))
+            session.add(FeedbackItem(internal_token="b", status="pending", **row))
+            await session.commit()
+            session.add(FeedbackItem(internal_token="c", status="pending", **row))
+            with pytest.raises(IntegrityError):
+                await session.commit()
+
+    asyncio.run(scenario())
+
+
+def test_spill_keeps_votes(session_maker, tmp_path):
+    """Голоса, не записанные при остановке, переживают перезапуск через spill-файл"""
+    spill_path = str(tmp_path / "spill.jsonl")
+
+    def unavailable():
+        raise ConnectionError("база недоступна")
+
+    async def scenario():
+        first = writer(session_maker, spill_path=spill_path)
+        first.DRAIN_ATTEMPTS = 1
+        token, _ = await first.submit("Вопрос", "старый", "новый")
+        await first.flush()
+        await first.close()
+
+        first._session_maker = unavailable
+        _, merged = await first.submit("Вопрос", "старый", "новый")
+        await first.submit("Другой вопрос", "старый", "новый")
+        await first.close()
+        assert merged
+
+        second = writer(session_maker, spill_path=spill_path)
+        second.start()
+        await second.flush()
+        await second.close()
+
+        rows = await feedback_rows(session_maker)
+        assert [(row.internal_token == token, row.votes) for row in rows] == [(True, 2), (False, 1)]
+
+    asyncio.run(scenario())
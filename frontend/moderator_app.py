@@ -12,10 +12,16 @@ st.set_page_config(
 
 st.title("👨‍⚖️ RAG Support - Moderator Panel")
 
-def get_pending_items():
+PAGE_SIZE = 20
+
+def get_pending_items(cursor=None, filters=None):
+    params = {"limit": PAGE_SIZE, **(filters or {})}
+    if cursor:
+        params["cursor"] = cursor
     try:
         response = requests.get(
             f"{API_BASE_URL}/api/moderation/pending",
+            params=params,
             timeout=API_TIMEOUT
         )
         response.raise_for_status()
@@ -40,6 +46,29 @@ def resolve_feedback(internal_token, action):
         st.error(f"Ошибка обработки: {str(e)}")
         return None
 
+def resolve_batch(internal_tokens, action):
+    try:
+        response = requests.post(
+            f"{API_BASE_URL}/api/moderation/resolve/batch",
+            json={
+                "items": [{"internal_token": token, "action": action} for token in internal_tokens]
+            },
+            timeout=API_TIMEOUT
+        )
+        response.raise_for_status()
+        return response.json()
+    except Exception as e:
+        st.error(f"Ошибка обработки: {str(e)}")
+        return None
+
+def get_index_status():
+    try:
+        response = requests.get(f"{API_BASE_URL}/api/index/status", timeout=5)
+        response.raise_for_status()
+        return response.json()
+    except Exception:
+        return None
+
 def get_stats():
     try:
         response = requests.get(
@@ -58,6 +87,22 @@ if stats:
     st.sidebar.metric("Ожидает модерации", stats.get("total_pending", 0))
     st.sidebar.metric("Принято", stats.get("total_approved", 0))
     st.sidebar.metric("Отклонено", stats.get("total_rejected", 0))
+    st.sidebar.metric("Среднее время решения", stats.get("avg_response_time", "N/A"))
+    if stats.get("operator_activity"):
+        with st.sidebar.expander("Активность операторов"):
+            for operator, activity in stats["operator_activity"].items():
+                st.write(
+                    f"**{operator}**: предложено {activity['submitted']}, "
+                    f"принято {activity['approved']}, отклонено {activity['rejected']}"
+                )
+
+index_status = get_index_status()
+if index_status:
+    st.sidebar.caption(
+        f"Индекс: версия {index_status['index_version']}, "
+        f"в очереди правок: {index_status['queued_changes']}"
+        + (f", идёт обновление ({index_status['running_stage']})" if index_status['running_jobs'] else "")
+    )
 
 st.sidebar.divider()
 
@@ -71,6 +116,28 @@ try:
 except:
     st.sidebar.error("❌ API недоступен")
 
+st.sidebar.divider()
+
+st.sidebar.header("🔎 Фильтры")
+source_label = st.sidebar.selectbox("Источник", ["Все", "Правки операторов", "Новые вопросы"])
+suggested_by = st.sidebar.text_input("Автор правки")
+category = st.sidebar.text_input("Категория (новые вопросы)")
+
+filters = {}
+if source_label == "Правки операторов":
+    filters["source"] = "feedback"
+elif source_label == "Новые вопросы":
+    filters["source"] = "qa"
+if suggested_by:
+    filters["suggested_by"] = suggested_by
+if category:
+    filters["category"] = category
+
+# Курсоры просмотренных страниц: назад - снять верхний, вперёд - добавить next_cursor
+if st.session_state.get("filters") != filters:
+    st.session_state.filters = filters
+    st.session_state.cursors = [None]
+
 if st.button("🔄 Обновить список", type="primary"):
     st.rerun()
 
@@ -78,19 +145,41 @@ st.divider()
 
 st.header("📋 Список на модерации")
 
-pending_data = get_pending_items()
+page = len(st.session_state.cursors)
+pending_data = get_pending_items(st.session_state.cursors[-1], filters)
 
 if pending_data and pending_data.get("items"):
     items = pending_data["items"]
-    st.info(f"Всего правок на модерации: {len(items)}")
+    offset = (page - 1) * PAGE_SIZE
+    st.info(f"Страница {page}: правки {offset + 1}-{offset + len(items)}")
     
-    for idx, item in enumerate(items, 1):
-        with st.expander(f"#{idx} - {item['original_question'][:80]}...", expanded=True):
+    page_tokens = [item['internal_token'] for item in items]
+    col_all_approve, col_all_reject = st.columns(2)
+    with col_all_approve:
+        if st.button("✅ Принять все на странице", use_container_width=True):
+            with st.spinner("Применяю изменения..."):
+                result = resolve_batch(page_tokens, "approve")
+            if result:
+                st.success(f"✅ Принято: {sum(r['status'] == 'applied' for r in result['items'])}. "
+                           f"База знаний обновляется (задание {result.get('job_id')})")
+                st.rerun()
+    with col_all_reject:
+        if st.button("❌ Отклонить все на странице", use_container_width=True):
+            result = resolve_batch(page_tokens, "reject")
+            if result:
+                st.warning(f"❌ Отклонено: {sum(r['status'] == 'rejected' for r in result['items'])}")
+                st.rerun()
+    
+    for idx, item in enumerate(items, offset + 1):
+        votes = f" (голосов: {item['votes']})" if item.get('votes', 1) > 1 else ""
+        with st.expander(f"#{idx} - {item['original_question'][:80]}...{votes}", expanded=True):
             col1, col2 = st.columns([3, 1])
             
             with col1:
                 st.write(f"**Токен:** `{item['internal_token']}`")
                 st.write(f"**Дата создания:** {item['created_at']}")
+                if item.get('category'):
+                    st.write(f"**Категория:** {item['category']} / {item.get('subcategory') or ''}")
                 if item.get('suggested_by'):
                     st.write(f"**Предложил:** {item['suggested_by']}")
                 
@@ -105,7 +194,7 @@ if pending_data and pending_data.get("items"):
                     value=item['old_answer'], 
                     height=120, 
                     disabled=True,
-                    key=f"old_{idx}"
+                    key=f"old_{item['internal_token']}"
                 )
                 
                 st.write("**Предложенный новый ответ:**")
@@ -114,7 +203,7 @@ if pending_data and pending_data.get("items"):
                     value=item['edited_answer'], 
                     height=120, 
                     disabled=True,
-                    key=f"new_{idx}"
+                    key=f"new_{item['internal_token']}"
                 )
             
             with col2:
@@ -122,24 +211,37 @@ if pending_data and pending_data.get("items"):
                 st.write("")
                 st.write("")
                 
-                if st.button("✅ Принять", key=f"approve_{idx}", type="primary", use_container_width=True):
+                if st.button("✅ Принять", key=f"approve_{item['internal_token']}", type="primary", use_container_width=True):
                     with st.spinner("Применяю изменения..."):
                         result = resolve_feedback(item['internal_token'], "approve")
                         if result:
                             if result.get("reembedded"):
                                 st.success("✅ Изменения применены! База знаний обновлена.")
                             else:
-                                st.success("✅ Изменения применены!")
+                                st.success("✅ Изменения применены! База знаний обновляется в фоне.")
                             st.balloons()
                             st.rerun()
                 
-                if st.button("❌ Отклонить", key=f"reject_{idx}", use_container_width=True):
+                if st.button("❌ Отклонить", key=f"reject_{item['internal_token']}", use_container_width=True):
                     result = resolve_feedback(item['internal_token'], "reject")
                     if result:
                         st.warning("❌ Правка отклонена")
                         st.rerun()
             
             st.divider()
+    
+    col_prev, col_next = st.columns(2)
+    with col_prev:
+        if page > 1 and st.button("⬅️ Предыдущая страница", use_container_width=True):
+            st.session_state.cursors.pop()
+            st.rerun()
+    with col_next:
+        if pending_data.get("next_cursor") and st.button("Следующая страница ➡️", use_container_width=True):
+            st.session_state.cursors.append(pending_data["next_cursor"])
+            st.rerun()
+elif page > 1:
+    st.session_state.cursors = [None]
+    st.rerun()
 else:
     st.success("✅ Нет правок на модерации!")
     st.balloons()
@@ -18,6 +18,10 @@ def search_api(query, top_k=3):
             json={"query": query, "top_k": top_k},
             timeout=API_TIMEOUT
         )
+        if response.status_code == 503:
+            retry_after = response.headers.get("Retry-After", "5")
+            st.warning(f"⏳ База знаний ещё загружается, повторите через {retry_after} сек.")
+            return None
         response.raise_for_status()
         return response.json()
     except Exception as e:
@@ -110,7 +114,9 @@ with col1:
                             note=None
                         )
                     
-                    if feedback_result:
+                    if feedback_result and feedback_result.get("merged"):
+                        st.success("✅ Такая правка уже ждёт модерации - ваш голос учтён!")
+                    elif feedback_result:
                         st.success("✅ Жалоба отправлена на модерацию!")
                         st.balloons()
 